@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark the import extractor on large generated modules.
+
+Times ``_get_imports`` on modules of 12.5k, 25k and 50k lines and checks
+that the scan time grows linearly with the size of the module.
+
+Usage:
+    python benchmarks/bench_dynamic_imports.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod2pip import mod2pip  # noqa: E402
+
+# Each block is 20 lines and mixes every construct the extractor handles.
+BLOCK = '''\
+import os
+from collections import OrderedDict
+name_{i} = "requests"
+mod_{i} = __import__(name_{i})
+importlib.import_module("yaml" + ".loader")
+
+
+def func_{i}(value):
+    """Docstring mentioning import json inside a try: block."""
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    data = {{"key": "flask", "other": "django"}}
+    exec("import pandas")
+    return value, data, np
+
+
+class Class_{i}(object):
+    attribute = f"{{name_{i}}}-{i}"
+'''
+
+# Allowed growth of the time per line between the smallest and the
+# largest module before the scan is considered non-linear.
+MAX_RATIO = 2.0
+
+
+def generate_module(lines):
+    """Return the source of a generated module of about ``lines`` lines."""
+    blocks = max(1, lines // BLOCK.count("\n"))
+    return "import importlib\n" + "".join(BLOCK.format(i=i) for i in range(blocks))
+
+
+def time_scan(contents, repeat):
+    """Return the best of ``repeat`` timings of one extraction."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mod2pip._get_imports(contents)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines", type=int, default=50000,
+                        help="lines of the largest module (default: 50000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timings per size, the best is kept (default: 3)")
+    args = parser.parse_args()
+
+    sizes = [args.lines // 4, args.lines // 2, args.lines]
+    per_line = []
+    print(f"{'lines':>8} {'bytes':>10} {'seconds':>9} {'us/line':>8}")
+    for lines in sizes:
+        contents = generate_module(lines)
+        elapsed = time_scan(contents, args.repeat)
+        actual = contents.count("\n")
+        per_line.append(elapsed / actual)
+        print(f"{actual:>8} {len(contents):>10} {elapsed:>9.3f} {per_line[-1] * 1e6:>8.2f}")
+
+    ratio = per_line[-1] / per_line[0]
+    print(f"time per line ratio (largest / smallest): {ratio:.2f}")
+    if ratio > MAX_RATIO:
+        print(f"FAIL: scan time is not linear (ratio > {MAX_RATIO})")
+        return 1
+    print("OK: scan time is linear")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
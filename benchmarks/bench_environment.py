@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Benchmark the discovery of installed packages on a synthetic environment.
+
+Builds a fake site-packages with dist-info distributions, egg-links and
+PEP 420 namespace directories, plus a fake ``CONDA_PREFIX/conda-meta``,
+and times every ``_get_*_packages`` source, ``get_locally_installed_packages``
+and ``get_import_local`` end to end. The environment is selected through
+``sys.path`` and ``CONDA_PREFIX`` only, so the same script can time older
+mod2pip versions. ``--output`` saves the results, ``--compare`` prints the
+speedup against a saved run.
+
+Usage:
+    python benchmarks/bench_environment.py [--distributions N] [--egg-links N]
+                                           [--namespaces N] [--conda-packages N]
+                                           [--repeat N] [--output FILE]
+                                           [--compare FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_environment  # noqa: E402
+from mod2pip import __version__, mod2pip  # noqa: E402
+
+STAGES = {
+    "pip": lambda imports: mod2pip._get_pip_packages(),
+    "conda": lambda imports: mod2pip._get_conda_packages(),
+    "editable": lambda imports: mod2pip._get_editable_packages(),
+    "namespace": lambda imports: mod2pip._get_namespace_packages(),
+    "installed": lambda imports: mod2pip.get_locally_installed_packages(),
+    "import_local": lambda imports: mod2pip.get_import_local(imports),
+}
+
+
+def time_stage(func, imports, site, conda_prefix, repeat):
+    """Return the best of ``repeat`` timings of ``func`` run against the
+    synthetic environment, and the number of packages it returned."""
+    saved_path, saved_prefix = sys.path[:], os.environ.get("CONDA_PREFIX")
+    sys.path[:] = [site]
+    os.environ["CONDA_PREFIX"] = conda_prefix
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(imports)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        sys.path[:] = saved_path
+        if saved_prefix is None:
+            os.environ.pop("CONDA_PREFIX", None)
+        else:
+            os.environ["CONDA_PREFIX"] = saved_prefix
+    return best, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--distributions", type=int, default=2000,
+                        help="number of dist-info distributions (default: 2000)")
+    parser.add_argument("--egg-links", type=int, default=100,
+                        help="number of editable installs (default: 100)")
+    parser.add_argument("--namespaces", type=int, default=100,
+                        help="number of namespace packages (default: 100)")
+    parser.add_argument("--conda-packages", type=int, default=500,
+                        help="number of conda-meta records (default: 500)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timings per stage, the best is kept (default: 3)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="print the speedup against the results in FILE")
+    args = parser.parse_args()
+
+    settings = {
+        "distributions": args.distributions,
+        "egg_links": args.egg_links,
+        "namespaces": args.namespaces,
+        "conda_packages": args.conda_packages,
+    }
+    # Every distribution's module, a few editable ones and unknown names
+    imports = [f"synthetic_mod_{i}" for i in range(0, args.distributions, 10)]
+    imports += [f"editable_mod_{i}" for i in range(0, args.egg_links, 10)]
+    imports += [f"unknown_{i}" for i in range(20)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        environment = make_environment(tmp, **settings)
+        print(f"generated the environment in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'stage':<14} {'seconds':>8} {'packages':>9}")
+        for name, func in STAGES.items():
+            seconds, packages = time_stage(
+                func, imports, environment["site"], environment["conda_prefix"],
+                args.repeat)
+            results[name] = {"seconds": round(seconds, 6), "packages": packages}
+            print(f"{name:<14} {seconds:>8.3f} {packages:>9}")
+
+    report = {"version": __version__, "settings": settings, "stages": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get("settings") != settings:
+            print("WARNING: the results were recorded with different settings")
+        print(f"\nspeedup against {previous.get('version')}:")
+        for name, result in results.items():
+            before = previous.get("stages", {}).get(name)
+            if before:
+                speedup = before["seconds"] / max(result["seconds"], 1e-9)
+                print(f"{name:<14} {speedup:>7.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark PyPI resolution against the local stub index.
+
+Resolves 10, 100 and 1000 unknown imports with ``get_imports_info`` and
+looks up their requirements through ``get_transitive_dependencies``,
+without a cache, with a cold and a warm PyPI metadata cache and with an
+expired one that is revalidated. Reports the end-to-end time, the
+requests and connections seen by the server and the bytes it sent.
+Everything runs offline.
+
+Usage:
+    python benchmarks/bench_pypi.py [--sizes N [N ...]] [--latency S]
+                                    [--error-rate F] [--not-found-rate F]
+                                    [--description-size N] [--workers N]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.pypi_stub import StubPyPIServer  # noqa: E402
+from mod2pip import mod2pip  # noqa: E402
+
+
+def resolve(imports, server, workers, cache=None):
+    """Resolve ``imports`` with ``get_imports_info``."""
+    return mod2pip.get_imports_info(
+        imports, pypi_server=server.url, max_workers=workers, cache=cache)
+
+
+def resolve_requirements(imports, server, workers, cache=None):
+    """Look up the requirements of ``imports`` as transitive resolution
+    does for packages that are not installed."""
+    return mod2pip.get_transitive_dependencies(
+        [{"name": name, "version": None} for name in imports], max_depth=1,
+        pypi_cache=cache, index=mod2pip.EnvironmentIndex([]),
+        max_workers=workers, pypi_server=server.url)
+
+
+def run(name, func, imports, server, workers, cache=None):
+    """Time one scenario and print what the server saw."""
+    server.reset()
+    start = time.perf_counter()
+    result = func(imports, server, workers, cache)
+    elapsed = time.perf_counter() - start
+    print(f"{len(imports):>6} {name:<22} {elapsed:>8.3f} {len(result):>8} "
+          f"{server.requests:>8} {server.connections:>11} {server.bytes_sent / 1e3:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="numbers of unknown imports (default: 10 100 1000)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds every response is delayed (default: 0.02)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests failing with a 503 (default: 0)")
+    parser.add_argument("--not-found-rate", type=float, default=0.1,
+                        help="fraction of names that do not exist (default: 0.1)")
+    parser.add_argument("--description-size", type=int, default=20000,
+                        help="bytes of long description per response (default: 20000)")
+    parser.add_argument("--workers", type=int, default=mod2pip.PYPI_MAX_WORKERS,
+                        help=f"concurrent lookups (default: {mod2pip.PYPI_MAX_WORKERS})")
+    args = parser.parse_args()
+
+    # get_imports_info warns about every unknown import
+    logging.disable(logging.WARNING)
+
+    print(f"{'size':>6} {'scenario':<22} {'seconds':>8} {'resolved':>8} "
+          f"{'requests':>8} {'connections':>11} {'KB sent':>9}")
+    with StubPyPIServer(latency=args.latency, error_rate=args.error_rate,
+                        not_found_rate=args.not_found_rate,
+                        description_size=args.description_size) as server:
+        for size in args.sizes:
+            imports = [f"unknown_package_{size}_{i}" for i in range(size)]
+            run("no cache", resolve, imports, server, args.workers)
+            run("transitive, no cache", resolve_requirements, imports, server, args.workers)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                cache = mod2pip.PyPICache(tmp)
+                run("cold cache", resolve, imports, server, args.workers, cache)
+                run("warm cache", resolve, imports, server, args.workers, cache)
+                cache.close()
+
+                cache = mod2pip.PyPICache(tmp, ttl=0)
+                run("expired cache", resolve, imports, server, args.workers, cache)
+                cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
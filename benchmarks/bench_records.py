@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Benchmark the memory of the distribution and requirement records.
+
+Discovers the distributions of a synthetic site-packages directory and
+measures, with ``tracemalloc``, the memory retained by the
+:class:`~mod2pip.mod2pip.Distribution` records and by the
+``EnvironmentIndex`` built over them, next to the same data held in the
+``name``/``version``/``exports`` dicts mod2pip used before. Requirement
+records are compared with ``name``/``version`` dicts the same way. Names
+are shared by both layouts, so the difference is the container overhead.
+
+Usage:
+    python benchmarks/bench_records.py [--distributions N] [--requirements N]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_site_packages  # noqa: E402
+from mod2pip import mod2pip  # noqa: E402
+
+
+def retained(func):
+    """Return the bytes still allocated after ``func()`` returns, while
+    its result is alive, and the result."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+
+def as_dicts(packages):
+    """Return ``packages`` in the dict layout mod2pip used before."""
+    return [
+        {"name": package.name, "version": package.version,
+         "exports": list(package.exports), "modules": list(package.modules)}
+        for package in packages
+    ]
+
+
+def as_records(packages):
+    return [
+        mod2pip.Distribution(package.name, package.version, package.exports, package.modules)
+        for package in packages
+    ]
+
+
+def report(name, count, dict_bytes, record_bytes):
+    saved = 1 - record_bytes / dict_bytes if dict_bytes else 0.0
+    print(f"{name:<28} {count:>7} {dict_bytes / 1024:>10.1f} {record_bytes / 1024:>10.1f} "
+          f"{dict_bytes / count:>8.0f} {record_bytes / count:>8.0f} {saved:>7.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--distributions", type=int, default=2000,
+                        help="distributions in the site-packages (default: 2000)")
+    parser.add_argument("--requirements", type=int, default=10000,
+                        help="requirement records to build (default: 10000)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site = make_site_packages(tmp, args.distributions, modules_per_package=2,
+                                  subpackages=0)
+        packages = mod2pip.get_locally_installed_packages(paths=[site])
+        metadata_dirs = mod2pip._get_metadata_dirs([site])
+
+    print(f"{'records':<28} {'count':>7} {'dicts KiB':>10} {'slots KiB':>10} "
+          f"{'B/dict':>8} {'B/slots':>8} {'saved':>7}")
+
+    dict_bytes, dicts = retained(lambda: as_dicts(packages))
+    record_bytes, records = retained(lambda: as_records(packages))
+    report("distributions", len(packages), dict_bytes, record_bytes)
+
+    # The index converts dicts to records, build the old index layout by hand
+    def dict_index():
+        by_export, by_name = {}, {}
+        for package in dicts:
+            for export in package["exports"]:
+                by_export.setdefault(export, []).append(package)
+            by_name.setdefault(mod2pip._normalize_name(package["name"]), []).append(package)
+        return by_export, by_name
+
+    index_dict_bytes, _ = retained(dict_index)
+    index_dict_bytes += dict_bytes
+    index_record_bytes, _ = retained(lambda: mod2pip.EnvironmentIndex(as_records(packages),
+                                                                      metadata_dirs))
+    report("environment index", len(packages), index_dict_bytes, index_record_bytes)
+
+    names = [sys.intern(f"requirement_{i}") for i in range(args.requirements)]
+    dict_bytes, _ = retained(lambda: [{"name": name, "version": "1.0"} for name in names])
+    record_bytes, _ = retained(lambda: [mod2pip.Requirement(name, "1.0") for name in names])
+    report("requirements", len(names), dict_bytes, record_bytes)
+
+    if records != dicts:
+        print("FAIL: records and dicts differ")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
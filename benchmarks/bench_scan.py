@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Benchmark the stages of the scanning pipeline on a synthetic project.
+
+Generates a project of configurable size and times every stage in a fresh
+child process, reporting files/s, MB/s and the peak RSS of the child.
+Results can be saved as a baseline JSON file and later runs compared with
+it; a stage whose throughput drops by more than ``--tolerance`` fails the
+run. Everything runs offline.
+
+Usage:
+    python benchmarks/bench_scan.py [--files N] [--lines N] [--import-density F]
+                                    [--notebooks N] [--depth N] [--ignored N]
+                                    [--repeat N]
+                                    [--save-baseline FILE] [--baseline FILE]
+                                    [--tolerance F]
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_project  # noqa: E402
+from mod2pip import mod2pip  # noqa: E402
+
+
+# Every stage prepares its inputs and returns the callable that is timed.
+def stage_imports(project, cache_dir):
+    """Serial import scan, without cache."""
+    return lambda: mod2pip.get_all_imports(project)
+
+
+def stage_imports_notebooks(project, cache_dir):
+    """Serial import scan of modules and notebooks."""
+    mod2pip.scan_noteboooks = True
+    mod2pip.handle_scan_noteboooks()
+    return lambda: mod2pip.get_all_imports(project)
+
+
+def stage_imports_nbconvert(project, cache_dir):
+    """Serial import scan of modules and notebooks read with nbconvert."""
+    mod2pip.scan_noteboooks = "nbconvert"
+    mod2pip.handle_scan_noteboooks()
+    return lambda: mod2pip.get_all_imports(project)
+
+
+def stage_imports_parallel(project, cache_dir):
+    """Import scan on one worker process per CPU."""
+    return lambda: mod2pip.get_all_imports(project, jobs=0)
+
+
+def stage_imports_cached(project, cache_dir):
+    """Import scan answered from a warm scan cache."""
+    mod2pip.get_all_imports(project, cache_dir=cache_dir)
+    return lambda: mod2pip.get_all_imports(project, cache_dir=cache_dir)
+
+
+def stage_imports_files_from(project, cache_dir):
+    """Import scan of a list of the project files, from a warm cache, so
+    that the walk is most of the time saved."""
+    files = [
+        os.path.relpath(os.path.join(root, name), project)
+        for root, _, names in os.walk(project) for name in names
+    ]
+    mod2pip.get_all_imports(project, cache_dir=cache_dir, files=files)
+    return lambda: mod2pip.get_all_imports(project, cache_dir=cache_dir, files=files)
+
+
+def stage_imports_changed(project, cache_dir):
+    """Import scan of a git copy of the project with 1% of its files changed
+    since the commit, from a warm baseline."""
+    repo = os.path.join(os.path.dirname(cache_dir), "changed")
+    changed_cache = os.path.join(os.path.dirname(cache_dir), "changed_cache")
+    shutil.rmtree(repo, ignore_errors=True)
+    shutil.rmtree(changed_cache, ignore_errors=True)
+    shutil.copytree(project, repo)
+    git = ["git", "-C", repo, "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "-A"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "baseline"], check=True)
+    mod2pip.get_all_imports(repo, cache_dir=changed_cache, changed_since="HEAD")
+
+    modules = sorted(
+        os.path.join(root, name) for root, _, files in os.walk(repo)
+        if ".git" not in root for name in files if name.endswith(".py"))
+    for file_name in modules[::100]:
+        with open(file_name, "a") as f:
+            f.write("import changed_module\n")
+    return lambda: mod2pip.get_all_imports(
+        repo, cache_dir=changed_cache, changed_since="HEAD")
+
+
+def stage_extract(project, cache_dir):
+    """Import extraction alone, on contents already read."""
+    modules = _read_modules(project)
+    return lambda: [mod2pip._get_imports(contents) for contents in modules]
+
+
+def stage_dynamic_imports(project, cache_dir):
+    """Dynamic import extraction alone, on contents already read."""
+    modules = _read_modules(project)
+    return lambda: [mod2pip._get_dynamic_imports(contents) for contents in modules]
+
+
+def stage_env_variables(project, cache_dir):
+    """Environment variable scan, without cache."""
+    return lambda: mod2pip.scan_for_env_variables(project)
+
+
+NOTEBOOK_STAGES = ("imports_notebooks", "imports_nbconvert")
+
+STAGES = {
+    "imports": stage_imports,
+    "imports_notebooks": stage_imports_notebooks,
+    "imports_nbconvert": stage_imports_nbconvert,
+    "imports_parallel": stage_imports_parallel,
+    "imports_cached": stage_imports_cached,
+    "imports_files_from": stage_imports_files_from,
+    "imports_changed": stage_imports_changed,
+    "extract": stage_extract,
+    "dynamic_imports": stage_dynamic_imports,
+    "env_variables": stage_env_variables,
+}
+
+
+def _read_modules(project):
+    """Return the contents of every module of ``project``."""
+    contents = []
+    for root, _, files in os.walk(project):
+        for file_name in files:
+            if file_name.endswith(".py"):
+                with open(os.path.join(root, file_name)) as f:
+                    contents.append(f.read())
+    return contents
+
+
+def _run_stage(name, project, cache_dir, repeat, queue):
+    """Time a stage in this (child) process and report it on ``queue``."""
+    func = STAGES[name](project, cache_dir)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put({"seconds": best, "peak_rss": peak_rss})
+
+
+def measure(name, project, cache_dir, repeat):
+    """Run a stage in a fresh process so its peak RSS is its own."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(
+        target=_run_stage, args=(name, project, cache_dir, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def project_size(project, notebooks):
+    """Return the number of files and bytes scanned in ``project``."""
+    extensions = mod2pip.get_file_extensions(notebooks)
+    rules = mod2pip.IgnoreRules.for_project(project)
+    files = total = 0
+    for file_name in mod2pip._walk_files(project, rules, extensions):
+        files += 1
+        total += os.path.getsize(file_name)
+    return files, total
+
+
+def compare(results, baseline, tolerance):
+    """Return the stages whose files/s dropped by more than ``tolerance``."""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get("stages", {}).get(name)
+        if not expected:
+            continue
+        if result["files_per_second"] < expected["files_per_second"] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=500,
+                        help="number of modules (default: 500)")
+    parser.add_argument("--lines", type=int, default=200,
+                        help="lines per module (default: 200)")
+    parser.add_argument("--import-density", type=float, default=0.05,
+                        help="fraction of lines that are imports (default: 0.05)")
+    parser.add_argument("--notebooks", type=int, default=0,
+                        help="number of notebooks (default: 0)")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="depth of the directory tree (default: 3)")
+    parser.add_argument("--ignored", type=int, default=0,
+                        help="modules in directories the scans leave out (default: 0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timings per stage, the best is kept (default: 3)")
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES),
+                        help="stages to run (default: all)")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the results with FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed drop of files/s against the baseline (default: 0.25)")
+    args = parser.parse_args()
+
+    stages = args.stages or [
+        name for name in STAGES
+        if name not in NOTEBOOK_STAGES or args.notebooks
+    ]
+    if "imports_nbconvert" in stages and importlib.util.find_spec("nbconvert") is None:
+        print("Skipping imports_nbconvert: nbconvert is not installed")
+        stages.remove("imports_nbconvert")
+    if "imports_changed" in stages and shutil.which("git") is None:
+        print("Skipping imports_changed: git is not installed")
+        stages.remove("imports_changed")
+    settings = {
+        "files": args.files,
+        "lines": args.lines,
+        "import_density": args.import_density,
+        "notebooks": args.notebooks,
+        "depth": args.depth,
+        "ignored": args.ignored,
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        project = make_project(tmp, **settings)
+        cache_dir = os.path.join(tmp, "cache")
+
+        print(f"{'stage':<18} {'files':>6} {'MB':>7} {'seconds':>8} "
+              f"{'files/s':>9} {'MB/s':>7} {'peak RSS MB':>11}")
+        for name in stages:
+            files, size = project_size(project, name in NOTEBOOK_STAGES)
+            result = measure(name, project, cache_dir, args.repeat)
+            seconds = max(result["seconds"], 1e-9)
+            results[name] = {
+                "files": files,
+                "bytes": size,
+                "seconds": round(result["seconds"], 6),
+                "files_per_second": round(files / seconds, 1),
+                "mb_per_second": round(size / seconds / 1e6, 3),
+                "peak_rss": result["peak_rss"],
+            }
+            print(f"{name:<18} {files:>6} {size / 1e6:>7.2f} {result['seconds']:>8.3f} "
+                  f"{files / seconds:>9.0f} {size / seconds / 1e6:>7.2f} "
+                  f"{result['peak_rss'] / 1e6:>11.1f}")
+
+    report = {"settings": settings, "python": sys.version.split()[0], "stages": results}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print("WARNING: the baseline was recorded with different project settings")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"FAIL: throughput dropped by more than {args.tolerance:.0%} "
+                  f"in: {', '.join(regressions)}")
+            return 1
+        print("OK: no stage is slower than the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Benchmark the discovery of pip installed distributions.
+
+Builds a synthetic site-packages directory and times ``_get_pip_packages``
+on it, next to a plain ``os.walk`` of the same tree, which is what the
+discovery cost before it only listed the top level of site directories.
+
+Usage:
+    python benchmarks/bench_site_packages.py [--distributions N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_site_packages  # noqa: E402
+from mod2pip import mod2pip  # noqa: E402
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """Return the best timing of ``repeat`` calls and the last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def walk_tree(path):
+    """Visit every directory below ``path``."""
+    return sum(1 for _ in os.walk(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--distributions", type=int, default=2000,
+                        help="number of distributions (default: 2000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timings per function, the best is kept (default: 3)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        site = make_site_packages(tmp, args.distributions)
+        print(f"generated {args.distributions} distributions in "
+              f"{time.perf_counter() - start:.1f}s")
+
+        walk_time, directories = best_of(args.repeat, walk_tree, site)
+        index_time, packages = best_of(
+            args.repeat, mod2pip._get_pip_packages, paths=[site])
+
+    print(f"os.walk of the tree:   {walk_time:.3f}s ({directories} directories)")
+    print(f"_get_pip_packages:     {index_time:.3f}s ({len(packages)} distributions)")
+    if len(packages) != args.distributions:
+        print("FAIL: not every distribution was found")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
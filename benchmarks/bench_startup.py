@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Benchmark the cold start of mod2pip.
+
+Imports ``mod2pip.mod2pip`` in fresh interpreters under
+``python -X importtime`` and reports the median import time and the
+slowest imports it triggers, then times whole ``--use-local --print``
+runs on a small project. Bytecode is compiled beforehand and allowed to
+be written, as it is for an installed package. Fails if a module that
+only some code paths need is in ``sys.modules`` after the import.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--top N]
+"""
+
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported by the code paths needing them: the
+# optional dependencies, and the standard library modules of the caches
+# and git listings. threading is not one, logging imports it.
+LAZY_MODULES = [
+    "requests", "docopt", "nbconvert", "concurrent.futures",
+    "hashlib", "sqlite3", "subprocess",
+]
+
+
+def child_env():
+    """Return the environment of the child interpreters."""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def import_times():
+    """Import mod2pip once and return its cumulative import time and the
+    ``(name, cumulative_us)`` of every import it triggered, in microseconds,
+    from the ``-X importtime`` report."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import mod2pip.mod2pip"],
+        env=child_env(), capture_output=True, text=True, check=True,
+    ).stderr
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level
+        indent = len(name) - len(name.lstrip())
+        entries.append((indent, name.strip(), int(cumulative_us)))
+
+    # Children are listed before their parent, more indented
+    position = max(i for i, entry in enumerate(entries) if entry[1] == "mod2pip.mod2pip")
+    indent, _, total = entries[position]
+    children = []
+    for child_indent, name, cumulative_us in reversed(entries[:position]):
+        if child_indent <= indent:
+            break
+        children.append((name, cumulative_us))
+    return total, children
+
+
+def loaded_modules():
+    """Return the modules in ``sys.modules`` after importing mod2pip in a
+    fresh interpreter."""
+    return set(subprocess.run(
+        [sys.executable, "-c", "import sys, mod2pip.mod2pip; print(*sys.modules)"],
+        env=child_env(), capture_output=True, text=True, check=True,
+    ).stdout.split())
+
+
+def time_run(project):
+    """Return the wall time of a ``--use-local --print`` run on ``project``."""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "mod2pip.mod2pip", "--use-local", "--print",
+         "--no-cache", project],
+        env=child_env(), capture_output=True, check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="fresh interpreters per measurement (default: 10)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="slowest imports to list (default: 10)")
+    args = parser.parse_args()
+
+    compileall.compile_dir(os.path.join(ROOT, "mod2pip"), quiet=1)
+    runs = [import_times() for _ in range(args.repeat)]
+    totals = [total for total, _ in runs]
+    print(f"import mod2pip.mod2pip: median {statistics.median(totals) / 1000:.1f} ms, "
+          f"best {min(totals) / 1000:.1f} ms over {args.repeat} interpreters")
+
+    children = runs[-1][1]
+    print("\nslowest imports of mod2pip (cumulative ms, last run):")
+    for name, cumulative_us in sorted(children, key=lambda c: c[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:>7.1f}  {name}")
+
+    with tempfile.TemporaryDirectory() as project:
+        with open(os.path.join(project, "app.py"), "w") as f:
+            f.write("import os\nimport json\n")
+        wall = [time_run(project) for _ in range(args.repeat)]
+    print(f"\nmod2pip --use-local --print: median {statistics.median(wall) * 1000:.0f} ms")
+
+    loaded = loaded_modules()
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+        return 1
+    print("OK: no lazily imported module is loaded at startup")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the standard library and import mapping lookups.
+
+Times the first load of the ``stdlib`` and ``mapping`` tables, then
+``get_pkg_names`` and the standard library filter with the tables already
+loaded, next to re-reading the files on every call as mod2pip did before
+they were cached.
+
+Usage:
+    python benchmarks/bench_tables.py [--imports N] [--number N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mod2pip import mod2pip  # noqa: E402
+
+
+def cold_load():
+    """Load both tables from their files."""
+    mod2pip._get_stdlib_modules.cache_clear()
+    mod2pip._get_import_mapping.cache_clear()
+    mod2pip._get_stdlib_modules()
+    mod2pip._get_import_mapping()
+
+
+def uncached_lookup(imports):
+    """Filter and map ``imports``, reading both files like every call used to."""
+    with open(mod2pip.join("stdlib")) as f:
+        stdlib = {x.strip() for x in f} | set(sys.stdlib_module_names)
+    with open(mod2pip.join("mapping")) as f:
+        mapping = dict(x.strip().split(":") for x in f)
+    return sorted({mapping.get(name, name) for name in set(imports) - stdlib},
+                  key=str.lower)
+
+
+def cached_lookup(imports):
+    """Filter and map ``imports`` with the cached tables."""
+    return mod2pip.get_pkg_names(set(imports) - mod2pip._get_stdlib_modules())
+
+
+def report(name, seconds, number):
+    print(f"{name:<34} {seconds / number * 1e6:>10.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--imports", type=int, default=200,
+                        help="import names per lookup (default: 200)")
+    parser.add_argument("--number", type=int, default=2000,
+                        help="calls per timing (default: 2000)")
+    args = parser.parse_args()
+
+    # Mapped, standard library and unknown names
+    mapping = list(mod2pip._get_import_mapping())
+    stdlib = sorted(mod2pip._get_stdlib_modules())
+    imports = [
+        [mapping, stdlib, [f"unknown_{i}" for i in range(args.imports)]][i % 3][i]
+        for i in range(args.imports)
+    ]
+    if cached_lookup(imports) != uncached_lookup(imports):
+        print("FAIL: cached and uncached lookups differ")
+        return 1
+
+    number = args.number
+    report("cold load of both tables", timeit.timeit(cold_load, number=number), number)
+    report("lookup, files read per call",
+           timeit.timeit(lambda: uncached_lookup(imports), number=number), number)
+    report("lookup, cached tables",
+           timeit.timeit(lambda: cached_lookup(imports), number=number), number)
+    report("stdlib membership, cached",
+           timeit.timeit(lambda: "os" in mod2pip._get_stdlib_modules(), number=number),
+           number)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
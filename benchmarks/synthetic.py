@@ -0,0 +1,215 @@
+"""
+Generators of synthetic trees used by the benchmarks.
+"""
+
+import json
+import os
+import random
+
+
+def make_site_packages(root, distributions=2000, modules_per_package=10,
+                       subpackages=2, without_top_level=0.25):
+    """Create a fake site-packages directory.
+
+    Every distribution gets an importable package with ``subpackages``
+    nested directories of ``modules_per_package`` modules each, and a
+    ``.dist-info`` directory with ``METADATA``, ``RECORD`` and, for all
+    but a ``without_top_level`` fraction of them, ``top_level.txt``.
+
+    Args:
+        root (str): Directory to create the tree in.
+        distributions (int): Number of distributions to create.
+        modules_per_package (int): Modules in every package directory.
+        subpackages (int): Nested package directories per distribution.
+        without_top_level (float): Fraction of distributions whose
+            exports have to be read from ``RECORD``.
+
+    Returns:
+        str: The path of the site-packages directory.
+    """
+    site = os.path.join(root, "site-packages")
+    os.makedirs(site, exist_ok=True)
+    skip_every = int(1 / without_top_level) if without_top_level else 0
+
+    for i in range(distributions):
+        name = f"synthetic_dist_{i}"
+        module = f"synthetic_mod_{i}"
+        version = f"1.{i % 10}.{i % 7}"
+        record = []
+
+        package_dir = os.path.join(site, module)
+        for depth in range(subpackages + 1):
+            os.makedirs(package_dir, exist_ok=True)
+            for j in range(modules_per_package):
+                file_name = "__init__.py" if j == 0 else f"module_{j}.py"
+                file_path = os.path.join(package_dir, file_name)
+                with open(file_path, "w") as f:
+                    f.write(f"VALUE = {j}\n")
+                record.append(os.path.relpath(file_path, site).replace(os.sep, "/"))
+            package_dir = os.path.join(package_dir, f"sub_{depth}")
+
+        dist_info = os.path.join(site, f"{name}-{version}.dist-info")
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write(f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n")
+            if i:
+                f.write(f"Requires-Dist: synthetic_dist_{i - 1}\n")
+            f.write("\n" + "Long description line.\n" * 200)
+        if not skip_every or i % skip_every:
+            with open(os.path.join(dist_info, "top_level.txt"), "w") as f:
+                f.write(module + "\n")
+        record.extend(
+            f"{os.path.basename(dist_info)}/{fn}" for fn in ("METADATA", "RECORD")
+        )
+        with open(os.path.join(dist_info, "RECORD"), "w") as f:
+            f.write("".join(f"{path},,\n" for path in record))
+
+    return site
+
+
+# Third party and standard library modules imported by generated projects.
+IMPORTED_MODULES = [
+    "requests", "numpy", "pandas", "yaml", "flask", "django", "boto3",
+    "sqlalchemy", "click", "jinja2", "os", "sys", "json", "re", "logging",
+    "collections", "itertools", "functools", "pathlib", "typing",
+]
+
+
+def make_project(root, files=500, lines=200, import_density=0.05, notebooks=0,
+                 depth=3, ignored=0, seed=0):
+    """Create a fake Python project.
+
+    Files are spread over a tree ``depth`` directories deep. Every line
+    of a module is an ``import``/``from`` statement with probability
+    ``import_density``; some of them are dynamic imports and some lines
+    read environment variables, the rest are plain statements.
+
+    Args:
+        root (str): Directory to create the project in.
+        files (int): Number of ``.py`` modules.
+        lines (int): Lines per module.
+        import_density (float): Fraction of lines that import a module.
+        notebooks (int): Number of ``.ipynb`` notebooks.
+        depth (int): Depth of the directory tree.
+        ignored (int): Number of modules in directories the scans leave
+            out: ``node_modules``, ``build`` and one in ``.gitignore``.
+        seed (int): Seed of the generator, the same seed gives the same tree.
+
+    Returns:
+        str: The path of the project.
+    """
+    rng = random.Random(seed)
+    project = os.path.join(root, "project")
+    directories = [project]
+    for level in range(depth):
+        directories.append(os.path.join(directories[-1], f"level_{level}"))
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    for i in range(files):
+        body = [_make_line(rng, n, import_density) for n in range(lines)]
+        path = os.path.join(directories[i % len(directories)], f"module_{i}.py")
+        with open(path, "w") as f:
+            f.write("\n".join(body) + "\n")
+
+    for i in range(notebooks):
+        cells = [
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "metadata": {},
+                "outputs": [],
+                "source": [_make_line(rng, n, import_density) + "\n" for n in range(20)],
+            }
+            for _ in range(max(1, lines // 20))
+        ]
+        notebook = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+        path = os.path.join(directories[i % len(directories)], f"notebook_{i}.ipynb")
+        with open(path, "w") as f:
+            json.dump(notebook, f)
+
+    if ignored:
+        with open(os.path.join(project, ".gitignore"), "w") as f:
+            f.write("generated/\n")
+        ignored_dirs = [
+            os.path.join(project, "node_modules", "package", "lib"),
+            os.path.join(project, "build", "lib"),
+            os.path.join(project, "generated"),
+        ]
+        for directory in ignored_dirs:
+            os.makedirs(directory, exist_ok=True)
+        for i in range(ignored):
+            body = [_make_line(rng, n, import_density) for n in range(lines)]
+            path = os.path.join(ignored_dirs[i % len(ignored_dirs)], f"ignored_{i}.py")
+            with open(path, "w") as f:
+                f.write("\n".join(body) + "\n")
+
+    return project
+
+
+def _make_line(rng, n, import_density):
+    """Return one generated line of code."""
+    if rng.random() < import_density:
+        module = rng.choice(IMPORTED_MODULES)
+        kind = rng.random()
+        if kind < 0.6:
+            return f"import {module}"
+        if kind < 0.9:
+            return f"from {module} import name_{n}"
+        return f"mod_{n} = __import__({module!r})"
+    if n % 50 == 0:
+        return f"setting_{n} = os.environ.get('SETTING_{n}', 'default')"
+    return f"value_{n} = {n} * 2 + len('text {n}')"
+
+
+def make_environment(root, distributions=2000, egg_links=100, namespaces=100,
+                     conda_packages=500):
+    """Create a fake Python environment.
+
+    On top of :func:`make_site_packages`, the site directory gets
+    ``egg_links`` ``.egg-link`` files pointing at development checkouts
+    with a ``setup.py``, ``namespaces`` PEP 420 namespace directories and
+    a ``CONDA_PREFIX`` with ``conda_packages`` ``conda-meta`` records.
+
+    Args:
+        root (str): Directory to create the environment in.
+        distributions (int): Number of ``.dist-info`` distributions.
+        egg_links (int): Number of editable installs.
+        namespaces (int): Number of namespace packages.
+        conda_packages (int): Number of conda package records.
+
+    Returns:
+        dict: The ``site`` directory and the ``conda_prefix``.
+    """
+    site = make_site_packages(root, distributions, modules_per_package=3)
+
+    for i in range(egg_links):
+        checkout = os.path.join(root, "src", f"editable_{i}")
+        os.makedirs(os.path.join(checkout, f"editable_mod_{i}"))
+        with open(os.path.join(checkout, "setup.py"), "w") as f:
+            f.write("from setuptools import setup\n"
+                    f"setup(name='editable_{i}', version='0.{i}',\n"
+                    f"      packages=['editable_mod_{i}'])\n")
+        with open(os.path.join(site, f"editable_{i}.egg-link"), "w") as f:
+            f.write(checkout + "\n.\n")
+
+    for i in range(namespaces):
+        portion = os.path.join(site, f"namespace_{i}", "portion")
+        os.makedirs(portion)
+        with open(os.path.join(portion, "__init__.py"), "w") as f:
+            f.write("")
+
+    conda_prefix = os.path.join(root, "conda")
+    conda_meta = os.path.join(conda_prefix, "conda-meta")
+    os.makedirs(conda_meta)
+    for i in range(conda_packages):
+        name = f"conda_pkg_{i}"
+        with open(os.path.join(conda_meta, f"{name}-1.{i}-py_0.json"), "w") as f:
+            json.dump({
+                "name": name,
+                "version": f"1.{i}",
+                "build": "py_0",
+                "files": [f"lib/python3/site-packages/{name}/__init__.py"],
+            }, f)
+
+    return {"site": site, "conda_prefix": conda_prefix}
@@ -31,7 +31,7 @@ def check_environment():
         return False
     
     # Check key dependencies
-    dependencies = ['yarg', 'docopt', 'requests', 'nbconvert', 'ipython']
+    dependencies = ['docopt', 'requests', 'nbconvert', 'ipython']
     missing_deps = []
     
     for dep in dependencies:
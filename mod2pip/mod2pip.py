@@ -18,6 +18,10 @@ Options:
                           parameter in your terminal:
                           $ export HTTP_PROXY="http://10.10.1.10:3128"
                           $ export HTTPS_PROXY="https://10.10.1.10:1080"
+    --pypi-timeout <s>    Timeout of each PyPI request in seconds
+                          (default: 10).
+    --pypi-total-timeout <s>  Give up on the PyPI lookups that have not
+                          completed after <s> seconds.
     --debug               Print debug information
     --ignore <dirs>...    Ignore extra directories, each separated by a comma
     --no-follow-links     Do not follow symbolic links in the project
@@ -37,6 +41,30 @@ Options:
                           <gt>     | e.g. Flask>=1.1.2
                           <no-pin> | e.g. Flask
     --scan-notebooks      Look for imports in jupyter notebook files.
+    --nbconvert           Read notebooks with nbconvert instead of the
+                          built-in reader (implies --scan-notebooks).
+    --jobs <n>            Scan project files with <n> worker processes
+                          (0 uses one per CPU, default: 1).
+    --chunk-size <n>      Number of files handed to a worker at a time
+                          when using --jobs (default: 64).
+    --no-cache            Do not use the scan and PyPI metadata caches.
+    --cache-dir <dir>     Directory of the scan cache (default: a directory
+                          per project in ~/.cache/mod2pip/scan).
+    --changed-since <ref>  Only scan the files changed since the git
+                          reference <ref>, reusing the imports the scan
+                          cache recorded at <ref> for the others. Every
+                          run records them for HEAD.
+    --files-from <file>   Scan the files listed in <file>, one per line or
+                          NUL separated, instead of walking <path>; - reads
+                          the list from the standard input, e.g.
+                          $ git ls-files | mod2pip --files-from -
+                          Relative paths are relative to <path>.
+    --pypi-cache-dir <dir>  Directory of the PyPI metadata cache
+                          (default: ~/.cache/mod2pip).
+    --pypi-cache-ttl <s>  Seconds before cached PyPI metadata is
+                          revalidated (default: 86400).
+    --pypi-cache-size <n>  Maximum number of packages kept in the PyPI
+                          metadata cache (default: 10000).
     --include-transitive  Include transitive dependencies (experimental).
     --transitive-depth <n> Maximum depth for transitive dependency
                           resolution (default: 2).
@@ -47,19 +75,27 @@ Options:
     --generate-env        Scan Python files for environment variables and
                           generate .env and .env.sample files.
     --validate-env        Validate .env file values against known patterns.
+    --profile-report <file>  Write the time spent in every stage and
+                          counters such as files scanned and HTTP requests
+                          to <file> as JSON. A summary is printed with
+                          --debug.
+    --cprofile <dir>      Profile every stage with cProfile and write the
+                          statistics to <dir>/<stage>.pstats.
+    --trace-memory        Trace memory allocations and report the peak
+                          memory and top allocation sites of every stage.
 """
+from collections import namedtuple
+from collections.abc import Mapping
 from contextlib import contextmanager
+from functools import lru_cache
 import os
 import sys
 import re
 import logging
 import ast
-import traceback
 import json
-from docopt import docopt
-import requests
-from yarg import json2package
-from yarg.exceptions import HTTPError
+import time
+from types import MappingProxyType
 
 from mod2pip import __version__
 
@@ -68,14 +104,330 @@ REGEXP = [
     re.compile(r"^from ((?!\.+).*?) import (?:.*)$")
 ]
 DEFAULT_EXTENSIONS = [".py", ".pyw"]
+DEFAULT_CHUNK_SIZE = 64
+DEFAULT_PYPI_SERVER = "https://pypi.python.org/pypi/"
+PYPI_MAX_WORKERS = 8
+# Connect and read timeout of a single PyPI request, in seconds.
+PYPI_TIMEOUT = 10
+# Seconds a cached PyPI response is used before it is revalidated.
+PYPI_CACHE_TTL = 24 * 60 * 60
+# Number of packages kept in the PyPI metadata cache.
+PYPI_CACHE_SIZE = 10000
+# __import__('module_name') and importlib.import_module('module_name'),
+# used when a file can not be parsed.
+DYNAMIC_IMPORT_PATTERNS = [
+    re.compile(r'__import__\s*\(\s*["\']([^"\']+)["\']'),
+    re.compile(r'import_module\s*\(\s*["\']([^"\']+)["\']'),
+]
+# Files of glob patterns of paths to leave out of the scans, in every
+# directory, see IgnoreRules.
+IGNORE_FILES = (".gitignore", ".mod2pipignore")
+# Number of git revisions whose imports are kept in the scan cache for
+# --changed-since, the oldest are dropped first.
+MAX_BASELINES = 8
+# Patterns to match environment variable access
+ENV_VAR_PATTERNS = [
+    # os.environ['VAR'], os.environ["VAR"]
+    re.compile(r'os\.environ\[["\']([A-Z_][A-Z0-9_]*?)["\']\]'),
+    # os.environ.get('VAR'), os.environ.get("VAR")
+    re.compile(r'os\.environ\.get\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
+    # os.getenv('VAR'), os.getenv("VAR")
+    re.compile(r'os\.getenv\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
+    # environ['VAR'], environ.get('VAR')
+    re.compile(r'environ\[["\']([A-Z_][A-Z0-9_]*?)["\']\]'),
+    re.compile(r'environ\.get\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
+]
+# Bump whenever the output of the import or env-var extractors changes so
+# that stale scan cache entries are discarded.
+EXTRACTOR_VERSION = 4
+# Header fields of a METADATA/PKG-INFO file used by mod2pip.
+Metadata = namedtuple("Metadata", ["name", "version", "requires_dist", "provides_extra"])
+# Scan result of a single file, yielded by iter_imports().
+FileImports = namedtuple("FileImports", ["file_name", "imports", "errors"])
 
 scan_noteboooks = False
 
 
+class _Record(Mapping):
+    """Base of the compact records returned by mod2pip.
+
+    Fields live in slots rather than in a per-record dict. Records are
+    also read-only mappings of their fields, so ``record["name"]``,
+    ``record.get("version")``, ``dict(record)`` and comparisons with
+    dicts work as with the dicts they replace. Tuple fields read as
+    lists through the mapping interface, as they were in those dicts.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        value = getattr(self, key)
+        return list(value) if isinstance(value, tuple) else value
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(field, getattr(self, field)) for field in self._fields))
+
+
+class Distribution(_Record):
+    """An installed distribution and the modules it exports.
+
+    Args:
+        name (str): Distribution name.
+        version (str): Installed version, ``None`` if unknown.
+        exports (Iterable[str]): Top level modules.
+        modules (Iterable[str]): The exports with namespace packages
+            replaced by the dotted names of the packages installed in
+            them, the exports themselves by default.
+    """
+
+    __slots__ = ("name", "version", "exports", "modules")
+    _fields = __slots__
+
+    def __init__(self, name, version, exports, modules=None):
+        self.name = sys.intern(name)
+        self.version = version
+        self.exports = tuple(sys.intern(export) for export in exports)
+        if modules is None or tuple(modules) == self.exports:
+            self.modules = self.exports
+        else:
+            self.modules = tuple(sys.intern(module) for module in modules)
+
+    @classmethod
+    def from_mapping(cls, package):
+        """Return ``package`` as a :class:`Distribution`, it may also be a
+        ``name``/``version``/``exports`` dict."""
+        if isinstance(package, cls):
+            return package
+        return cls(package["name"], package.get("version"), package["exports"],
+                   package.get("modules"))
+
+
+class Requirement(_Record):
+    """A requirement to write out, a distribution name and its version.
+
+    Args:
+        name (str): Distribution name.
+        version (str): Version, ``None`` or ``""`` to leave it unpinned.
+    """
+
+    __slots__ = ("name", "version")
+    _fields = __slots__
+
+    def __init__(self, name, version=None):
+        self.name = sys.intern(name)
+        self.version = version
+
+
+class Profile(object):
+    """Timers and counters of a mod2pip run.
+
+    ``stage()`` times a block under a name, ``incr()`` bumps a counter.
+    Both are safe to call from the PyPI worker threads. The profile in
+    use is a module global, a :class:`_NullProfile` that does nothing
+    unless ``--profile-report``, ``--cprofile``, ``--trace-memory`` or
+    ``--debug`` is given.
+
+    Stages can also be run under ``cProfile``, whose statistics are
+    written to ``<cprofile_dir>/<stage>.pstats``, and ``tracemalloc``,
+    which records the peak and retained memory of the stage and its
+    ``top`` allocation sites. Only stages that are not nested in another
+    hooked stage get the hooks. ``cProfile`` sees the calling thread
+    only, so PyPI lookups and ``--jobs`` workers show up as waits.
+
+    Args:
+        cprofile_dir (str): Directory of the pstats files, ``None`` to
+            disable ``cProfile``.
+        trace_memory (bool): Whether to trace memory allocations.
+        top (int): Number of allocation sites kept per stage.
+    """
+
+    enabled = True
+
+    def __init__(self, cprofile_dir=None, trace_memory=False, top=10):
+        import threading
+
+        self.stages = {}
+        self.counters = {}
+        self.cprofile_dir = cprofile_dir
+        self.trace_memory = trace_memory
+        self.top = top
+        self._profilers = {}
+        self._hooked = False
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, hooks=True):
+        hooks = (
+            hooks and not self._hooked
+            and bool(self.cprofile_dir or self.trace_memory)
+        )
+        if hooks:
+            self._hooked = True
+            profiler, before = self._start_hooks(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if hooks:
+                self._stop_hooks(name, profiler, before)
+                self._hooked = False
+            with self._lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                stage["seconds"] += elapsed
+                stage["calls"] += 1
+
+    def _start_hooks(self, name):
+        import cProfile
+        import tracemalloc
+
+        before = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            before = (tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[0])
+            tracemalloc.reset_peak()
+
+        profiler = None
+        if self.cprofile_dir:
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        return profiler, before
+
+    def _stop_hooks(self, name, profiler, before):
+        import tracemalloc
+
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.cprofile_dir, name + ".pstats"))
+
+        if before is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot, base = before
+            # Leave out the allocations of the profilers themselves
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "*/cProfile.py"),
+            ]
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+            top = [
+                stat for stat in after.compare_to(snapshot.filter_traces(filters), "lineno")
+                if stat.size_diff > 0
+            ][:self.top]
+            memory = self.stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0}).setdefault("memory", {"peak": 0})
+            memory["peak"] = max(memory["peak"], peak - base)
+            memory["retained"] = current - base
+            memory["top"] = [str(stat) for stat in top]
+
+    def close(self):
+        """Stop the memory tracing started by the profile."""
+        if self._started_tracing:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, counters):
+        """Add the ``counters`` of another profile, e.g. of a worker process."""
+        for name, value in counters.items():
+            self.incr(name, value)
+
+    def report(self):
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {"seconds": round(stage["seconds"], 6), "calls": stage["calls"]}
+            if "memory" in stage:
+                stages[name]["memory"] = stage["memory"]
+        return {
+            "version": __version__,
+            "stages": stages,
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def write(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+    def summary(self):
+        stages = ", ".join(
+            "{0} {1:.3f}s".format(name, stage["seconds"])
+            for name, stage in self.stages.items()
+        )
+        counters = ", ".join(
+            "{0}={1}".format(name, value) for name, value in sorted(self.counters.items())
+        )
+        return "Profile: {0}\nCounters: {1}".format(stages or "-", counters or "-")
+
+    def memory_summary(self):
+        lines = []
+        for name, stage in self.stages.items():
+            memory = stage.get("memory")
+            if not memory:
+                continue
+            lines.append("Stage {0}: peak {1:.1f} KiB, retained {2:.1f} KiB".format(
+                name, memory["peak"] / 1024, memory["retained"] / 1024))
+            lines.extend("    " + line for line in memory["top"])
+        return "\n".join(lines)
+
+
+class _NullProfile(object):
+    """Profile used when profiling is disabled, every call is a no-op."""
+
+    enabled = False
+    counters = {}
+
+    def stage(self, name, hooks=True):
+        return _NULL_STAGE
+
+    def incr(self, name, value=1):
+        pass
+
+    def merge(self, counters):
+        pass
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+_profile = _NullProfile()
+
+
+def _set_profile(profile):
+    """Make ``profile`` the current profile and return the previous one."""
+    global _profile
+    previous, _profile = _profile, profile
+    return previous
+
+
 class NbconvertNotInstalled(ImportError):
     default_message = (
-        "In order to scan jupyter notebooks, please install the "
-        "nbconvert and ipython libraries"
+        "In order to read jupyter notebooks with nbconvert, please install "
+        "the nbconvert and ipython libraries (pip install mod2pip[nbconvert])"
     )
 
     def __init__(self, message=default_message):
@@ -124,23 +476,461 @@ def _open(filename=None, mode="r"):
             file.close()
 
 
+class ScanCache(object):
+    """Persistent per-file cache of scan results, stored in SQLite.
+
+    Entries are keyed by the absolute file path and validated against the
+    file size and mtime. When only the mtime changed, the content hash of
+    the file decides whether the cached result can still be used.
+
+    New entries are written in batches, so that the write lock is only held
+    while a batch is flushed and several scans can share the cache. If the
+    cache stays locked, it is no longer updated but the scan goes on.
+
+    Args:
+        cache_dir (str): Directory holding the cache database. It is
+            created if it does not exist.
+    """
+
+    filename = "scan.sqlite3"
+    # Entries written per transaction
+    batch_size = 500
+    # Seconds to wait for another scan holding the lock
+    timeout = 10
+
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.filename)
+        self.hits = 0
+        self.misses = 0
+        self.writable = True
+        self._rows = []
+        self._touched = []
+        # sqlite3 and hashlib are only imported when a cache is used
+        import sqlite3
+
+        self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta "
+            "(kind TEXT PRIMARY KEY, fingerprint TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(kind TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, "
+            "digest TEXT, value TEXT, PRIMARY KEY (kind, path))"
+        )
+        # Results of every file at a git revision, see get_baseline()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS baselines "
+            "(kind TEXT, revision TEXT, created REAL, value TEXT, "
+            "PRIMARY KEY (kind, revision))"
+        )
+
+    def prepare(self, kind, **settings):
+        """Drop the ``kind`` entries if they were produced by another
+        mod2pip version or with different extractor settings."""
+        settings.update(version=__version__, extractor=EXTRACTOR_VERSION)
+        fingerprint = json.dumps(settings, sort_keys=True)
+        row = self._conn.execute(
+            "SELECT fingerprint FROM meta WHERE kind = ?", (kind,)
+        ).fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logging.debug("Scan cache settings changed, clearing %s", kind)
+            for table in ("files", "baselines"):
+                self._conn.execute(f"DELETE FROM {table} WHERE kind = ?", (kind,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (kind, fingerprint)
+            )
+            # Do not hold the write lock, the same cache may be opened again
+            self._conn.commit()
+
+    def get(self, kind, file_name):
+        """Return the cached value for ``file_name`` or ``None``."""
+        import sqlite3
+
+        path = os.path.abspath(file_name)
+        try:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, digest, value FROM files "
+                "WHERE kind = ? AND path = ?", (kind, path)
+            ).fetchone()
+            st = os.stat(path)
+        except (OSError, sqlite3.OperationalError):
+            row = None
+        if row is not None and row[0] == st.st_size:
+            if row[1] == st.st_mtime_ns:
+                self.hits += 1
+                _profile.incr("scan_cache_hits")
+                return json.loads(row[3])
+            if row[2] is not None and row[2] == _file_digest(path):
+                self._touched.append((st.st_mtime_ns, kind, path))
+                self._maybe_flush()
+                self.hits += 1
+                _profile.incr("scan_cache_hits")
+                return json.loads(row[3])
+        self.misses += 1
+        _profile.incr("scan_cache_misses")
+        return None
+
+    def set(self, kind, file_name, value, stamp=None):
+        """Store ``value``, which must be JSON serializable, for ``file_name``.
+
+        ``stamp`` is the ``(size, mtime_ns, digest)`` of the contents the
+        value was computed from, see :func:`_read_text`. Without it the file
+        is stat'ed and the entry has no hash, a new mtime then invalidates it.
+        """
+        path = os.path.abspath(file_name)
+        if stamp is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            stamp = (st.st_size, st.st_mtime_ns, None)
+        self._rows.append((kind, path) + tuple(stamp) + (json.dumps(value),))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._rows) + len(self._touched) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending entries in one transaction."""
+        rows, touched = self._rows, self._touched
+        self._rows, self._touched = [], []
+        if self.writable and (rows or touched):
+            self._write(
+                ("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows),
+                ("UPDATE files SET mtime_ns = ? WHERE kind = ? AND path = ?", touched),
+            )
+
+    def _write(self, *statements):
+        """Run the ``(sql, rows)`` statements in one transaction. If the
+        database is locked by another scan, stop updating the cache."""
+        import sqlite3
+
+        try:
+            with self._conn:
+                for sql, rows in statements:
+                    self._conn.executemany(sql, rows)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"Scan cache {self.path} is not updated: {e}")
+            self.writable = False
+
+    def get_baseline(self, kind, revision):
+        """Return the ``{path: value}`` map stored for the git ``revision``,
+        or ``None`` if there is none.
+
+        Unlike the other entries, baselines are not validated against the
+        files: the caller knows from git which files changed since.
+        """
+        import sqlite3
+
+        try:
+            row = self._conn.execute(
+                "SELECT value FROM baselines WHERE kind = ? AND revision = ?", (kind, revision)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        # One document per revision, loading rows one by one is much slower
+        return None if row is None else json.loads(row[0])
+
+    def set_baseline(self, kind, revision, values):
+        """Store the ``{path: value}`` map of the git ``revision``, keeping
+        only the :data:`MAX_BASELINES` most recent revisions."""
+        if not self.writable:
+            return
+        self._write(
+            ("INSERT OR REPLACE INTO baselines VALUES (?, ?, ?, ?)",
+             [(kind, revision, time.time(), json.dumps(values))]),
+            ("DELETE FROM baselines WHERE kind = ? AND revision NOT IN ("
+             "SELECT revision FROM baselines WHERE kind = ? ORDER BY created DESC LIMIT ?)",
+             [(kind, kind, MAX_BASELINES)]),
+        )
+
+    def close(self):
+        logging.debug(
+            "Scan cache {0}: {1} hits, {2} misses".format(
+                self.path, self.hits, self.misses)
+        )
+        self.flush()
+        self._conn.close()
+
+
+def _file_digest(file_name):
+    import hashlib
+
+    with open(file_name, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _open_scan_cache(cache_dir, kind, **settings):
+    """Open the scan cache in ``cache_dir``, or return ``None`` if caching
+    is disabled or the cache can not be used."""
+    if not cache_dir:
+        return None
+    import sqlite3
+
+    try:
+        cache = ScanCache(cache_dir)
+        cache.prepare(kind, **settings)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"Scan cache disabled, could not open {cache_dir}: {e}")
+        return None
+    return cache
+
+
 def get_all_imports(
-    path, encoding="utf-8", extra_ignore_dirs=None, follow_links=True
+    path, encoding="utf-8", extra_ignore_dirs=None, follow_links=True,
+    jobs=None, chunk_size=DEFAULT_CHUNK_SIZE, cache_dir=None, full_names=False,
+    notebooks=None, changed_since=None, files=None
 ):
+    """Return the third party imports found in the files under ``path``.
+
+    Imports of the standard library and of modules found in the project
+    itself are left out. With ``full_names`` the dotted names are kept
+    (e.g. ``google.cloud.storage``), otherwise only their top level
+    package is returned. Built on :func:`iter_imports`, see there for the
+    other arguments. Files that can not be read raise the error met.
+
+    With ``changed_since``, a git reference, the files are listed by git
+    instead of walking the tree and only those changed since the reference
+    are scanned, see :func:`_scan_changed_files`. The result is the same.
+    Listed files that do not exist are skipped with a warning.
+    """
     imports = set()
-    raw_imports = set()
-    candidates = []
-    ignore_errors = False
+    candidates = set()
+    stdlib = _get_stdlib_modules()
+
+    notebooks = _scan_notebooks(notebooks)
+    if changed_since is not None and files is not None:
+        raise ValueError("changed_since and files can not be used together")
+
+    with _profile.stage("scan"):
+        if changed_since is None:
+            if files is None:
+                file_names = _walk_source_files(
+                    path, extra_ignore_dirs, follow_links, notebooks, candidates)
+            else:
+                file_names = _list_source_files(
+                    path, files, IgnoreRules.for_project(path, extra_ignore_dirs),
+                    get_file_extensions(notebooks), candidates)
+            results = _scan_files(file_names, encoding, jobs, chunk_size, cache_dir, notebooks)
+        else:
+            results = _scan_changed_files(
+                path, changed_since, encoding, extra_ignore_dirs, follow_links, jobs,
+                chunk_size, cache_dir, notebooks, candidates)
+        try:
+            for file_name, file_imports, errors in results:
+                for error in errors:
+                    if files is not None and isinstance(error, FileNotFoundError):
+                        # Lists such as git ls-files name deleted files
+                        logging.warning(f"Skipping {file_name}, listed but not found")
+                    # Unparsable files were scanned with regular expressions
+                    elif not isinstance(error, SyntaxError):
+                        raise error
+                for name in file_imports:
+                    # Cleanup: Unless full names are asked for, we only want
+                    # the first part of the import.
+                    # Ex: from django.conf --> django.conf. But we only want
+                    # django as an import.
+                    cleaned_name, _, _ = name.partition(".")
+                    if cleaned_name not in stdlib:
+                        imports.add(name if full_names else cleaned_name)
+        finally:
+            results.close()
+
+    # Modules of the project itself are only all known once it is walked
+    packages = {name for name in imports if name.partition(".")[0] not in candidates}
+    logging.debug("Found packages: {0}".format(packages))
+
+    # Sorted so that the serial and the parallel scans return the same list.
+    return sorted(packages)
+
+
+def iter_imports(
+    path, encoding="utf-8", extra_ignore_dirs=None, follow_links=True,
+    jobs=None, chunk_size=DEFAULT_CHUNK_SIZE, cache_dir=None, notebooks=None, files=None
+):
+    """Yield the imports of every source file under ``path`` as it is scanned.
+
+    The tree is walked lazily and files are scanned as they are found, so
+    memory stays bounded however large the tree is and the caller can stop
+    at any time.
+
+    Args:
+        path (str): Directory to scan.
+        encoding (str): Encoding used to open the files.
+        extra_ignore_dirs (List[str]): Directories to skip on top of the
+            usual virtualenv and VCS directories.
+        follow_links (bool): Whether to follow symbolic links.
+        jobs (int): Number of worker processes, ``None`` or ``1`` scans in
+            this process and ``0`` uses all CPUs. Workers are only started
+            once more than ``chunk_size`` files need scanning.
+        chunk_size (int): Number of files sent to a worker at a time.
+        cache_dir (str): Directory of the scan cache, ``None`` disables it.
+        notebooks (bool): Whether to scan Jupyter notebooks, ``None`` uses
+            the module wide ``scan_noteboooks`` setting.
+        files (List[str]): Files to scan instead of walking ``path``, for
+            example the output of ``git ls-files``. Relative paths are
+            relative to ``path``. Files in ignored directories or that are
+            not source files are left out, like in a walk.
+
+    Yields:
+        FileImports: ``(file_name, imports, errors)`` with the set of dotted
+            names the file imports, standard library included, and the
+            list of exceptions met scanning it. A file that could not be
+            parsed reports its ``SyntaxError`` and the imports found with
+            regular expressions, a file that could not be read reports
+            the error and no imports. With ``jobs``, files come in the
+            order their chunks complete.
+    """
+    notebooks = _scan_notebooks(notebooks)
+    if files is None:
+        file_names = _walk_source_files(path, extra_ignore_dirs, follow_links, notebooks)
+    else:
+        file_names = _list_source_files(
+            path, files, IgnoreRules.for_project(path, extra_ignore_dirs),
+            get_file_extensions(notebooks))
+    results = _scan_files(file_names, encoding, jobs, chunk_size, cache_dir, notebooks)
+    try:
+        yield from results
+    finally:
+        results.close()
+
+
+def _walk_source_files(path, extra_ignore_dirs=None, follow_links=True, notebooks=False,
+                       candidates=None):
+    """Yield the paths of the files to scan under ``path``, one directory
+    at a time, see :func:`_walk_files`."""
+    rules = IgnoreRules.for_project(path, extra_ignore_dirs)
+    return _walk_files(path, rules, get_file_extensions(notebooks), follow_links, candidates)
+
+
+def _walk_files(path, rules, extensions, follow_links=True, candidates=None, directory=""):
+    """Yield the paths of the files with one of ``extensions`` under the
+    ``directory`` of the project at ``path``, one directory at a time.
+
+    The ignore files of every directory are read as it is walked, and the
+    directories ``rules`` leave out are pruned before they are walked.
+    The names of the directories walked and of the Python modules found
+    are added to the ``candidates`` set, they are the modules of the
+    project itself.
+
+    Directories and files are told apart by their ``(st_dev, st_ino)``:
+    with ``follow_links``, a directory already walked, through a symbolic
+    link loop or another link to it, is not walked again, and a file is
+    only yielded once however many links or hard links lead to it.
+    """
+    top = os.path.join(path, directory) if directory else path
+    dir_rules = {top: rules}
+    # Sizes of the files left out cost a stat each, only taken when shown
+    sizes = _profile.enabled or logging.getLogger().isEnabledFor(logging.DEBUG)
+    pruned = ignored = ignored_bytes = 0
+    visited_dirs = {_file_identity(top)} if follow_links else set()
+    visited_files = set()
+    duplicate_dirs = duplicate_files = 0
+
+    walk = os.walk(top, followlinks=follow_links)
+    try:
+        while True:
+            # Timed without hooks, walking is interleaved with scanning
+            with _profile.stage("walk", hooks=False):
+                step = next(walk, None)
+            if step is None:
+                return
+            root, dirs, files = step
+            relative = root[len(path):].strip(os.sep).replace(os.sep, "/")
+            local = dir_rules.pop(root).child(path, relative, files)
+
+            kept = []
+            for d in dirs:
+                if local.ignored(f"{relative}/{d}" if relative else d, is_dir=True):
+                    pruned += 1
+                    continue
+                if follow_links:
+                    identity = _file_identity(os.path.join(root, d))
+                    if identity is not None and identity in visited_dirs:
+                        duplicate_dirs += 1
+                        # Its name would have been seen walking it
+                        if candidates is not None:
+                            candidates.add(d)
+                        continue
+                    visited_dirs.add(identity)
+                kept.append(d)
+                dir_rules[os.path.join(root, d)] = local
+            dirs[:] = kept
+
+            if candidates is not None:
+                candidates.add(os.path.basename(root))
+                candidates.update(
+                    os.path.splitext(file)[0] for file in files
+                    if file_ext_is_allowed(file, DEFAULT_EXTENSIONS)
+                )
+
+            for fn in files:
+                if not file_ext_is_allowed(fn, extensions):
+                    continue
+                if local.ignored(f"{relative}/{fn}" if relative else fn):
+                    ignored += 1
+                    if sizes:
+                        try:
+                            ignored_bytes += os.stat(os.path.join(root, fn)).st_size
+                        except OSError:
+                            pass
+                    continue
+                identity = _file_identity(os.path.join(root, fn))
+                if identity is not None:
+                    if identity in visited_files:
+                        duplicate_files += 1
+                        continue
+                    visited_files.add(identity)
+                yield os.path.join(root, fn)
+    finally:
+        if duplicate_dirs or duplicate_files:
+            _profile.incr("duplicate_dirs", duplicate_dirs)
+            _profile.incr("duplicate_files", duplicate_files)
+            logging.debug(
+                f"Skipped under {top}: {duplicate_dirs} directories already walked "
+                f"(symbolic link loops or links to them), {duplicate_files} duplicate files"
+            )
+        if pruned or ignored:
+            _profile.incr("ignored_dirs", pruned)
+            _profile.incr("ignored_files", ignored)
+            _profile.incr("ignored_bytes", ignored_bytes)
+            logging.debug(
+                f"Ignored under {top}: {pruned} directories pruned, {ignored} files "
+                f"({ignored_bytes / 1024:.1f} KiB) skipped"
+            )
+
+
+def _file_identity(file_name):
+    """Return the ``(st_dev, st_ino)`` of the file or directory a path leads
+    to, or ``None`` if it can not be told."""
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        return None
+    # Some file systems do not number their files
+    return (st.st_dev, st.st_ino) if st.st_ino else None
+
+
+def _get_ignore_dirs(extra_ignore_dirs=None):
+    """Return the names of the directories left out of the scans."""
     ignore_dirs = [
         ".hg",
         ".svn",
         ".git",
         ".tox",
+        ".eggs",
         "__pycache__",
         "env",
         "venv",
         ".venv",
         ".ipynb_checkpoints",
+        "node_modules",
+        "dist",
+        "build",
     ]
 
     if extra_ignore_dirs:
@@ -148,146 +938,795 @@ def get_all_imports(
         for e in extra_ignore_dirs:
             ignore_dirs_parsed.append(os.path.basename(os.path.realpath(e)))
         ignore_dirs.extend(ignore_dirs_parsed)
+    return ignore_dirs
 
-    extensions = get_file_extensions()
 
-    walk = os.walk(path, followlinks=follow_links)
-    for root, dirs, files in walk:
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+class IgnoreRules(object):
+    """The files and directories left out of the scans.
 
-        candidates.append(os.path.basename(root))
-        py_files = [
-            file for file in files
-            if file_ext_is_allowed(file, DEFAULT_EXTENSIONS)
-        ]
-        candidates.extend([
-            os.path.splitext(filename)[0] for filename in py_files
-        ])
+    Directories are left out by name, and files and directories by the
+    patterns of the ``.gitignore`` and ``.mod2pipignore`` files of the
+    project and of its subdirectories, with the semantics of
+    ``.gitignore``: a pattern applies below the directory of its file, the
+    last pattern matching a path decides and ``!`` includes a path again.
+    The patterns in effect in a directory are compiled into one regular
+    expression.
 
-        files = [fn for fn in files if file_ext_is_allowed(fn, extensions)]
+    Args:
+        names (Iterable[str]): Names of the directories to leave out.
+        rules (List[Tuple[str, bool]]): Regular expressions of the patterns
+            in effect, see :func:`_ignore_pattern_regex`, in file order.
+    """
 
-        for file_name in files:
-            file_name = os.path.join(root, file_name)
-            contents = read_file_content(file_name, encoding)
+    def __init__(self, names=(), rules=()):
+        self.names = frozenset(names)
+        self.rules = list(rules)
+        self._regex = None
+        if self.rules:
+            # The first alternative that matches is the last pattern
+            self._regex = re.compile(
+                "|".join(f"({regex})" for regex, _ in reversed(self.rules)))
+
+    @classmethod
+    def for_project(cls, path, extra_ignore_dirs=None):
+        """Return the rules of the project at ``path`` before any ignore
+        file is read."""
+        return cls(_get_ignore_dirs(extra_ignore_dirs))
+
+    def child(self, path, directory, file_names):
+        """Return the rules in effect in ``directory`` of the project at
+        ``path``, given the names of the files it holds.
+
+        ``directory`` is relative to ``path`` and ``/`` separated. Its
+        ignore files are read if they are in ``file_names``.
+        """
+        rules = []
+        for name in IGNORE_FILES:
+            if name in file_names:
+                rules.extend(_read_ignore_file(os.path.join(path, directory, name), directory))
+        return IgnoreRules(self.names, self.rules + rules) if rules else self
+
+    def ignored(self, name, is_dir=False):
+        """Return whether the file or directory ``name``, relative to the
+        project and ``/`` separated, is left out."""
+        if is_dir and name.rpartition("/")[2] in self.names:
+            return True
+        if self._regex is None:
+            return False
+        match = self._regex.fullmatch(name + "/" if is_dir else name)
+        return match is not None and not self.rules[-match.lastindex][1]
+
+
+def _read_ignore_file(file_name, directory=""):
+    """Return the rules of the ignore file ``file_name`` of ``directory``,
+    or none if it can not be read."""
+    try:
+        with open(file_name, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    return [rule for rule in (_ignore_pattern_regex(line, directory) for line in lines) if rule]
 
-            try:
-                # Enhanced import detection
-                static_imports = _get_static_imports(contents)
-                dynamic_imports = _get_dynamic_imports(contents)
 
-                raw_imports.update(static_imports)
-                raw_imports.update(dynamic_imports)
+def _ignore_pattern_regex(pattern, directory=""):
+    """Translate a ``.gitignore`` pattern of the ignore file of
+    ``directory`` into a regular expression.
+
+    The expression matches the paths the pattern applies to, relative to
+    the project, ``/`` separated and with a trailing ``/`` for
+    directories.
+
+    Returns:
+        Tuple[str, bool]: The expression and whether the pattern is
+            negated, or ``None`` for blank lines, comments and patterns
+            that are not valid, such as ``[z-a]``, which git skips too.
+    """
+    if pattern.startswith("#"):
+        return None
+    # Trailing spaces are left out unless escaped
+    stripped = pattern.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(pattern):
+        stripped += " "
+    pattern = stripped
+    negated = pattern.startswith("!")
+    if negated or pattern.startswith(("\\!", "\\#")):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    # A slash anywhere but at the end anchors the pattern to its directory
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    parts = []
+    i = 0
+    try:
+        while i < len(pattern):
+            i = _translate_ignore_pattern(pattern, i, parts)
+        prefix = re.escape(directory + "/") if directory else ""
+        if not anchored:
+            prefix += "(?:.*/)?"
+        regex = prefix + "".join(parts) + ("/" if dir_only else "/?")
+        re.compile(regex)
+    except re.error:
+        return None
+    return regex, negated
+
+
+# Ranges of the POSIX character classes allowed in ``[...]``
+_IGNORE_CHAR_CLASSES = {
+    "alnum": "0-9A-Za-z", "alpha": "A-Za-z", "blank": " \\t",
+    "cntrl": "\\x00-\\x1f\\x7f", "digit": "0-9", "graph": "!-~", "lower": "a-z",
+    "print": " -~", "punct": "!-/:-@\\[-`{-~", "space": " \\t\\n\\r\\f\\v",
+    "upper": "A-Z", "xdigit": "0-9A-Fa-f",
+}
+
+
+def _translate_ignore_pattern(pattern, i, regex):
+    """Append the expression of the ``.gitignore`` pattern token at
+    ``pattern[i]`` to ``regex`` and return the index of the next token.
+
+    Raises:
+        re.error: If the token is a character class naming an unknown
+            POSIX class.
+    """
+    c = pattern[i]
+    if (pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/")
+            and pattern[i + 2:i + 3] in ("", "/")):
+        # "**/" is any number of directories, a final "/**" everything
+        # inside, but not the directory itself
+        regex.append("(?:.*/)?" if i + 2 < len(pattern) else ".+")
+        return i + 3
+    if c == "*":
+        regex.append("[^/]*")
+    elif c == "?":
+        regex.append("[^/]")
+    elif c == "[":
+        end = _translate_ignore_class(pattern, i, regex)
+        if end is None:
+            # An unclosed "[" is taken literally
+            regex.append(re.escape(c))
+        else:
+            i = end
+    elif c == "\\" and i + 1 < len(pattern):
+        i += 1
+        regex.append(re.escape(pattern[i]))
+    else:
+        regex.append(re.escape(c))
+    return i + 1
+
+
+def _translate_ignore_class(pattern, i, regex):
+    """Append the expression of the character class ``[...]`` opening at
+    ``pattern[i]`` to ``regex`` and return the index of its ``]``, or
+    ``None`` if it is not closed.
+
+    Every character of the class is escaped, so that ``[`` and the set
+    operations of future Python versions are taken literally, and the
+    POSIX classes such as ``[:space:]`` are replaced by their ranges. A
+    ``]`` right after the opening ``[``, ``[!`` or ``[^`` is a member.
+    """
+    j = i + 1
+    negated = pattern[j:j + 1] in ("!", "^")
+    if negated:
+        j += 1
+    members = []
+    start = j
+    while j < len(pattern) and (pattern[j] != "]" or j == start):
+        if pattern.startswith("[:", j) and ":]" in pattern[j + 2:]:
+            end = pattern.index(":]", j + 2)
+            name = pattern[j + 2:end]
+            if name not in _IGNORE_CHAR_CLASSES:
+                raise re.error(f"unknown character class {name!r}")
+            members.append(_IGNORE_CHAR_CLASSES[name])
+            j = end + 2
+            continue
+        first, j = _ignore_class_char(pattern, j)
+        if pattern[j:j + 1] == "-" and pattern[j + 1:j + 2] not in ("", "]"):
+            last, j = _ignore_class_char(pattern, j + 1)
+            members.append(re.escape(first) + "-" + re.escape(last))
+        else:
+            members.append(re.escape(first))
+    if j >= len(pattern):
+        return None
+    # A negated class does not match the separator either
+    regex.append(("[^/" if negated else "[") + "".join(members) + "]")
+    return j
+
+
+def _ignore_class_char(pattern, j):
+    """Return the character at ``pattern[j]`` of a character class, a
+    backslash escaping the next one, and the index after it."""
+    if pattern[j] == "\\" and j + 1 < len(pattern):
+        j += 1
+    return pattern[j], j + 1
+
+
+def _git(path, *args):
+    """Run ``git`` in ``path`` and return its output split on NUL bytes,
+    the commands are given ``-z``, or on lines."""
+    import subprocess
+
+    output = subprocess.run(
+        ["git", "-C", path, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return [os.fsdecode(line) for line in output.split(b"\0" if "-z" in args else b"\n")
+            if line]
+
+
+def _git_revision(path, ref):
+    """Return the commit id ``ref`` names, or ``None`` if it names none."""
+    import subprocess
+
+    try:
+        return _git(path, "rev-parse", "--verify", "--quiet", ref + "^{commit}")[0]
+    except (subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def _git_source_files(path, rules, extensions, follow_links, candidates=None):
+    """Return the files of ``path`` that :func:`_walk_source_files` would
+    scan, as listed by git, the set of those git does not track and the
+    directories git does not look into.
+
+    File names are relative to ``path`` and ``/`` separated. The
+    directories are submodules and, with ``follow_links``, symbolic links
+    to directories, which must be walked. Directories git lists no file
+    in, such as empty ones, are not added to ``candidates``.
+    """
+    # Patterns are matched afterwards, git's own matching of the ignore
+    # files could differ from that of the walk
+    excludes = [f"--exclude={name}" for name in sorted(rules.names)]
+    tracked = _git(path, "ls-files", "-z", "--stage")
+    untracked = _git(path, "ls-files", "-z", "--others", *excludes)
+
+    entries = {}
+    for entry in tracked:
+        meta, _, name = entry.partition("\t")
+        entries[name] = meta.split(" ", 1)[0]
+    entries.update(dict.fromkeys(untracked))
+    untracked = set(untracked)
+
+    file_names, others = _filter_file_list(path, entries, rules, extensions, candidates)
+    if candidates is not None:
+        candidates.add(os.path.basename(path))
+    directories = [
+        name for name in others
+        if entries[name] == "160000" or (
+            follow_links and entries[name] in ("120000", None)
+            and os.path.isdir(os.path.join(path, name)))
+    ]
+    return file_names, untracked & set(file_names), directories
+
+
+def _list_source_files(path, files, rules, extensions, candidates=None):
+    """Return the paths of the files of the list ``files`` that a walk of
+    ``path`` would scan, without walking it.
+
+    Relative paths are relative to ``path``. The directories and modules
+    of the list are added to ``candidates``.
+    """
+    names = []
+    for name in files:
+        if os.path.isabs(name):
+            name = os.path.relpath(name, path)
+        names.append(os.path.normpath(name).replace(os.sep, "/"))
+    file_names, _ = _filter_file_list(path, dict.fromkeys(names), rules, extensions, candidates)
+    if candidates is not None:
+        candidates.add(os.path.basename(path))
+    return [os.path.join(path, name) for name in file_names]
+
+
+def read_file_list(file_name):
+    """Return the paths listed in ``file_name``, or on the standard input
+    for ``-``, one per line or separated by NUL bytes (``git ls-files -z``).
+    """
+    if file_name == "-":
+        contents = sys.stdin.read()
+    else:
+        with open(file_name, "r") as f:
+            contents = f.read()
+    separator = "\0" if "\0" in contents else "\n"
+    return [name.strip("\r\n") for name in contents.split(separator) if name.strip()]
+
+
+def _filter_file_list(path, names, rules, extensions, candidates=None):
+    """Split ``names``, ``/`` separated paths relative to the project at
+    ``path``, into the files a walk of the project would scan and the
+    other entries of the directories it would enter.
+
+    The ignore files of the subdirectories are read when they are listed.
+    The directories it would enter and the Python modules found are added
+    to ``candidates``, like :func:`_walk_files` does.
+    """
+    ignore_files = {}
+    for name in names:
+        parent, _, base = name.rpartition("/")
+        if parent and base in IGNORE_FILES:
+            ignore_files.setdefault(parent, []).append(base)
+    # The rules in effect in each directory, None for those left out
+    dir_rules = {"": rules.child(path, "", IGNORE_FILES)}
+
+    def rules_for(directory):
+        if directory not in dir_rules:
+            parent, _, name = directory.rpartition("/")
+            local = rules_for(parent)
+            if local is None or local.ignored(directory, is_dir=True):
+                dir_rules[directory] = None
+            else:
+                dir_rules[directory] = local.child(
+                    path, directory, ignore_files.get(directory, ()))
+                if candidates is not None:
+                    candidates.add(name)
+        return dir_rules[directory]
+
+    file_names = []
+    others = []
+    for name in names:
+        parent, _, base = name.rpartition("/")
+        local = rules_for(parent)
+        if local is None:
+            continue
+        stem, ext = os.path.splitext(base)
+        if candidates is not None and ext in DEFAULT_EXTENSIONS:
+            candidates.add(stem)
+        if ext in extensions:
+            if not local.ignored(name):
+                file_names.append(name)
+        elif not local.ignored(name, is_dir=True):
+            others.append(name)
+    return file_names, others
+
+
+def _scan_changed_files(path, ref, encoding="utf-8", extra_ignore_dirs=None,
+                        follow_links=True, jobs=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                        cache_dir=None, notebooks=False, candidates=None):
+    """Yield ``(file_name, imports, errors)`` for every file under ``path``
+    like :func:`_scan_files` over :func:`_walk_source_files`, scanning only
+    the files changed since the git reference ``ref``.
+
+    The imports of the other files come from the baseline of ``ref``, the
+    imports of every tracked file at that commit kept in the scan cache.
+    Every run records the baseline of ``HEAD``, from the files that do not
+    differ from it, for the next one. Without a baseline for ``ref`` every
+    file is scanned, and without git the tree is walked.
+
+    Raises:
+        ValueError: If ``ref`` is not a commit of the repository.
+    """
+    import subprocess
+
+    rules = IgnoreRules.for_project(path, extra_ignore_dirs)
+    extensions = get_file_extensions(notebooks)
+    try:
+        file_names, untracked, directories = _git_source_files(
+            path, rules, extensions, follow_links, candidates)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Can not list the files of {path} with git, scanning every file: {e}")
+        file_names = _walk_source_files(
+            path, extra_ignore_dirs, follow_links, notebooks, candidates)
+        yield from _scan_files(file_names, encoding, jobs, chunk_size, cache_dir, notebooks)
+        return
+
+    revision = _git_revision(path, ref)
+    if revision is None:
+        raise ValueError(f"Unknown git reference: {ref}")
+    head = _git_revision(path, "HEAD")
+
+    cache = _open_scan_cache(cache_dir, "imports", encoding=encoding, notebooks=notebooks)
+    try:
+        baseline = cache.get_baseline("imports", revision) if cache else None
+        if baseline is None:
+            logging.info(f"No import baseline for {ref} in the scan cache, scanning every file")
+            baseline = {}
+        # Changes of the working tree since the commit, committed or not
+        changed = set(_git(path, "diff", "--name-only", "--no-renames", "--relative", "-z",
+                           revision, "--"))
+        if head == revision:
+            dirty = changed | untracked
+        elif head is not None:
+            dirty = untracked.union(_git(
+                path, "diff", "--name-only", "--no-renames", "--relative", "-z", "HEAD", "--"))
+        else:
+            dirty = None
+
+        pending = []
+        # The entries of files changed since are still those of the commit
+        head_baseline = dict(baseline) if head == revision else {}
+        for name in file_names:
+            imports = baseline.get(name) if name not in changed else None
+            if imports is None:
+                pending.append(name)
+                continue
+            if dirty is not None and name not in dirty:
+                head_baseline[name] = imports
+            yield FileImports(os.path.join(path, name), set(imports), [])
+        logging.debug(f"{len(pending)} of {len(file_names)} files changed since {ref}")
+        _profile.incr("baseline_hits", len(file_names) - len(pending))
+
+        # Deleted files are still listed by git until the deletion is staged
+        pending = [name for name in pending if os.path.exists(os.path.join(path, name))]
+        scanned = _scan_files(
+            (os.path.join(path, name) for name in pending), encoding, jobs, chunk_size,
+            cache_dir, notebooks)
+        try:
+            for result in scanned:
+                name = os.path.relpath(result.file_name, path).replace(os.sep, "/")
+                if dirty is not None and name not in dirty and all(
+                        isinstance(error, SyntaxError) for error in result.errors):
+                    head_baseline[name] = sorted(result.imports)
+                yield result
+        finally:
+            scanned.close()
+
+        for directory in directories:
+            walked = _walk_files(path, rules, extensions, follow_links, candidates, directory)
+            yield from _scan_files(walked, encoding, jobs, chunk_size, cache_dir, notebooks)
 
-            except Exception as exc:
-                if ignore_errors:
-                    traceback.print_exc(exc)
-                    logging.warn("Failed on file: %s" % file_name)
+        if cache and dirty is not None and (head != revision or head_baseline != baseline):
+            cache.set_baseline("imports", head, head_baseline)
+    finally:
+        if cache:
+            cache.close()
+
+
+def _scan_files(file_names, encoding="utf-8", jobs=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                cache_dir=None, notebooks=False):
+    """Yield ``(file_name, imports, errors)`` for every file of the iterable
+    ``file_names``, see :func:`iter_imports`.
+
+    Unchanged files are served from the scan cache. Files scanned without
+    errors are added to it, those with errors are scanned again next time
+    so that their errors are reported again.
+    """
+    cache = _open_scan_cache(cache_dir, "imports", encoding=encoding, notebooks=notebooks)
+    # Size, mtime and hash of the files scanned, for the cache entries
+    stamps = {} if cache else None
+    parallel = jobs is not None and jobs != 1
+    pending = []
+    pool = None
+    try:
+        for file_name in file_names:
+            cached = cache.get("imports", file_name) if cache else None
+            if cached is not None:
+                yield FileImports(file_name, set(cached), [])
+                continue
+            if not parallel:
+                results = [FileImports(
+                    file_name, *_scan_file(file_name, encoding, notebooks, stamps))]
+            else:
+                pending.append(file_name)
+                # Small projects are not worth starting the workers for
+                if pool is None and len(pending) > chunk_size:
+                    pool = _ScanPool(encoding, jobs, notebooks, stamps)
+                if pool is None or len(pending) < chunk_size:
                     continue
-                else:
-                    logging.error("Failed on file: %s" % file_name)
-                    raise exc
-
-    # Clean up imports
-    for name in [n for n in raw_imports if n]:
-        # Sanity check: Name could have been None if the import
-        # statement was as ``from . import X``
-        # Cleanup: We only want to first part of the import.
-        # Ex: from django.conf --> django.conf. But we only want django
-        # as an import.
-        cleaned_name, _, _ = name.partition(".")
-        imports.add(cleaned_name)
-
-    packages = imports - (set(candidates) & imports)
-    logging.debug("Found packages: {0}".format(packages))
+                results = pool.submit(pending[:chunk_size])
+                pending = pending[chunk_size:]
+            for result in results:
+                _cache_scan_result(cache, result, stamps)
+                yield result
+
+        if pool is None:
+            results = (FileImports(fn, *_scan_file(fn, encoding, notebooks, stamps))
+                       for fn in pending)
+        else:
+            results = pool.finish(pending)
+        for result in results:
+            _cache_scan_result(cache, result, stamps)
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+        if cache:
+            cache.close()
 
-    with open(join("stdlib"), "r") as f:
-        data = {x.strip() for x in f}
 
-    return list(packages - data)
+def _cache_scan_result(cache, result, stamps):
+    file_name, imports, errors = result
+    stamp = stamps.pop(file_name, None) if cache else None
+    if cache and not errors:
+        cache.set("imports", file_name, sorted(imports), stamp)
 
 
-def _get_static_imports(contents):
-    """Extract imports using AST parsing (existing method)."""
-    imports = set()
+def _scan_file(file_name, encoding="utf-8", notebooks=None, stamps=None):
+    """Return the raw (dotted, unfiltered) imports of a single file and the
+    list of errors met scanning it. See :func:`_read_text` for ``stamps``."""
+    errors = []
+    try:
+        contents = _read_source(file_name, encoding, notebooks, stamps)
+        _profile.incr("files_scanned")
+
+        # Enhanced import detection
+        imports = _get_imports(contents, errors)
+    except Exception as exc:
+        _profile.incr("scan_errors")
+        logging.error("Failed on file: %s" % file_name)
+        return set(), [exc]
+    return imports, errors
 
+
+def _scan_file_chunk(file_names, encoding="utf-8", notebooks=False, profile=False,
+                     stamps=False):
+    """Scan a chunk of files inside a worker process.
+
+    Args:
+        file_names (List[str]): Paths of the files to scan.
+        encoding (str): Encoding used to open the files.
+        notebooks (bool): Whether to scan Jupyter notebooks.
+        profile (bool): Whether the parent process is profiling, the
+            counters of the chunk are then returned with the stats.
+        stamps (bool): Whether to return the size, mtime and hash of the
+            files read with the stats, for the scan cache.
+
+    Returns:
+        tuple: A list of :class:`FileImports` for the chunk and a dict with the worker pid, number of files, bytes read,
+            elapsed time and profile counters.
+    """
+    previous = _set_profile(Profile() if profile else _NullProfile())
+
+    start = time.perf_counter()
+    results = []
+    num_bytes = 0
+    chunk_stamps = {} if stamps else None
     try:
-        tree = ast.parse(contents)
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import):
-                for subnode in node.names:
-                    if subnode.name:
-                        imports.add(subnode.name)
-            elif isinstance(node, ast.ImportFrom):
-                if node.module:
-                    imports.add(node.module)
-    except SyntaxError:
-        # If AST parsing fails, fall back to regex
-        imports.update(_get_regex_imports(contents))
+        for file_name in file_names:
+            results.append(FileImports(
+                file_name, *_scan_file(file_name, encoding, notebooks, chunk_stamps)))
+            try:
+                num_bytes += os.path.getsize(file_name)
+            except OSError:
+                pass
+    finally:
+        chunk_profile = _set_profile(previous)
+
+    stats = {
+        "pid": os.getpid(),
+        "files": len(file_names),
+        "bytes": num_bytes,
+        "seconds": time.perf_counter() - start,
+        "counters": chunk_profile.counters,
+        "stamps": chunk_stamps,
+    }
+    return results, stats
 
-    return imports
+
+class _ScanPool(object):
+    """Worker processes scanning chunks of files for imports.
+
+    At most two chunks per worker are in flight, ``submit()`` waits for
+    chunks to complete beyond that, so that the walk does not run ahead
+    of the workers and results do not pile up.
+
+    Args:
+        encoding (str): Encoding used to open the files.
+        jobs (int): Number of worker processes, ``0`` uses all CPUs.
+        notebooks (bool): Whether to scan Jupyter notebooks.
+        stamps (dict): Dict the size, mtime and hash of the files read are
+            added to, see :func:`_read_text`, or ``None``.
+    """
+
+    def __init__(self, encoding="utf-8", jobs=0, notebooks=False, stamps=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.encoding = encoding
+        self.notebooks = notebooks
+        self.stamps = stamps
+        self.max_workers = jobs or os.cpu_count() or 1
+        self.max_in_flight = 2 * self.max_workers
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.in_flight = set()
+        self.workers = {}
+        logging.debug("Scanning files with {0} workers".format(self.max_workers))
+
+    def submit(self, chunk):
+        """Queue ``chunk`` and return the results of the chunks completed
+        while waiting for room."""
+        results = []
+        while len(self.in_flight) >= self.max_in_flight:
+            results.extend(self._collect())
+        self.in_flight.add(self.executor.submit(
+            _scan_file_chunk, chunk, self.encoding, self.notebooks, _profile.enabled,
+            self.stamps is not None,
+        ))
+        return results
+
+    def finish(self, chunk):
+        """Scan the last ``chunk`` and yield the results of all the chunks
+        still in flight."""
+        if chunk:
+            yield from self.submit(chunk)
+        while self.in_flight:
+            yield from self._collect()
+
+    def _collect(self):
+        """Wait for a chunk to complete and return the results of the
+        completed chunks."""
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        done, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        results = []
+        for future in done:
+            chunk_results, stats = future.result()
+            results.extend(chunk_results)
+            _profile.merge(stats["counters"])
+            if self.stamps is not None:
+                self.stamps.update(stats["stamps"])
+            worker = self.workers.setdefault(
+                stats["pid"], {"chunks": 0, "files": 0, "bytes": 0, "seconds": 0.0}
+            )
+            worker["chunks"] += 1
+            worker["files"] += stats["files"]
+            worker["bytes"] += stats["bytes"]
+            worker["seconds"] += stats["seconds"]
+        return results
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        for pid, worker in sorted(self.workers.items()):
+            seconds = worker["seconds"] or 1e-9
+            logging.debug(
+                "Worker {0}: {1} chunks, {2} files, {3:.1f} KiB in {4:.2f}s "
+                "({5:.1f} files/s, {6:.1f} KiB/s)".format(
+                    pid, worker["chunks"], worker["files"], worker["bytes"] / 1024,
+                    worker["seconds"], worker["files"] / seconds,
+                    worker["bytes"] / 1024 / seconds,
+                )
+            )
+
+
+def _get_imports(contents, errors=None):
+    """Extract static and dynamic imports with a single parse and walk."""
+    return set().union(*_extract_imports(contents, errors))
+
+
+def _get_static_imports(contents):
+    """Extract ``import`` and ``from ... import`` statements."""
+    return _extract_imports(contents)[0]
 
 
 def _get_dynamic_imports(contents):
-    """Extract dynamic imports using pattern matching."""
-    imports = set()
+    """Extract imports made through ``__import__``, ``importlib`` or
+    ``exec``/``eval`` of source strings."""
+    return _extract_imports(contents)[1]
 
-    # Ensure contents is a string
-    if isinstance(contents, bytes):
-        contents = contents.decode('utf-8')
 
-    # Pattern 1: __import__('module_name')
-    import_pattern1 = re.compile(r'__import__\s*\(\s*["\']([^"\']+)["\']')
+def _extract_imports(contents, errors=None):
+    """Parse ``contents`` once and return its static and dynamic imports.
 
-    # Pattern 2: importlib.import_module('module_name')
-    import_pattern2 = re.compile(r'import_module\s*\(\s*["\']([^"\']+)["\']')
+    Files that can not be parsed (e.g. Python 2 sources) fall back to
+    line based regular expressions, their ``SyntaxError`` is appended to
+    the ``errors`` list if one is given.
 
-    # Pattern 3: exec("import module_name") or eval("import module_name")
-    exec_import_pattern = re.compile(
-        r'(?:exec|eval)\s*\(\s*["\'].*?import\s+([a-zA-Z_][a-zA-Z0-9_]*)')
+    Returns:
+        tuple: The set of static imports and the set of dynamic imports.
+    """
+    # Ensure contents is a string
+    if isinstance(contents, bytes):
+        contents = contents.decode('utf-8')
 
-    # Pattern 4: Dynamic imports in f-strings or format strings
-    fstring_import_pattern = re.compile(
-        r'f["\'].*?import\s+([a-zA-Z_][a-zA-Z0-9_]*)'
-    )
+    try:
+        tree = ast.parse(contents)
+    except SyntaxError as exc:
+        # If AST parsing fails, fall back to regex
+        _profile.incr("regex_fallbacks")
+        if errors is not None:
+            errors.append(exc)
+        return _get_regex_imports(contents), _get_regex_dynamic_imports(contents)
 
-    # Pattern 5: Conditional imports (try/except blocks)
-    try_import_pattern = re.compile(
-        r'try\s*:.*?import\s+([a-zA-Z_][a-zA-Z0-9_]*)', re.DOTALL
-    )
+    visitor = _ImportVisitor()
+    visitor.visit(tree)
+    return visitor.static_imports, visitor.dynamic_imports
 
-    # Pattern 6: Late imports (imports inside functions)
-    function_import_pattern = re.compile(
-        r'def\s+\w+.*?:\s*.*?import\s+([a-zA-Z_][a-zA-Z0-9_]*)', re.DOTALL)
 
-    patterns = [
-        import_pattern1, import_pattern2, exec_import_pattern,
-        fstring_import_pattern, try_import_pattern, function_import_pattern
-    ]
+class _ImportVisitor(ast.NodeVisitor):
+    """Collect static and dynamic imports in one walk over a module.
 
-    for pattern in patterns:
-        matches = pattern.findall(contents)
-        for match in matches:
-            if match and not match.startswith('.'):  # Skip relative imports
-                imports.add(match)
+    Imports inside functions, classes and ``try`` blocks are found simply
+    because the whole tree is visited. Dynamic imports are the string
+    arguments of ``__import__()``, ``import_module()`` and the sources
+    passed to ``exec()``/``eval()``. String arguments are constant folded:
+    literals, names assigned a string earlier in the file, ``+``
+    concatenation and f-strings made of those are all resolved.
+    """
 
-    # Additional pattern: Look for string literals that might be
-    # module names. This catches cases like:
-    # module_name = "requests"; __import__(module_name)
-    string_literals = re.findall(
-        r'["\']([a-zA-Z_][a-zA-Z0-9_]*)["\']', contents
-    )
-    potential_modules = set()
+    dynamic_import_funcs = {"__import__", "import_module"}
+    exec_funcs = {"exec", "eval"}
+    # Guards against exec("exec('...')") style recursion.
+    max_exec_depth = 3
+
+    def __init__(self, exec_depth=0):
+        self.static_imports = set()
+        self.dynamic_imports = set()
+        self.strings = {}
+        self.exec_depth = exec_depth
+
+    def visit_Import(self, node):
+        for subnode in node.names:
+            if subnode.name:
+                self.static_imports.add(subnode.name)
+
+    def visit_ImportFrom(self, node):
+        if node.module:
+            self.static_imports.add(node.module)
+            if not node.level:
+                # ``from google.cloud import storage`` may import the
+                # ``google.cloud.storage`` module of a namespace package.
+                self.static_imports.update(
+                    node.module + "." + alias.name
+                    for alias in node.names if alias.name != "*"
+                )
 
-    for literal in string_literals:
-        # Check if this string appears in an import context
-        if (f'__import__({literal})' in contents or
-            f'import_module({literal})' in contents or
-                literal in _get_common_package_names()):
-            potential_modules.add(literal)
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        value = self._fold(node.value)
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if value is None:
+                    self.strings.pop(target.id, None)
+                else:
+                    self.strings[target.id] = value
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if isinstance(func, ast.Name):
+            name = func.id
+        elif isinstance(func, ast.Attribute):
+            name = func.attr
+        else:
+            return
+        if not node.args:
+            return
 
-    imports.update(potential_modules)
+        if name in self.dynamic_import_funcs:
+            module = self._fold(node.args[0])
+            if module and not module.startswith("."):  # Skip relative imports
+                self.dynamic_imports.add(module)
+        elif name in self.exec_funcs and self.exec_depth < self.max_exec_depth:
+            source = self._fold(node.args[0])
+            if source and "import" in source:
+                self._visit_source(source)
 
-    return imports
+    def _visit_source(self, source):
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            self.dynamic_imports.update(_get_regex_imports(source))
+            return
+        visitor = _ImportVisitor(self.exec_depth + 1)
+        visitor.visit(tree)
+        self.dynamic_imports.update(visitor.static_imports)
+        self.dynamic_imports.update(visitor.dynamic_imports)
+
+    def _fold(self, node):
+        """Return the string value of ``node`` if it can be computed
+        statically, otherwise ``None``."""
+        if isinstance(node, ast.Constant):
+            return node.value if isinstance(node.value, str) else None
+        if isinstance(node, ast.Name):
+            return self.strings.get(node.id)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left = self._fold(node.left)
+            right = self._fold(node.right)
+            if left is not None and right is not None:
+                return left + right
+            return None
+        if isinstance(node, ast.JoinedStr):
+            parts = []
+            for value in node.values:
+                if isinstance(value, ast.FormattedValue):
+                    if value.conversion != -1 or value.format_spec is not None:
+                        return None
+                    value = value.value
+                part = self._fold(value)
+                if part is None:
+                    return None
+                parts.append(part)
+            return "".join(parts)
+        return None
 
 
 def _get_regex_imports(contents):
@@ -298,10 +1737,11 @@ def _get_regex_imports(contents):
     if isinstance(contents, bytes):
         contents = contents.decode('utf-8')
 
-    # Basic import patterns
+    # Basic import patterns, indented ones included so that imports in
+    # functions and try blocks are found as well.
     import_patterns = [
-        re.compile(r'^import\s+([a-zA-Z_][a-zA-Z0-9_]*)', re.MULTILINE),
-        re.compile(r'^from\s+([a-zA-Z_][a-zA-Z0-9_]*)\s+import', re.MULTILINE),
+        re.compile(r'^[ \t]*import\s+([a-zA-Z_][a-zA-Z0-9_]*)', re.MULTILINE),
+        re.compile(r'^[ \t]*from\s+([a-zA-Z_][a-zA-Z0-9_]*)\s+import', re.MULTILINE),
     ]
 
     for pattern in import_patterns:
@@ -311,36 +1751,74 @@ def _get_regex_imports(contents):
     return imports
 
 
-def _get_common_package_names():
-    """Return common package names to help identify dynamic imports."""
-    return {
-        'requests', 'numpy', 'pandas', 'matplotlib', 'scipy', 'sklearn',
-        'tensorflow', 'torch', 'flask', 'django', 'fastapi', 'sqlalchemy',
-        'pytest', 'click', 'pydantic', 'aiohttp', 'boto3', 'redis',
-        'celery', 'gunicorn', 'uvicorn', 'psycopg2', 'pymongo', 'pillow',
-        'opencv', 'beautifulsoup4', 'lxml', 'yaml', 'toml', 'json5',
-        'dateutil', 'pytz', 'arrow', 'pendulum', 'cryptography', 'jwt',
-        'httpx', 'websockets', 'asyncio', 'multiprocessing', 'threading'
-    }
+def _get_regex_dynamic_imports(contents):
+    """Fallback regex-based extraction of literal dynamic imports."""
+    imports = set()
 
+    for pattern in DYNAMIC_IMPORT_PATTERNS:
+        for match in pattern.findall(contents):
+            if not match.startswith('.'):  # Skip relative imports
+                imports.add(match)
+
+    return imports
 
-def get_file_extensions():
-    extensions = [".ipynb"] if scan_noteboooks else []
+
+def get_file_extensions(notebooks=None):
+    extensions = [".ipynb"] if _scan_notebooks(notebooks) else []
     return DEFAULT_EXTENSIONS + extensions
 
 
-def read_file_content(file_name: str, encoding="utf-8"):
+def _scan_notebooks(notebooks=None):
+    """Return ``notebooks``, or the module wide ``scan_noteboooks`` setting
+    when it is ``None``, as ``False``, ``True`` or ``"nbconvert"``."""
+    if notebooks is None:
+        notebooks = scan_noteboooks
+    return "nbconvert" if notebooks == "nbconvert" else bool(notebooks)
+
+
+def read_file_content(file_name: str, encoding="utf-8", notebooks=None):
+    return _read_source(file_name, encoding, notebooks)
+
+
+def _read_source(file_name, encoding="utf-8", notebooks=None, stamps=None):
+    """Return the source of ``file_name`` as scanned for imports, see
+    :func:`_read_text` for ``stamps``."""
     if file_ext_is_allowed(file_name, DEFAULT_EXTENSIONS):
-        with open(file_name, "r", encoding=encoding) as f:
-            contents = f.read()
-    elif file_ext_is_allowed(file_name, [".ipynb"]) and scan_noteboooks:
-        contents = ipynb_2_py(file_name, encoding=encoding)
-        # Ensure contents is a string, not bytes
-        if isinstance(contents, bytes):
-            contents = contents.decode(encoding)
+        contents = _read_text(file_name, encoding, stamps)
+    elif file_ext_is_allowed(file_name, [".ipynb"]) and _scan_notebooks(notebooks):
+        if _scan_notebooks(notebooks) == "nbconvert":
+            # nbconvert reads the file itself, it is not hashed for the cache
+            contents = ipynb_2_py(file_name, encoding=encoding)
+            # Ensure contents is a string, not bytes
+            if isinstance(contents, bytes):
+                contents = contents.decode(encoding)
+        else:
+            contents = _notebook_script(json.loads(_read_text(file_name, encoding, stamps)))
     return contents
 
 
+def _read_text(file_name, encoding="utf-8", stamps=None):
+    """Return the text of ``file_name``, with newlines translated like
+    ``open()`` in text mode.
+
+    With a ``stamps`` dict, the ``(size, mtime_ns, digest)`` of the bytes
+    read is stored in it under ``file_name``, so that the scan cache does
+    not read the file again to hash it.
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+        if stamps is not None:
+            import hashlib
+
+            st = os.fstat(f.fileno())
+            stamps[file_name] = (st.st_size, st.st_mtime_ns, hashlib.sha256(data).hexdigest())
+    _profile.incr("bytes_read", len(data))
+    text = data.decode(encoding)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
 def file_ext_is_allowed(file_name, acceptable):
     return os.path.splitext(file_name)[1] in acceptable
 
@@ -356,12 +1834,161 @@ def ipynb_2_py(file_name, encoding="utf-8"):
         str: parsed string
 
     """
-    exporter = PythonExporter()
+    exporter = _get_python_exporter()()
     (body, _) = exporter.from_filename(file_name)
 
     return body.encode(encoding)
 
 
+# Cell magics whose body is Python code, the body of any other is skipped
+PYTHON_CELL_MAGICS = frozenset(["time", "timeit", "capture", "prun", "debug"])
+# "files = !ls" and "result = %timeit -o f()"
+_MAGIC_ASSIGNMENT_RE = re.compile(r"^(\s*[\w.]+(?:\s*,\s*[\w.]+)*\s*=\s*)[!%]")
+# Characters of a line that open or close a bracket, a string or a comment,
+# or escape the next one, see _continuation()
+_CONTINUATION_RE = re.compile(r"""\\.?|'''|\"\"\"|['"#()\[\]{}]""")
+# "obj?", "obj??" and "?obj"
+_HELP_RE = re.compile(r"^\s*(?:\?{1,2}[\w.]+|[\w.]+\?{1,2})\s*$")
+
+
+def read_notebook(file_name, encoding="utf-8"):
+    """Return the code cells of a Jupyter notebook as a Python script.
+
+    The ``.ipynb`` JSON is read directly, without ``nbconvert``. IPython
+    syntax is removed with :func:`_strip_ipython` so that the script parses.
+
+    Args:
+        file_name (str): Path of the notebook.
+        encoding (str): Encoding of the notebook.
+
+    Returns:
+        str: The code cells, separated by blank lines.
+    """
+    return _notebook_script(json.loads(_read_text(file_name, encoding)))
+
+
+def _notebook_script(notebook):
+    """Return the code cells of the parsed ``notebook``, see :func:`read_notebook`."""
+    cells = notebook.get("cells")
+    if cells is None:
+        # nbformat 3 keeps the cells in worksheets, and the code in "input"
+        cells = [cell for sheet in notebook.get("worksheets", []) for cell in sheet.get("cells", [])]
+
+    sources = []
+    for cell in cells:
+        if cell.get("cell_type") != "code":
+            continue
+        source = cell.get("source", cell.get("input", ""))
+        if isinstance(source, list):
+            source = "".join(source)
+        source = _strip_ipython(source)
+        if source.strip():
+            sources.append(source)
+    return "\n\n".join(sources) + "\n"
+
+
+def _strip_ipython(source):
+    """Replace the IPython syntax of a notebook cell with plain Python.
+
+    Line magics, shell escapes and help requests become ``pass`` at the
+    same indentation, and an assignment from a magic or shell escape
+    assigns ``None``, so the lines around them still parse. They are only
+    recognized at the start of a statement, a line continuing an open
+    bracket, string or backslash, such as ``    % b)``, is Python. The body
+    of a cell magic is kept when it is Python code
+    (:data:`PYTHON_CELL_MAGICS`) and dropped otherwise.
+
+    Args:
+        source (str): Code of the cell.
+
+    Returns:
+        str: The cell as Python code.
+    """
+    lines = source.splitlines()
+    if lines and lines[0].lstrip().startswith("%%"):
+        magic = lines[0].lstrip()[2:].split(None, 1)
+        if not magic or magic[0] not in PYTHON_CELL_MAGICS:
+            return ""
+        lines[0] = ""
+
+    result = []
+    continued = False
+    # Python statement left open by the lines of result before "checked",
+    # only brought up to date when a line looks like IPython syntax
+    depth, quote, joined = 0, None, False
+    checked = 0
+    for line in lines:
+        if continued:
+            # Rest of a magic or shell escape continued with a backslash
+            continued = line.endswith("\\")
+            result.append("")
+            checked += 1
+            continue
+        stripped = line.lstrip()
+        magic = stripped.startswith(("%", "!"))
+        assignment = not magic and _MAGIC_ASSIGNMENT_RE.match(line)
+        if magic or assignment or _HELP_RE.match(line):
+            for previous in result[checked:]:
+                depth, quote, joined = _continuation(previous, depth, quote)
+            checked = len(result)
+            if not (depth or quote or joined):
+                indent = line[:len(line) - len(stripped)]
+                if assignment:
+                    result.append(assignment.group(1) + "None")
+                else:
+                    result.append(indent + "pass")
+                continued = bool(magic or assignment) and line.endswith("\\")
+                checked += 1
+                continue
+        result.append(line)
+    return "\n".join(result)
+
+
+def _continuation(line, depth, quote):
+    """Return how the Python statement of ``line`` is left open: the depth
+    of the brackets still open, the quotes of the string still open and
+    whether the line ends with a backslash.
+
+    ``depth`` and ``quote`` are those left open by the previous lines. Only
+    what tells a statement start from a continuation is tracked, the line
+    is not validated.
+    """
+    for match in _CONTINUATION_RE.finditer(line):
+        token = match.group()
+        if token[0] == "\\":
+            # An escape, or a backslash joining the next line
+            if len(token) == 1 and not quote:
+                return depth, quote, True
+        elif quote:
+            # Three quotes close a single quoted string and open an empty one
+            if token == quote or token == quote * 3:
+                quote = None
+        elif token == "#":
+            break
+        elif token[0] in "\"'":
+            quote = token
+        elif token in "([{":
+            depth += 1
+        else:
+            depth = max(depth - 1, 0)
+    # A string in single quotes ends with its line, unless continued
+    if quote in ("'", '"'):
+        if line.endswith("\\"):
+            return depth, quote, True
+        quote = None
+    return depth, quote, False
+
+
+@lru_cache(maxsize=None)
+def _get_python_exporter():
+    """Return the ``nbconvert`` exporter class used to read notebooks."""
+    try:
+        from nbconvert import PythonExporter
+    except ImportError:
+        raise NbconvertNotInstalled()
+    return PythonExporter
+
+
 def generate_requirements_file(path, imports, symbol, append=False):
     existing_packages = set()
     
@@ -422,65 +2049,383 @@ def output_requirements(imports, symbol):
 
 
 def get_imports_info(
-    imports, pypi_server="https://pypi.python.org/pypi/", proxy=None
+    imports, pypi_server=DEFAULT_PYPI_SERVER, proxy=None, session=None,
+    max_workers=PYPI_MAX_WORKERS, timeout=PYPI_TIMEOUT, total_timeout=None,
+    cache=None
 ):
+    """Resolve imports to their latest release on a PyPI server.
+
+    The lookups run concurrently over a shared keep-alive connection pool.
+    The result keeps the order of ``imports``.
+
+    Args:
+        imports (List[str]): Names to look up.
+        pypi_server (str): Base URL of the PyPI JSON API.
+        proxy (dict): Proxies passed to ``requests``.
+        session (requests.Session): Session to reuse, a new one is created
+            when ``None``. It is closed once the lookups, abandoned ones
+            included, have completed.
+        max_workers (int): Number of concurrent lookups.
+        timeout (float): Connect and read timeout of each request in seconds.
+        total_timeout (float): Seconds after which the lookups that have not
+            completed yet are abandoned, ``None`` to wait for all of them.
+        cache (PyPICache): Metadata cache to consult before the server.
+
+    Returns:
+        List[Requirement]: ``name``/``version`` records of the resolved packages.
+    """
     result = []
+    if not imports:
+        return result
 
     for item in imports:
-        try:
-            logging.warning(
-                'Import named "%s" not found locally. '
-                "Trying to resolve it at the PyPI server.",
-                item,
-            )
-            response = requests.get(
-                "{0}{1}/json".format(pypi_server, item), proxies=proxy
+        logging.warning(
+            'Import named "%s" not found locally. '
+            "Trying to resolve it at the PyPI server.",
+            item,
+        )
+
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    own_session = session is None
+    if own_session:
+        session = _new_session(max_workers)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(
+                _get_import_info, session, item, pypi_server, proxy, timeout,
+                cache
             )
-            if response.status_code == 200:
-                if hasattr(response.content, "decode"):
-                    data = json2package(response.content.decode())
-                else:
-                    data = json2package(response.content)
-            elif response.status_code >= 300:
-                raise HTTPError(
-                    status_code=response.status_code,
-                    reason=response.reason
+            for item in imports
+        ]
+        _, not_done = wait(futures, timeout=total_timeout)
+
+        for item, future in zip(imports, futures):
+            if future in not_done:
+                logging.warning(
+                    'Gave up resolving "%s" after %s seconds', item, total_timeout
                 )
-        except HTTPError:
+                continue
+            info = future.result()
+            if info is None:
+                continue
             logging.warning(
-                'Package "%s" does not exist or network problems', item
+                'Import named "%s" was resolved to "%s:%s" package (%s).\n'
+                "Please, verify manually the final list of requirements.txt "
+                "to avoid possible dependency confusions.",
+                item,
+                info["name"],
+                info["version"],
+                info["url"],
             )
-            continue
+            result.append(Requirement(info["name"], info["version"]))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if own_session:
+            _close_when_done(session, futures)
+    return result
+
+
+def _close_when_done(session, futures):
+    """Close ``session`` once the ``futures`` still running, lookups
+    abandoned after the total timeout, have completed."""
+    import threading
+
+    running = [future for future in futures if not future.done()]
+    if not running:
+        session.close()
+        return
+    lock = threading.Lock()
+    remaining = [len(running)]
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            session.close()
+
+    for future in running:
+        # Called at once if the future completed in the meantime
+        future.add_done_callback(done)
+
+
+def _get_import_info(session, item, pypi_server, proxy=None, timeout=PYPI_TIMEOUT,
+                     cache=None):
+    """Fetch the PyPI metadata of ``item``.
+
+    Returns:
+        dict: The metadata record of the package (see
+            :func:`_fetch_pypi_metadata`), or ``None`` if it could not be
+            found.
+    """
+    import requests
+
+    try:
+        info = _fetch_pypi_metadata(session, item, pypi_server, proxy, timeout, cache)
+    except requests.Timeout:
+        logging.warning('Timed out resolving "%s" at the PyPI server', item)
+        return None
+
+    if info is None:
         logging.warning(
-            'Import named "%s" was resolved to "%s:%s" package (%s).\n'
-            "Please, verify manually the final list of requirements.txt "
-            "to avoid possible dependency confusions.",
-            item,
-            data.name,
-            data.latest_release_id,
-            data.pypi_url,
+            'Package "%s" does not exist or network problems', item
         )
-        result.append({"name": data.name, "version": data.latest_release_id})
-    return result
+    return info
+
+
+def _fetch_pypi_metadata(session, name, pypi_server=DEFAULT_PYPI_SERVER, proxy=None,
+                         timeout=PYPI_TIMEOUT, cache=None):
+    """Return the ``name``, latest ``version``, ``requires_dist`` and
+    ``url`` of a package from the PyPI JSON API, or ``None`` if the server
+    does not know it.
+
+    Fresh cache entries, negative ones included, are returned without a
+    request. Expired entries are revalidated with ``If-None-Match`` /
+    ``If-Modified-Since``.
+    """
+    entry = cache.get(pypi_server, name) if cache else None
+    if entry and entry["fresh"]:
+        _profile.incr("pypi_cache_hits")
+        return entry["data"]
+
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    _profile.incr("http_requests")
+    response = session.get(
+        "{0}{1}/json".format(pypi_server, name),
+        headers=headers, proxies=proxy, timeout=timeout,
+    )
+    _profile.incr("http_bytes", len(response.content))
+
+    if response.status_code == 304 and entry:
+        _profile.incr("http_not_modified")
+        cache.revalidated(pypi_server, name)
+        return entry["data"]
+
+    if response.status_code == 200:
+        info = response.json()["info"]
+        data = {
+            "name": info["name"],
+            "version": info["version"],
+            "requires_dist": info.get("requires_dist") or [],
+            "url": info.get("package_url"),
+        }
+    elif response.status_code == 404:
+        data = None
+    else:
+        return None
+
+    if cache:
+        cache.set(
+            pypi_server, name, data,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return data
+
+
+class PyPICache(object):
+    """Persistent cache of the PyPI metadata used by mod2pip, in SQLite.
+
+    Only the fields mod2pip needs are stored, along with the validators
+    of the response. Packages the server does not know are cached as
+    well, so local module names are not queried on every run. Entries
+    older than ``ttl`` are revalidated, and the least recently used ones
+    beyond ``max_entries`` are pruned when the cache is closed.
+
+    Every new entry is committed at once and the access times are written
+    when the cache is closed, so that the write lock is only held briefly
+    and runs sharing the cache do not wait for each other. If the cache
+    stays locked, it is no longer updated but the lookups go on.
+
+    Args:
+        cache_dir (str): Directory holding the cache database.
+        ttl (float): Seconds an entry is used without revalidation.
+        max_entries (int): Maximum number of cached packages.
+    """
+
+    filename = "pypi.sqlite3"
+    # Seconds to wait for another run holding the lock
+    timeout = 10
+
+    def __init__(self, cache_dir, ttl=PYPI_CACHE_TTL, max_entries=PYPI_CACHE_SIZE):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.filename)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writable = True
+        import sqlite3
+        import threading
+
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata "
+            "(server TEXT, name TEXT, data TEXT, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL, accessed_at REAL, PRIMARY KEY (server, name))"
+        )
+
+    def get(self, server, name):
+        """Return the cached entry of ``name`` as a dict with the ``data``,
+        ``etag``, ``last_modified`` and ``fresh`` keys, or ``None``."""
+        import sqlite3
+
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT data, etag, last_modified, fetched_at FROM metadata "
+                    "WHERE server = ? AND name = ?", (server, name)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._accessed[server, name] = now
+            fresh = now - row[3] < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return {
+            "data": json.loads(row[0]),
+            "etag": row[1],
+            "last_modified": row[2],
+            "fresh": fresh,
+        }
+
+    def set(self, server, name, data, etag=None, last_modified=None):
+        """Store the metadata of ``name``, ``None`` meaning it does not exist."""
+        now = time.time()
+        self._write(
+            ("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)",
+             [(server, name, json.dumps(data), etag, last_modified, now, now)]),
+        )
+
+    def revalidated(self, server, name):
+        """Mark the entry of ``name`` as confirmed by the server."""
+        self._write(
+            ("UPDATE metadata SET fetched_at = ? WHERE server = ? AND name = ?",
+             [(time.time(), server, name)]),
+        )
+
+    def prune(self):
+        """Write the access times and remove the least recently used
+        entries beyond ``max_entries``."""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        self._write(
+            ("UPDATE metadata SET accessed_at = ? WHERE server = ? AND name = ?",
+             [(now, server, name) for (server, name), now in accessed.items()]),
+            ("DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata "
+             "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", [(self.max_entries,)]),
+        )
+
+    def _write(self, *statements):
+        """Run the ``(sql, rows)`` statements in one transaction. If the
+        database is locked by another run, stop updating the cache."""
+        import sqlite3
+
+        with self._lock:
+            if not self.writable:
+                return
+            try:
+                with self._conn:
+                    for sql, rows in statements:
+                        self._conn.executemany(sql, rows)
+            except sqlite3.OperationalError as e:
+                logging.warning(f"PyPI cache {self.path} is not updated: {e}")
+                self.writable = False
+
+    def close(self):
+        logging.debug(
+            "PyPI cache {0}: {1} hits, {2} misses".format(
+                self.path, self.hits, self.misses)
+        )
+        self.prune()
+        self._conn.close()
+
+
+def _user_cache_dir():
+    """Return the per-user cache directory of mod2pip."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "mod2pip")
+
+
+def _scan_cache_dir(path):
+    """Return the default scan cache directory of the project at ``path``,
+    in the per-user cache directory rather than in the project."""
+    import hashlib
+
+    project = os.path.abspath(path).encode("utf-8", "surrogateescape")
+    return os.path.join(_user_cache_dir(), "scan", hashlib.sha256(project).hexdigest()[:16])
+
 
+def _open_pypi_cache(cache_dir, ttl=PYPI_CACHE_TTL, max_entries=PYPI_CACHE_SIZE):
+    """Open the PyPI metadata cache, or return ``None`` if caching is
+    disabled or the cache can not be used."""
+    if not cache_dir:
+        return None
+    import sqlite3
 
-def get_locally_installed_packages(encoding="utf-8"):
+    try:
+        return PyPICache(cache_dir, ttl=ttl, max_entries=max_entries)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"PyPI cache disabled, could not open {cache_dir}: {e}")
+        return None
+
+
+def _new_session(pool_size=PYPI_MAX_WORKERS):
+    """Return a ``requests`` session whose connection pool can keep one
+    connection alive per concurrent lookup."""
+    # requests takes longer to import than the rest of mod2pip, and the
+    # --use-local, --diff and --validate-env runs never need it.
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_locally_installed_packages(encoding="utf-8", paths=None, metadata_dirs=None):
     """Enhanced package detection supporting conda, editable installs,
-    and namespace packages."""
+    and namespace packages.
+
+    ``paths`` are the site directories to search, ``sys.path`` by default.
+    Returns a list of :class:`Distribution` records. A ``metadata_dirs``
+    dict is filled like :func:`_get_metadata_dirs` in the same pass.
+    """
     packages = []
     ignore = ["tests", "_tests", "egg", "EGG", "info"]
 
     # Get packages from multiple sources
-    packages.extend(_get_pip_packages(encoding, ignore))
+    packages.extend(_get_pip_packages(encoding, ignore, paths, metadata_dirs))
     packages.extend(_get_conda_packages(encoding, ignore))
-    packages.extend(_get_editable_packages(encoding, ignore))
-    packages.extend(_get_namespace_packages(encoding, ignore))
+    packages.extend(_get_editable_packages(encoding, ignore, paths))
+    packages.extend(_get_namespace_packages(encoding, ignore, paths))
 
     # Remove duplicates while preserving order
     seen = set()
     unique_packages = []
     for pkg in packages:
-        pkg_key = (pkg["name"], tuple(sorted(pkg["exports"])))
+        pkg_key = (pkg.name, tuple(sorted(pkg.exports)))
         if pkg_key not in seen:
             seen.add(pkg_key)
             unique_packages.append(pkg)
@@ -488,69 +2433,206 @@ def get_locally_installed_packages(encoding="utf-8"):
     return unique_packages
 
 
-def _get_pip_packages(encoding="utf-8", ignore=None):
-    """Get packages from standard pip/setuptools installations."""
+def _get_pip_packages(encoding="utf-8", ignore=None, paths=None, metadata_dirs=None):
+    """Get packages from standard pip/setuptools installations.
+
+    Only the top level of every site directory is listed; the metadata
+    files are read for the ``*.dist-info``/``*.egg-info`` directories
+    found there. Those directories are also added to the ``metadata_dirs``
+    dict, if given, see :func:`_get_metadata_dirs`.
+    """
     if ignore is None:
         ignore = ["tests", "_tests", "egg", "EGG", "info"]
 
     packages = []
-    for path in sys.path:
-        if not os.path.exists(path):
+    for metadata_dir in _iter_metadata_dirs(paths):
+        if metadata_dirs is not None:
+            metadata_dirs.setdefault(_metadata_dir_key(metadata_dir), metadata_dir)
+        package = _read_distribution(metadata_dir, encoding, ignore)
+        if package:
+            packages.append(package)
+
+    return packages
+
+
+def _iter_metadata_dirs(paths=None):
+    """Yield the ``*.dist-info`` and ``*.egg-info`` directories found at
+    the top level of ``paths`` (defaults to ``sys.path``)."""
+    seen = set()
+    for path in sys.path if paths is None else paths:
+        if not path or not os.path.isdir(path):
             continue
+        real_path = os.path.realpath(path)
+        if real_path in seen:
+            continue
+        seen.add(real_path)
 
-        for root, dirs, files in os.walk(path):
-            # Look for dist-info and egg-info directories
-            if any(suffix in root for suffix in [".dist-info", ".egg-info"]):
-                top_level_file = None
-                metadata_file = None
-
-                # Find top_level.txt and METADATA/PKG-INFO
-                for item in files:
-                    if "top_level" in item.lower():
-                        top_level_file = os.path.join(root, item)
-                    elif item in ["METADATA", "PKG-INFO"]:
-                        metadata_file = os.path.join(root, item)
-
-                if top_level_file:
-                    try:
-                        with open(top_level_file, "r", encoding=encoding) as f:
-                            top_level_modules = [
-                                m.strip() for m in f.read().strip().split("\n") if m.strip()]
-                    except (IOError, UnicodeDecodeError):
-                        continue
-                else:
-                    # Fallback: infer from package name
-                    package_name = os.path.basename(root).split("-")[0]
-                    top_level_modules = [package_name.replace("_", "").replace("-", "")]
-
-                # Extract package name and version
-                package_parts = os.path.basename(root).split("-")
-                package_name = package_parts[0]
-                version = None
-
-                if len(package_parts) > 1:
-                    version = package_parts[1].replace(".dist", "").replace(".egg", "")
-
-                # Try to get version from metadata if not found
-                if not version and metadata_file:
-                    version = _extract_version_from_metadata(metadata_file, encoding)
-
-                # Filter modules
-                filtered_modules = [
-                    module for module in top_level_modules
-                    if module and module not in ignore and package_name not in ignore
-                ]
-
-                if filtered_modules:
-                    packages.append({
-                        "name": package_name,
-                        "version": version,
-                        "exports": filtered_modules,
-                    })
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.endswith((".dist-info", ".egg-info")) and entry.is_dir():
+                yield entry.path
+
+
+def _get_metadata_dirs(paths=None):
+    """Map the normalized name of every installed distribution to its
+    metadata directory, the first one found on ``paths`` winning."""
+    metadata_dirs = {}
+    for metadata_dir in _iter_metadata_dirs(paths):
+        metadata_dirs.setdefault(_metadata_dir_key(metadata_dir), metadata_dir)
+    return metadata_dirs
+
+
+def _metadata_dir_key(metadata_dir):
+    """Return the normalized distribution name of a metadata directory."""
+    dir_name = os.path.splitext(os.path.basename(metadata_dir))[0]
+    return _normalize_name(dir_name.split("-")[0])
+
+
+def _read_distribution(metadata_dir, encoding="utf-8", ignore=()):
+    """Build the :class:`Distribution` record of a distribution from its
+    metadata directory, or return ``None`` if it exports nothing.
+
+    The exported modules come from ``top_level.txt``, then from the
+    installed files listed in ``RECORD``, and are otherwise inferred
+    from the distribution name. ``modules`` are the exports with every
+    namespace package replaced by the packages the distribution installs
+    in it, e.g. ``google.cloud.storage`` instead of ``google``.
+    """
+    _profile.incr("dist_infos_read")
+    # e.g. "Flask-2.0.1.dist-info" or "foo-1.0-py3.9.egg-info"
+    dir_name = os.path.basename(metadata_dir)
+    package_parts = os.path.splitext(dir_name)[0].split("-")
+    package_name = package_parts[0]
+    version = package_parts[1] if len(package_parts) > 1 else None
+
+    top_level_file = os.path.join(metadata_dir, "top_level.txt")
+    try:
+        with open(top_level_file, "r", encoding=encoding) as f:
+            top_level_modules = [
+                m.strip() for m in f.read().strip().split("\n") if m.strip()]
+    except FileNotFoundError:
+        top_level_modules = _get_record_top_level(
+            os.path.join(metadata_dir, "RECORD"), encoding)
+        if not top_level_modules:
+            # Fallback: infer from package name
+            top_level_modules = [package_name.replace("_", "").replace("-", "")]
+    except (IOError, UnicodeDecodeError):
+        return None
+
+    # Try to get version from metadata if not found
+    if not version:
+        for metadata_file in ["METADATA", "PKG-INFO"]:
+            metadata_path = os.path.join(metadata_dir, metadata_file)
+            if os.path.exists(metadata_path):
+                version = _extract_version_from_metadata(metadata_path, encoding)
+                break
+
+    # Filter modules
+    filtered_modules = [
+        module for module in top_level_modules
+        if module and module not in ignore and package_name not in ignore
+    ]
+
+    if not filtered_modules:
+        return None
+
+    return Distribution(
+        package_name, version, filtered_modules,
+        _get_namespace_modules(metadata_dir, filtered_modules, encoding),
+    )
+
+
+def _get_namespace_modules(metadata_dir, exports, encoding="utf-8"):
+    """Return ``exports`` with the namespace packages among them replaced
+    by the dotted names of the packages installed in them, read from the
+    ``RECORD`` file of the distribution.
+
+    A namespace package is an installed directory without ``__init__.py``,
+    so ``RECORD`` is only read for distributions that have one.
+    """
+    site_dir = os.path.dirname(metadata_dir)
+    namespaces = {
+        export for export in exports
+        if os.path.isdir(os.path.join(site_dir, export))
+        and not os.path.exists(os.path.join(site_dir, export, "__init__.py"))
+    }
+    if not namespaces:
+        return list(exports)
+
+    packages = _get_record_packages(
+        os.path.join(metadata_dir, "RECORD"), namespaces, encoding)
+    modules = []
+    for export in exports:
+        found = packages.get(export) if export in namespaces else None
+        modules.extend(found or [export])
+    return modules
+
+
+def _get_record_packages(record_file, namespaces, encoding="utf-8"):
+    """Map every namespace package in ``namespaces`` to the dotted names
+    of the outermost regular packages and modules installed below it
+    according to a RECORD file."""
+    files = []
+    try:
+        with open(record_file, "r", encoding=encoding) as f:
+            for line in f:
+                path = line.rsplit(",", 2)[0].strip().strip('"')
+                parts = path.split("/")
+                if len(parts) > 1 and parts[0] in namespaces:
+                    files.append(parts)
+    except (IOError, UnicodeDecodeError):
+        return {}
 
+    package_dirs = {tuple(parts[:-1]) for parts in files if parts[-1] == "__init__.py"}
+    packages = {}
+    for parts in files:
+        for depth in range(2, len(parts)):
+            if tuple(parts[:depth]) in package_dirs:
+                names = parts[:depth]
+                break
+        else:
+            # A module directly inside the namespace directories
+            if not parts[-1].endswith((".py", ".so", ".pyd")):
+                continue
+            names = parts[:-1] + [parts[-1].partition(".")[0]]
+        if all(name.isidentifier() for name in names):
+            name = ".".join(names)
+            modules = packages.setdefault(parts[0], [])
+            if name not in modules:
+                modules.append(name)
     return packages
 
 
+def _get_record_top_level(record_file, encoding="utf-8"):
+    """Return the top level modules installed according to a RECORD file."""
+    modules = []
+    try:
+        with open(record_file, "r", encoding=encoding) as f:
+            for line in f:
+                path = line.rsplit(",", 2)[0].strip().strip('"')
+                top, sep, _ = path.partition("/")
+                if not top or top.startswith(".") or "__pycache__" in top:
+                    continue
+                if sep:
+                    # Skip the metadata and the *.data directories
+                    if top.endswith((".dist-info", ".egg-info", ".data")):
+                        continue
+                    module = top
+                elif top.endswith((".py", ".so", ".pyd")):
+                    # Single module, e.g. six.py or _cffi_backend.cpython-312.so
+                    module = top.partition(".")[0]
+                else:
+                    continue
+                if module.isidentifier() and module not in modules:
+                    modules.append(module)
+    except (IOError, UnicodeDecodeError):
+        return []
+    return modules
+
+
 def _get_conda_packages(encoding="utf-8", ignore=None):
     """Get packages from conda environments."""
     if ignore is None:
@@ -585,11 +2667,7 @@ def _get_conda_packages(encoding="utf-8", ignore=None):
                     import_names = _get_conda_import_mapping(package_name)
 
                     if import_names:
-                        packages.append({
-                            "name": package_name,
-                            "version": version,
-                            "exports": import_names,
-                        })
+                        packages.append(Distribution(package_name, version, import_names))
 
                 except (json.JSONDecodeError, IOError):
                     continue
@@ -601,14 +2679,14 @@ def _get_conda_packages(encoding="utf-8", ignore=None):
     return packages
 
 
-def _get_editable_packages(encoding="utf-8", ignore=None):
+def _get_editable_packages(encoding="utf-8", ignore=None, paths=None):
     """Get editable/development packages from .egg-link files."""
     if ignore is None:
         ignore = ["tests", "_tests", "egg", "EGG", "info"]
 
     packages = []
 
-    for path in sys.path:
+    for path in sys.path if paths is None else paths:
         if not os.path.exists(path):
             continue
 
@@ -640,11 +2718,7 @@ def _get_editable_packages(encoding="utf-8", ignore=None):
                         # Fallback: use package name
                         import_names = [package_name.replace("-", "_")]
 
-                    packages.append({
-                        "name": package_name,
-                        "version": version,
-                        "exports": import_names,
-                    })
+                    packages.append(Distribution(package_name, version, import_names))
 
                 except (IOError, UnicodeDecodeError):
                     continue
@@ -652,14 +2726,14 @@ def _get_editable_packages(encoding="utf-8", ignore=None):
     return packages
 
 
-def _get_namespace_packages(encoding="utf-8", ignore=None):
+def _get_namespace_packages(encoding="utf-8", ignore=None, paths=None):
     """Get namespace packages (PEP 420) that don't have __init__.py files."""
     if ignore is None:
         ignore = ["tests", "_tests", "egg", "EGG", "info"]
 
     packages = []
 
-    for path in sys.path:
+    for path in sys.path if paths is None else paths:
         if not os.path.exists(path):
             continue
 
@@ -680,25 +2754,63 @@ def _get_namespace_packages(encoding="utf-8", ignore=None):
                         break
 
                 if has_python_files:
-                    packages.append({
-                        "name": item,
-                        "version": None,
-                        "exports": [item],
-                    })
+                    packages.append(Distribution(item, None, [item]))
 
     return packages
 
 
 def _extract_version_from_metadata(metadata_file, encoding="utf-8"):
     """Extract version from METADATA or PKG-INFO file."""
+    metadata = _read_metadata(metadata_file, encoding)
+    return metadata.version if metadata else None
+
+
+def _read_metadata(metadata_file, encoding="utf-8"):
+    """Read the header block of a METADATA or PKG-INFO file.
+
+    Only the lines up to the first blank line are read, so the long
+    description that follows is never loaded.
+
+    Returns:
+        Metadata: The headers, or ``None`` if the file cannot be read.
+    """
+    _profile.incr("metadata_files_read")
     try:
         with open(metadata_file, "r", encoding=encoding) as f:
-            for line in f:
-                if line.startswith("Version:"):
-                    return line.split(":", 1)[1].strip()
+            return _parse_metadata_headers(f)
     except (IOError, UnicodeDecodeError):
-        pass
-    return None
+        return None
+
+
+def _parse_metadata_headers(lines):
+    """Parse the RFC 822 header block of metadata ``lines``.
+
+    Headers continued on indented lines are joined, parsing stops at the
+    first blank line.
+    """
+    headers = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            break
+        if line[0] in " \t":
+            if headers:
+                headers[-1][1] += " " + line.strip()
+            continue
+        key, sep, value = line.partition(":")
+        if sep:
+            headers.append([key.strip(), value.strip()])
+
+    fields = {"Name": None, "Version": None, "Requires-Dist": [], "Provides-Extra": []}
+    for key, value in headers:
+        if key not in fields:
+            continue
+        if isinstance(fields[key], list):
+            fields[key].append(value)
+        elif fields[key] is None:
+            fields[key] = value
+    return Metadata(
+        fields["Name"], fields["Version"], fields["Requires-Dist"], fields["Provides-Extra"])
 
 
 def _get_conda_import_mapping(conda_package_name):
@@ -774,34 +2886,159 @@ def _parse_pyproject_toml(pyproject_path, package_name):
     return import_names, version
 
 
-def get_import_local(imports, encoding="utf-8"):
-    local = get_locally_installed_packages()
+class ModuleTrie(object):
+    """Dotted module names mapped to values, matched by longest prefix.
+
+    ``google.cloud.storage.blob`` matches ``google.cloud.storage`` before
+    ``google``, in as many dict lookups as the name has parts, however
+    many names are stored.
+
+    Args:
+        items (Iterable[tuple]): ``(dotted_name, value)`` pairs to insert.
+    """
+
+    def __init__(self, items=()):
+        self.root = {}
+        for name, value in items:
+            self.insert(name, value)
+
+    def insert(self, name, value):
+        """Add ``value`` to the values of the dotted name ``name``."""
+        node = self.root
+        for part in name.split("."):
+            node = node.setdefault(part, {})
+        # Parts are strings, so None can not clash with a child
+        node.setdefault(None, []).append(value)
+
+    def match(self, name):
+        """Return the depth and the values of the longest stored prefix of
+        the dotted name ``name``, or ``(0, [])`` if none is stored."""
+        node = self.root
+        depth, values = 0, []
+        for position, part in enumerate(name.split("."), 1):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                depth, values = position, node[None]
+        return depth, values
+
+
+class EnvironmentIndex(object):
+    """Lookup tables over the locally installed distributions.
+
+    Every exported top level module and every normalized distribution
+    name maps to the distribution records providing it, so that matching
+    an import is a dict lookup instead of a scan of all distributions.
+    The packages installed inside namespace packages are kept in a
+    :class:`ModuleTrie`, ``modules``.
+
+    It also knows where the metadata of every distribution lives, so the
+    requirements of a distribution are read at most once.
+
+    Args:
+        packages (List[Distribution]): The distributions, as returned by
+            :func:`get_locally_installed_packages`. ``name``/``version``/
+            ``exports`` dicts are converted.
+        metadata_dirs (dict): Normalized distribution names mapped to
+            their ``.dist-info``/``.egg-info`` directory.
+    """
+
+    def __init__(self, packages, metadata_dirs=None):
+        self.packages = [Distribution.from_mapping(package) for package in packages]
+        self.metadata_dirs = metadata_dirs or {}
+        self.by_export = {}
+        self.by_name = {}
+        self.modules = ModuleTrie()
+        self._requires = {}
+        for package in self.packages:
+            for export in package.exports:
+                self.by_export.setdefault(export, []).append(package)
+            if package.modules is not package.exports:
+                for module in package.modules:
+                    if "." in module:
+                        self.modules.insert(module, package)
+            self.by_name.setdefault(
+                _normalize_name(package.name), []).append(package)
+
+    @classmethod
+    def from_environment(cls, encoding="utf-8", paths=None):
+        """Build the index of the packages installed in this environment,
+        or in the site directories ``paths``."""
+        metadata_dirs = {}
+        packages = get_locally_installed_packages(
+            encoding=encoding, paths=paths, metadata_dirs=metadata_dirs)
+        return cls(packages, metadata_dirs)
+
+    def lookup(self, item):
+        """Return the distributions exporting ``item`` or named ``item``."""
+        exporting = self.by_export.get(item) or self.by_export.get(item.lower(), [])
+        return exporting + self.by_name.get(_normalize_name(item), [])
+
+    def __contains__(self, item):
+        return bool(self.lookup(item))
+
+    def version(self, name):
+        """Return the installed version of the distribution ``name``."""
+        packages = self.by_name.get(_normalize_name(name))
+        return packages[0].version if packages else None
+
+    def requires(self, name):
+        """Return the requirements, markers included, of the installed
+        distribution ``name``, or ``None`` if it is not installed."""
+        key = _normalize_name(name)
+        if key not in self._requires:
+            metadata_dir = self.metadata_dirs.get(key)
+            self._requires[key] = (
+                None if metadata_dir is None else _read_requirements(metadata_dir)
+            )
+        return self._requires[key]
+
+
+def _normalize_name(name):
+    """Normalize a distribution name as described in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def get_import_local(imports, encoding="utf-8", index=None):
+    if index is None:
+        index = EnvironmentIndex.from_environment(encoding=encoding)
+
+    # if candidate import name matches export name
+    # or candidate import name equals to the package name
+    # append it to the result, removing duplicates of package/version
+    seen = set()
     result = []
     for item in imports:
-        # search through local packages
-        for package in local:
-            # if candidate import name matches export name
-            # or candidate import name equals to the package name
-            # append it to the result
-            if item in package["exports"] or item == package["name"]:
+        for package in index.lookup(item):
+            key = (package.name, package.version)
+            if key not in seen:
+                seen.add(key)
                 result.append(package)
 
-    # removing duplicates of package/version
-    # had to use second method instead of the previous one,
-    # because we have a list in the 'exports' field
-    # https://stackoverflow.com/questions/9427163/remove-duplicate-dict-in-list-in-python
-    result_unique = [i for n, i in enumerate(result) if i not in result[n + 1:]]
-
-    return result_unique
+    return result
 
 
-def get_transitive_dependencies(packages, max_depth=2):
+def get_transitive_dependencies(packages, max_depth=2, pypi_cache=None, index=None,
+                                max_workers=PYPI_MAX_WORKERS,
+                                pypi_server="https://pypi.org/pypi/", session=None):
     """
     Resolve transitive dependencies for the given packages.
 
+    The dependency graph is walked breadth first, one level per depth.
+    Requirements come from the installed metadata; only distributions
+    that are not installed are looked up on PyPI, concurrently for a
+    whole level. Optional (extra) requirements are not followed.
+
     Args:
         packages: List of package dictionaries with 'name' and 'version'
         max_depth: Maximum depth to resolve dependencies (default: 2)
+        pypi_cache: PyPICache used for the PyPI fallback
+        index: EnvironmentIndex of the installed packages, built when None
+        max_workers: Number of concurrent PyPI lookups
+        pypi_server: Base URL of the PyPI JSON API
+        session: requests.Session to reuse, a new one is created (and
+            closed) when needed if None
 
     Returns:
         List of additional packages that are transitive dependencies
@@ -809,168 +3046,221 @@ def get_transitive_dependencies(packages, max_depth=2):
     if max_depth <= 0:
         return []
 
-    transitive_deps = set()
-    processed_packages = set()
-
-    def _get_package_dependencies(package_name, current_depth=0):
-        if current_depth >= max_depth or package_name in processed_packages:
-            return
-
-        processed_packages.add(package_name)
-
-        try:
-            # Try to get dependencies from local installation first
-            deps = _get_local_dependencies(package_name)
-
-            if not deps:
-                # Fallback to PyPI metadata (limited to avoid too many requests)
-                deps = _get_pypi_dependencies(package_name)
+    if index is None:
+        index = EnvironmentIndex.from_environment()
 
-            for dep in deps:
-                dep_name = dep.split()[0].split('=')[0].split(
-                    '<')[0].split('>')[0].split('!')[0].split('~')[0]
-                if dep_name and dep_name not in processed_packages:
-                    transitive_deps.add(dep_name)
-                    # Recursively get dependencies
-                    _get_package_dependencies(dep_name, current_depth + 1)
-
-        except Exception as e:
-            logging.debug(f"Failed to get dependencies for {package_name}: {e}")
-
-    # Process each package
+    seen = set()
+    frontier = []
     for package in packages:
-        _get_package_dependencies(package['name'])
-
-    # Convert to package format and filter out already included packages
-    existing_names = {pkg['name'] for pkg in packages}
-    result = []
-
-    for dep_name in transitive_deps:
-        if dep_name not in existing_names:
-            # Try to find version info
-            local_packages = get_locally_installed_packages()
-            version = None
+        if _normalize_name(package['name']) not in seen:
+            seen.add(_normalize_name(package['name']))
+            frontier.append(package['name'])
 
-            for local_pkg in local_packages:
-                if local_pkg['name'] == dep_name:
-                    version = local_pkg['version']
-                    break
+    from concurrent.futures import ThreadPoolExecutor
 
-            result.append({
-                'name': dep_name,
-                'version': version
-            })
+    found = []
+    own_session = session is None
+    try:
+        for depth in range(max_depth):
+            if not frontier:
+                break
 
-    return result
+            requirements = {name: index.requires(name) for name in frontier}
+            missing = [name for name in frontier if requirements[name] is None]
+            if missing:
+                if session is None:
+                    session = _new_session(max_workers)
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    fetched = executor.map(
+                        lambda name: _get_pypi_requirements(
+                            name, session, pypi_server, cache=pypi_cache),
+                        missing,
+                    )
+                    requirements.update(zip(missing, fetched))
+
+            next_frontier = []
+            for name in frontier:
+                for dep_name in _runtime_requirement_names(requirements[name]):
+                    if _normalize_name(dep_name) not in seen:
+                        seen.add(_normalize_name(dep_name))
+                        found.append(dep_name)
+                        next_frontier.append(dep_name)
+            logging.debug(
+                f"Transitive depth {depth + 1}: {len(next_frontier)} new dependencies "
+                f"({len(missing)} looked up on PyPI)"
+            )
+            frontier = next_frontier
+    finally:
+        if own_session and session is not None:
+            session.close()
 
+    return [Requirement(name, index.version(name)) for name in found]
 
-def _get_local_dependencies(package_name):
-    """Get dependencies from locally installed package metadata."""
-    dependencies = []
 
-    for path in sys.path:
-        if not os.path.exists(path):
+def _runtime_requirement_names(requirements):
+    """Yield the distribution names of requirements that are not limited
+    to an extra."""
+    for requirement in requirements:
+        requirement, _, marker = requirement.partition(';')
+        if "extra" in marker:
             continue
+        match = re.match(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)', requirement)
+        if match:
+            yield match.group(1)
 
-        # Look for package metadata
-        for root, dirs, files in os.walk(path):
-            if package_name.lower() in root.lower() and any(
-                    suffix in root for suffix in [".dist-info", ".egg-info"]):
-                # Look for METADATA or requires.txt
-                metadata_files = ["METADATA", "PKG-INFO", "requires.txt"]
 
-                for metadata_file in metadata_files:
-                    metadata_path = os.path.join(root, metadata_file)
-                    if os.path.exists(metadata_path):
-                        try:
-                            with open(metadata_path, "r", encoding="utf-8") as f:
-                                content = f.read()
+def _get_local_dependencies(package_name, index=None):
+    """Get dependencies from locally installed package metadata."""
+    if index is None:
+        index = EnvironmentIndex([], _get_metadata_dirs())
+
+    # Remove environment markers like "; python_version >= '3.6'"
+    return [
+        dep.split(';')[0].strip()
+        for dep in index.requires(package_name) or []
+        if dep.split(';')[0].strip()
+    ]
 
-                            # Parse dependencies from metadata
-                            if metadata_file in ["METADATA", "PKG-INFO"]:
-                                dependencies.extend(_parse_metadata_dependencies(content))
-                            elif metadata_file == "requires.txt":
-                                dependencies.extend(_parse_requires_txt(content))
 
-                        except (IOError, UnicodeDecodeError):
-                            continue
+def _read_requirements(metadata_dir, encoding="utf-8"):
+    """Read the requirements, markers included, of a distribution from
+    its metadata directory."""
+    metadata_path = os.path.join(metadata_dir, "METADATA")
+    if os.path.exists(metadata_path):
+        metadata = _read_metadata(metadata_path, encoding)
+        return metadata.requires_dist if metadata else []
 
-                if dependencies:
-                    break
+    # Eggs list their requirements in requires.txt
+    try:
+        with open(os.path.join(metadata_dir, "requires.txt"), "r", encoding=encoding) as f:
+            return _parse_requires_txt(f.read())
+    except FileNotFoundError:
+        pass
+    except (IOError, UnicodeDecodeError):
+        return []
 
-    return dependencies
+    metadata = _read_metadata(os.path.join(metadata_dir, "PKG-INFO"), encoding)
+    return metadata.requires_dist if metadata else []
 
 
 def _parse_metadata_dependencies(content):
     """Parse dependencies from METADATA or PKG-INFO content."""
     dependencies = []
 
-    for line in content.split('\n'):
-        line = line.strip()
-        if line.startswith('Requires-Dist:'):
-            dep = line.split(':', 1)[1].strip()
-            # Remove environment markers like "; python_version >= '3.6'"
-            dep = dep.split(';')[0].strip()
-            if dep:
-                dependencies.append(dep)
+    for dep in _parse_metadata_headers(content.splitlines()).requires_dist:
+        # Remove environment markers like "; python_version >= '3.6'"
+        dep = dep.split(';')[0].strip()
+        if dep:
+            dependencies.append(dep)
 
     return dependencies
 
 
 def _parse_requires_txt(content):
-    """Parse dependencies from requires.txt content."""
+    """Parse dependencies from requires.txt content.
+
+    Requirements listed under an ``[extra]`` or ``[extra:marker]`` section
+    get an ``extra == "extra"`` marker, those under ``[:marker]`` the
+    section marker.
+    """
     dependencies = []
+    marker = None
 
     for line in content.split('\n'):
         line = line.strip()
-        if line and not line.startswith('#'):
-            dependencies.append(line)
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            extra, _, section_marker = line[1:-1].partition(':')
+            if extra:
+                marker = 'extra == "{0}"'.format(extra)
+            else:
+                marker = section_marker
+            continue
+        dependencies.append(line + '; ' + marker if marker else line)
 
     return dependencies
 
 
-def _get_pypi_dependencies(package_name):
+def _get_pypi_dependencies(package_name, session=None, pypi_server="https://pypi.org/pypi/",
+                           cache=None):
     """Get dependencies from PyPI metadata (limited use to avoid rate limiting)."""
     dependencies = []
 
-    try:
-        response = requests.get(f"https://pypi.org/pypi/{package_name}/json", timeout=5)
+    for req in _get_pypi_requirements(package_name, session, pypi_server, cache):
+        # Remove environment markers
+        dep = req.split(';')[0].strip()
+        if dep:
+            dependencies.append(dep)
 
-        if response.status_code == 200:
-            data = response.json()
-            info = data.get('info', {})
-            requires_dist = info.get('requires_dist', [])
+    return dependencies
 
-            if requires_dist:
-                for req in requires_dist:
-                    # Remove environment markers
-                    dep = req.split(';')[0].strip()
-                    if dep:
-                        dependencies.append(dep)
 
+def _get_pypi_requirements(package_name, session=None, pypi_server="https://pypi.org/pypi/",
+                           cache=None):
+    """Return the ``requires_dist`` of a package on PyPI, markers included."""
+    try:
+        if session is None:
+            with _new_session(1) as session:
+                data = _fetch_pypi_metadata(
+                    session, package_name, pypi_server, timeout=5, cache=cache)
+        else:
+            data = _fetch_pypi_metadata(
+                session, package_name, pypi_server, timeout=5, cache=cache)
     except Exception as e:
         logging.debug(f"Failed to get PyPI dependencies for {package_name}: {e}")
+        return []
 
-    return dependencies
+    return data["requires_dist"] if data else []
 
 
-def get_pkg_names(pkgs):
+def get_pkg_names(pkgs, index=None):
     """Get PyPI package names from a list of imports.
 
+    Dotted imports are matched against the mapping file and, given an
+    ``index``, the packages installed in namespace packages. The longest
+    matching prefix wins, an installed package over a mapping of the same
+    length, so ``google.cloud.storage`` resolves to ``google-cloud-storage``
+    rather than to the package mapped to ``google``.
+
+    A name is left out when a longer name under it matches deeper:
+    ``from google.cloud import storage`` records both ``google.cloud`` and
+    ``google.cloud.storage``, and ``google.cloud`` alone would fall back
+    to the package mapped to ``google``.
+
     Args:
         pkgs (List[str]): List of import names.
+        index (EnvironmentIndex): Installed distributions to match.
 
     Returns:
         List[str]: The corresponding PyPI package names.
 
     """
+    mapping = _get_mapping_trie()
+    matches = {}
+    for pkg in set(pkgs):
+        depth, names = mapping.match(pkg)
+        if index is not None:
+            installed_depth, packages = index.modules.match(pkg)
+            if packages and installed_depth >= depth:
+                depth, names = installed_depth, [package.name for package in packages]
+        matches[pkg] = depth, names
+
+    # Deepest match of the names under every dotted prefix
+    deepest = {}
+    for pkg, (depth, _) in matches.items():
+        parts = pkg.split(".")
+        for end in range(1, len(parts)):
+            prefix = ".".join(parts[:end])
+            deepest[prefix] = max(deepest.get(prefix, 0), depth)
+
     result = set()
-    with open(join("mapping"), "r") as f:
-        data = dict(x.strip().split(":") for x in f)
-    for pkg in pkgs:
+    for pkg, (depth, names) in matches.items():
+        if deepest.get(pkg, 0) > depth:
+            continue
         # Look up the mapped requirement. If a mapping isn't found,
-        # simply use the package name.
-        result.add(data.get(pkg, pkg))
+        # simply use the top level package name.
+        result.add(names[-1] if names else pkg.partition(".")[0])
     # Return a sorted list for backward compatibility.
     return sorted(result, key=lambda s: s.lower())
 
@@ -983,7 +3273,7 @@ def get_specific_libraries(lib_names, encoding="utf-8"):
         encoding (str): Encoding for file operations.
 
     Returns:
-        List[dict]: List of dictionaries with 'name' and 'version' keys.
+        List[Requirement]: ``name``/``version`` records.
     """
     result = []
     local_packages = get_locally_installed_packages(encoding=encoding)
@@ -1000,27 +3290,24 @@ def get_specific_libraries(lib_names, encoding="utf-8"):
         # Try to find the library in local packages
         for package in local_packages:
             # Normalize package name and exports for comparison
-            normalized_pkg_name = package["name"].lower().replace("-", "_")
+            normalized_pkg_name = package.name.lower().replace("-", "_")
             normalized_exports = [
                 exp.lower().replace("-", "_")
-                for exp in package["exports"]
+                for exp in package.exports
             ]
 
             # Check if library name matches package name or any export
             if (normalized_pkg_name == normalized_lib_name or
-                    lib_name.lower() == package["name"].lower() or
+                    lib_name.lower() == package.name.lower() or
                     normalized_lib_name in normalized_exports or
                     lib_name.lower() in [
-                        exp.lower() for exp in package["exports"]]):
+                        exp.lower() for exp in package.exports]):
 
-                result.append({
-                    "name": package["name"],
-                    "version": package["version"]
-                })
+                result.append(Requirement(package.name, package.version))
                 found = True
                 logging.info(
                     f'Found library "{lib_name}" as package '
-                    f'"{package["name"]}" version {package["version"]}'
+                    f'"{package.name}" version {package.version}'
                 )
                 break
 
@@ -1029,12 +3316,13 @@ def get_specific_libraries(lib_names, encoding="utf-8"):
                 f'Library "{lib_name}" not found in local installation. '
                 f"It will be added without version information."
             )
-            result.append({"name": lib_name, "version": None})
+            result.append(Requirement(lib_name))
 
     return result
 
 
-def scan_for_env_variables(path, encoding="utf-8", extra_ignore_dirs=None, follow_links=True):
+def scan_for_env_variables(path, encoding="utf-8", extra_ignore_dirs=None, follow_links=True,
+                           cache_dir=None, files=None):
     """Scan Python files for environment variable usage.
 
     Args:
@@ -1042,82 +3330,86 @@ def scan_for_env_variables(path, encoding="utf-8", extra_ignore_dirs=None, follo
         encoding (str): File encoding to use.
         extra_ignore_dirs (list): Additional directories to ignore.
         follow_links (bool): Whether to follow symbolic links.
+        cache_dir (str): Directory of the scan cache, ``None`` disables it.
+        files (list): Files to scan instead of walking ``path``, see
+            :func:`iter_imports`.
 
     Returns:
         dict: Dictionary with env var names as keys and metadata as values.
     """
     env_vars = {}
-    ignore_dirs = [
-        ".hg", ".svn", ".git", ".tox", "__pycache__",
-        "env", "venv", ".venv", ".ipynb_checkpoints",
-        "node_modules", "dist", "build", ".eggs"
-    ]
+    rules = IgnoreRules.for_project(path, extra_ignore_dirs)
+    if files is None:
+        file_paths = _walk_files(path, rules, [".py"], follow_links)
+    else:
+        file_paths = _list_source_files(path, files, rules, [".py"])
 
-    if extra_ignore_dirs:
-        ignore_dirs_parsed = []
-        for e in extra_ignore_dirs:
-            ignore_dirs_parsed.append(os.path.basename(os.path.realpath(e)))
-        ignore_dirs.extend(ignore_dirs_parsed)
+    cache = _open_scan_cache(cache_dir, "env", encoding=encoding)
+    stamps = {} if cache else None
+    try:
+        for file_path in file_paths:
+            relative_path = os.path.relpath(file_path, path)
 
-    # Patterns to match environment variable access
-    patterns = [
-        # os.environ['VAR'], os.environ["VAR"]
-        re.compile(r'os\.environ\[["\']([A-Z_][A-Z0-9_]*?)["\']\]'),
-        # os.environ.get('VAR'), os.environ.get("VAR")
-        re.compile(r'os\.environ\.get\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
-        # os.getenv('VAR'), os.getenv("VAR")
-        re.compile(r'os\.getenv\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
-        # environ['VAR'], environ.get('VAR')
-        re.compile(r'environ\[["\']([A-Z_][A-Z0-9_]*?)["\']\]'),
-        re.compile(r'environ\.get\(["\']([A-Z_][A-Z0-9_]*?)["\']'),
-    ]
+            findings = cache.get("env", file_path) if cache else None
+            if findings is None:
+                try:
+                    findings = _scan_file_env_variables(file_path, encoding, stamps)
+                except (IOError, UnicodeDecodeError) as e:
+                    logging.warning(f"Failed to read file {file_path}: {e}")
+                    continue
+                if cache:
+                    cache.set("env", file_path, findings, stamps.pop(file_path, None))
+
+            for var_name, line_num, line_content, default_value in findings:
+                if var_name not in env_vars:
+                    env_vars[var_name] = {
+                        'locations': [],
+                        'default': default_value,
+                        'description': _infer_description(var_name, line_content)
+                    }
+
+                env_vars[var_name]['locations'].append({
+                    'file': relative_path,
+                    'line': line_num,
+                    'context': line_content
+                })
+    finally:
+        if cache:
+            cache.close()
 
-    walk = os.walk(path, followlinks=follow_links)
-    for root, dirs, files in walk:
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+    return env_vars
 
-        py_files = [f for f in files if f.endswith('.py')]
 
-        for file_name in py_files:
-            file_path = os.path.join(root, file_name)
-            relative_path = os.path.relpath(file_path, path)
+def _scan_file_env_variables(file_path, encoding="utf-8", stamps=None):
+    """Find environment variable accesses in a single Python file. See
+    :func:`_read_text` for ``stamps``.
 
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                    lines = content.split('\n')
-
-                for pattern in patterns:
-                    for match in pattern.finditer(content):
-                        var_name = match.group(1)
-                        
-                        # Find the line number
-                        line_num = content[:match.start()].count('\n') + 1
-                        
-                        # Get the line content for context
-                        line_content = lines[line_num - 1].strip() if line_num <= len(lines) else ""
-                        
-                        # Extract default value if present
-                        default_value = _extract_default_value(line_content, var_name)
-                        
-                        if var_name not in env_vars:
-                            env_vars[var_name] = {
-                                'locations': [],
-                                'default': default_value,
-                                'description': _infer_description(var_name, line_content)
-                            }
-                        
-                        env_vars[var_name]['locations'].append({
-                            'file': relative_path,
-                            'line': line_num,
-                            'context': line_content
-                        })
-
-            except (IOError, UnicodeDecodeError) as e:
-                logging.warning(f"Failed to read file {file_path}: {e}")
-                continue
+    Returns:
+        list: ``[var_name, line_number, line_content, default_value]``
+            entries, in match order.
+    """
+    findings = []
+    _profile.incr("env_files_scanned")
 
-    return env_vars
+    content = _read_text(file_path, encoding, stamps)
+    lines = content.split('\n')
+
+    for pattern in ENV_VAR_PATTERNS:
+        for match in pattern.finditer(content):
+            var_name = match.group(1)
+
+            # Find the line number
+            line_num = content[:match.start()].count('\n') + 1
+
+            # Get the line content for context
+            line_content = lines[line_num - 1].strip() if line_num <= len(lines) else ""
+
+            # Extract default value if present
+            default_value = _extract_default_value(line_content, var_name)
+
+            findings.append([var_name, line_num, line_content, default_value])
+
+    return findings
 
 
 def _extract_default_value(line_content, var_name):
@@ -1546,6 +3838,35 @@ def join(f):
     return os.path.join(os.path.dirname(__file__), f)
 
 
+@lru_cache(maxsize=None)
+def _get_stdlib_modules():
+    """Return the names of the standard library modules.
+
+    The ``stdlib`` file is read once per process. It lists the modules of
+    every Python version mod2pip supports, ``sys.stdlib_module_names``
+    adds those of the running interpreter.
+    """
+    with open(join("stdlib"), "r") as f:
+        names = {x.strip() for x in f}
+    names.update(getattr(sys, "stdlib_module_names", ()))
+    names.discard("")
+    return frozenset(names)
+
+
+@lru_cache(maxsize=None)
+def _get_import_mapping():
+    """Return the read-only mapping of import names to PyPI package names,
+    read once per process from the ``mapping`` file."""
+    with open(join("mapping"), "r") as f:
+        return MappingProxyType(dict(x.strip().split(":") for x in f if x.strip()))
+
+
+@lru_cache(maxsize=None)
+def _get_mapping_trie():
+    """Return the import mapping as a :class:`ModuleTrie`."""
+    return ModuleTrie(_get_import_mapping().items())
+
+
 def parse_requirements(file_):
     """Parse a requirements formatted file.
 
@@ -1589,13 +3910,13 @@ def parse_requirements(file_):
     for x in data:
         # Check for modules w/o a specifier.
         if not any([y in x for y in delim]):
-            modules.append({"name": x, "version": None})
+            modules.append(Requirement(x))
         for y in x:
             if y in delim:
                 module = x.split(y)
                 module_name = module[0]
                 module_version = module[-1].replace("=", "")
-                module = {"name": module_name, "version": module_version}
+                module = Requirement(module_name, module_version)
 
                 if module not in modules:
                     modules.append(module)
@@ -1670,7 +3991,7 @@ def clean(file_, imports):
 def dynamic_versioning(scheme, imports):
     """Enables dynamic versioning with <compat>, <gt> or <non-pin> schemes."""
     if scheme == "no-pin":
-        imports = [{"name": item["name"], "version": ""} for item in imports]
+        imports = [Requirement(item["name"], "") for item in imports]
         symbol = ""
     elif scheme == "gt":
         symbol = ">="
@@ -1679,32 +4000,274 @@ def dynamic_versioning(scheme, imports):
     return imports, symbol
 
 
+class Scanner(object):
+    """Scans projects for their imports and environment variables.
+
+    Holds the scanning settings that :func:`init` takes from the command
+    line. Nothing else is kept between scans, so one scanner can be reused
+    for any number of projects, from several threads at once as long as
+    no profile is active: the profile that :func:`init` installs for
+    ``--profile-report`` and friends is a module global, so it would also
+    count the work of scans running in other threads.
+
+    Args:
+        encoding (str): Encoding used to open the files.
+        extra_ignore_dirs (List[str]): Directories to skip on top of the
+            usual virtualenv and VCS directories.
+        follow_links (bool): Whether to follow symbolic links.
+        notebooks (bool): Whether to scan Jupyter notebooks, with the
+            built-in reader, or ``"nbconvert"`` to read them with
+            ``nbconvert``.
+        jobs (int): Worker processes of the import scan, see
+            :func:`iter_imports`.
+        chunk_size (int): Number of files sent to a worker at a time.
+        cache (bool): Whether to use the scan cache.
+        cache_dir (str): Directory of the scan cache, by default one
+            directory per scanned project in the per-user cache directory
+            (``~/.cache/mod2pip/scan``). Scans can share a directory.
+    """
+
+    def __init__(self, encoding="utf-8", extra_ignore_dirs=None, follow_links=True,
+                 notebooks=False, jobs=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 cache=False, cache_dir=None):
+        if notebooks == "nbconvert":
+            # Fail now rather than on the first notebook
+            _get_python_exporter()
+        self.encoding = encoding
+        self.extra_ignore_dirs = extra_ignore_dirs
+        self.follow_links = follow_links
+        self.notebooks = notebooks
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.cache_dir = cache_dir
+
+    def _cache_dir(self, path):
+        if not self.cache:
+            return None
+        return self.cache_dir or _scan_cache_dir(path)
+
+    def iter_imports(self, path, files=None):
+        """Yield ``(file_name, imports, errors)`` for every file under
+        ``path``, or of ``files``, see :func:`iter_imports`."""
+        return iter_imports(
+            path, encoding=self.encoding, extra_ignore_dirs=self.extra_ignore_dirs,
+            follow_links=self.follow_links, jobs=self.jobs, chunk_size=self.chunk_size,
+            cache_dir=self._cache_dir(path), notebooks=self.notebooks, files=files,
+        )
+
+    def get_all_imports(self, path, full_names=False, changed_since=None, files=None):
+        """Return the third party imports of the project at ``path``, see
+        :func:`get_all_imports`."""
+        return get_all_imports(
+            path, encoding=self.encoding, extra_ignore_dirs=self.extra_ignore_dirs,
+            follow_links=self.follow_links, jobs=self.jobs, chunk_size=self.chunk_size,
+            cache_dir=self._cache_dir(path), full_names=full_names,
+            notebooks=self.notebooks, changed_since=changed_since, files=files,
+        )
+
+    def scan_env_variables(self, path, files=None):
+        """Return the environment variables used by the project at ``path``,
+        see :func:`scan_for_env_variables`."""
+        return scan_for_env_variables(
+            path, encoding=self.encoding, extra_ignore_dirs=self.extra_ignore_dirs,
+            follow_links=self.follow_links, cache_dir=self._cache_dir(path), files=files,
+        )
+
+
+class Resolver(object):
+    """Resolves imports to the distributions providing them.
+
+    The environment index is built on first use and the HTTP session is
+    opened on the first PyPI lookup. Both are then reused, along with the
+    PyPI metadata cache, by every later call, from any thread, until
+    :meth:`close`. The mapping and standard library tables are loaded once
+    per process in any case. As with :class:`Scanner`, calls from several
+    threads should not be mixed with a profiled :func:`init` run.
+
+    Args:
+        encoding (str): Encoding used to read the installed metadata.
+        use_local (bool): Only report installed distributions, never
+            query PyPI for the others.
+        pypi_server (str): Base URL of the PyPI JSON API.
+        proxy (dict): Proxies passed to ``requests``.
+        timeout (float): Timeout of each PyPI request in seconds.
+        total_timeout (float): Seconds after which the PyPI lookups of a
+            call are abandoned, ``None`` to wait for all of them.
+        max_workers (int): Number of concurrent PyPI lookups.
+        pypi_cache (PyPICache): Metadata cache, closed by :meth:`close`.
+        include_transitive (bool): Whether to add the dependencies of the
+            resolved distributions.
+        transitive_depth (int): Depth of the transitive resolution.
+        index (EnvironmentIndex): Index to use instead of the one of this
+            environment.
+    """
+
+    def __init__(self, encoding="utf-8", use_local=False, pypi_server=DEFAULT_PYPI_SERVER,
+                 proxy=None, timeout=PYPI_TIMEOUT, total_timeout=None,
+                 max_workers=PYPI_MAX_WORKERS, pypi_cache=None,
+                 include_transitive=False, transitive_depth=2, index=None):
+        import threading
+
+        self.encoding = encoding
+        self.use_local = use_local
+        self.pypi_server = pypi_server
+        self.proxy = proxy
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.max_workers = max_workers
+        self.pypi_cache = pypi_cache
+        self.include_transitive = include_transitive
+        self.transitive_depth = transitive_depth
+        self._index = index
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        """The :class:`EnvironmentIndex` of the installed distributions."""
+        with self._lock:
+            if self._index is None:
+                self._index = EnvironmentIndex.from_environment(encoding=self.encoding)
+            return self._index
+
+    @property
+    def session(self):
+        """The ``requests`` session of the PyPI lookups."""
+        with self._lock:
+            if self._session is None:
+                self._session = _new_session(self.max_workers)
+            return self._session
+
+    def resolve(self, imports):
+        """Return the ``name``/``version`` records of the distributions
+        providing ``imports``, e.g. the dotted names returned by
+        :meth:`Scanner.get_all_imports` with ``full_names``."""
+        with _profile.stage("environment"):
+            index = self.index
+        with _profile.stage("mapping"):
+            candidates = get_pkg_names(imports, index=index)
+        logging.debug("Found imports: " + ", ".join(candidates))
+
+        if self.use_local:
+            logging.debug("Getting package information ONLY from local installation.")
+            with _profile.stage("local"):
+                packages = get_import_local(candidates, encoding=self.encoding, index=index)
+        else:
+            logging.debug("Getting packages information from Local/PyPI")
+            with _profile.stage("local"):
+                local = get_import_local(candidates, encoding=self.encoding, index=index)
+
+            # check if candidate name is found in
+            # the list of exported modules, installed locally
+            # and the package name is not in the list of local module names
+            # it add to difference
+            difference = [x for x in candidates if x not in index]
+
+            with _profile.stage("pypi"):
+                packages = local + get_imports_info(
+                    difference,
+                    proxy=self.proxy,
+                    pypi_server=self.pypi_server,
+                    session=self.session if difference else None,
+                    max_workers=self.max_workers,
+                    timeout=self.timeout,
+                    total_timeout=self.total_timeout,
+                    cache=self.pypi_cache,
+                )
+
+        # Add transitive dependencies if requested
+        if self.include_transitive:
+            logging.info(f"Resolving transitive dependencies (depth: {self.transitive_depth})")
+            try:
+                with _profile.stage("transitive"):
+                    transitive_deps = get_transitive_dependencies(
+                        packages, max_depth=self.transitive_depth,
+                        pypi_cache=self.pypi_cache, index=index,
+                        max_workers=self.max_workers, pypi_server=self.pypi_server,
+                        # Opening a session imports requests, only reuse one
+                        session=self._session)
+                if transitive_deps:
+                    logging.info(f"Found {len(transitive_deps)} transitive dependencies")
+                    packages.extend(transitive_deps)
+                else:
+                    logging.info("No additional transitive dependencies found")
+            except Exception as e:
+                logging.warning(f"Failed to resolve transitive dependencies: {e}")
+        return packages
+
+    def close(self):
+        """Close the HTTP session and the PyPI metadata cache."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        if self.pypi_cache:
+            self.pypi_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
 def handle_scan_noteboooks():
     if not scan_noteboooks:
         logging.info("Not scanning for jupyter notebooks.")
         return
 
-    try:
-        global PythonExporter
-        from nbconvert import PythonExporter
-    except ImportError:
-        raise NbconvertNotInstalled()
+    if scan_noteboooks == "nbconvert":
+        _get_python_exporter()
 
 
 def init(args):
-    global scan_noteboooks
+    report_file = args.get("--profile-report")
+    cprofile_dir = args.get("--cprofile")
+    trace_memory = args.get("--trace-memory")
+    if not (report_file or cprofile_dir or trace_memory or args.get("--debug")):
+        return _init(args)
+
+    profile = Profile(cprofile_dir=cprofile_dir, trace_memory=trace_memory)
+    previous = _set_profile(profile)
+    try:
+        with profile.stage("total", hooks=False):
+            return _init(args)
+    finally:
+        _set_profile(previous)
+        profile.close()
+        logging.debug(profile.summary())
+        if trace_memory:
+            logging.info(profile.memory_summary())
+        if cprofile_dir:
+            logging.info(f"cProfile statistics of every stage written to {cprofile_dir}")
+        if report_file:
+            profile.write(report_file)
+
+
+def _init(args):
     encoding = args.get("--encoding")
     extra_ignore_dirs = args.get("--ignore")
     follow_links = not args.get("--no-follow-links")
     include_transitive = args.get("--include-transitive", False)
     transitive_depth = int(args.get("--transitive-depth") or 2)
+    jobs = int(args.get("--jobs") or 1)
+    chunk_size = int(args.get("--chunk-size") or DEFAULT_CHUNK_SIZE)
+    pypi_timeout = float(args.get("--pypi-timeout") or PYPI_TIMEOUT)
+    pypi_total_timeout = args.get("--pypi-total-timeout")
+    if pypi_total_timeout:
+        pypi_total_timeout = float(pypi_total_timeout)
     enhanced_detection = args.get("--enhanced-detection", False)
     lib_names = args.get("--lib")
     generate_env = args.get("--generate-env", False)
     validate_env_flag = args.get("--validate-env", False)
 
-    scan_noteboooks = args.get("--scan-notebooks", False)
-    handle_scan_noteboooks()
+    notebooks = args.get("--scan-notebooks", False)
+    if args.get("--nbconvert"):
+        notebooks = "nbconvert"
+    if not notebooks:
+        logging.info("Not scanning for jupyter notebooks.")
 
     input_path = args["<path>"]
 
@@ -1716,6 +4279,20 @@ def init(args):
     if extra_ignore_dirs:
         extra_ignore_dirs = extra_ignore_dirs.split(",")
 
+    scanner = Scanner(
+        encoding=encoding,
+        extra_ignore_dirs=extra_ignore_dirs,
+        follow_links=follow_links,
+        notebooks=notebooks,
+        jobs=jobs,
+        chunk_size=chunk_size,
+        cache=not args.get("--no-cache"),
+        cache_dir=args.get("--cache-dir"),
+    )
+    files = None
+    if args.get("--files-from"):
+        files = read_file_list(args["--files-from"])
+
     # Handle --validate-env flag for validating .env files
     if validate_env_flag:
         validate_env_file(input_path)
@@ -1725,12 +4302,8 @@ def init(args):
     if generate_env:
         logging.info(f"Scanning for environment variables in {input_path}")
         
-        env_vars = scan_for_env_variables(
-            input_path,
-            encoding=encoding,
-            extra_ignore_dirs=extra_ignore_dirs,
-            follow_links=follow_links
-        )
+        with _profile.stage("env_variables"):
+            env_vars = scanner.scan_env_variables(input_path, files=files)
         
         if not env_vars:
             logging.info("No environment variables found in Python files.")
@@ -1828,16 +4401,10 @@ def init(args):
     if enhanced_detection:
         logging.info("Using enhanced detection for conda packages and dynamic imports")
 
-    candidates = get_all_imports(
-        input_path,
-        encoding=encoding,
-        extra_ignore_dirs=extra_ignore_dirs,
-        follow_links=follow_links,
-    )
-    candidates = get_pkg_names(candidates)
-    logging.debug("Found imports: " + ", ".join(candidates))
+    candidates = scanner.get_all_imports(
+        input_path, full_names=True, changed_since=args.get("--changed-since"), files=files)
 
-    pypi_server = "https://pypi.python.org/pypi/"
+    pypi_server = DEFAULT_PYPI_SERVER
     proxy = None
     if args["--pypi-server"]:
         pypi_server = args["--pypi-server"]
@@ -1845,43 +4412,26 @@ def init(args):
     if args["--proxy"]:
         proxy = {"http": args["--proxy"], "https": args["--proxy"]}
 
-    if args["--use-local"]:
-        logging.debug("Getting package information ONLY from local installation.")
-        imports = get_import_local(candidates, encoding=encoding)
-    else:
-        logging.debug("Getting packages information from Local/PyPI")
-        local = get_import_local(candidates, encoding=encoding)
-
-        # check if candidate name is found in
-        # the list of exported modules, installed locally
-        # and the package name is not in the list of local module names
-        # it add to difference
-        difference = [
-            x
-            for x in candidates
-            if
-            # aggregate all export lists into one
-            # flatten the list
-            # check if candidate is in exports
-            x.lower() not in [y for x in local for y in x["exports"]] and
-            # check if candidate is package names
-            x.lower() not in [x["name"] for x in local]
-        ]
-
-        imports = local + get_imports_info(difference, proxy=proxy, pypi_server=pypi_server)
+    pypi_cache = None
+    if not args.get("--no-cache") and (not args["--use-local"] or include_transitive):
+        pypi_cache = _open_pypi_cache(
+            args.get("--pypi-cache-dir") or _user_cache_dir(),
+            ttl=float(args.get("--pypi-cache-ttl") or PYPI_CACHE_TTL),
+            max_entries=int(args.get("--pypi-cache-size") or PYPI_CACHE_SIZE),
+        )
 
-    # Add transitive dependencies if requested
-    if include_transitive:
-        logging.info(f"Resolving transitive dependencies (depth: {transitive_depth})")
-        try:
-            transitive_deps = get_transitive_dependencies(imports, max_depth=transitive_depth)
-            if transitive_deps:
-                logging.info(f"Found {len(transitive_deps)} transitive dependencies")
-                imports.extend(transitive_deps)
-            else:
-                logging.info("No additional transitive dependencies found")
-        except Exception as e:
-            logging.warning(f"Failed to resolve transitive dependencies: {e}")
+    with Resolver(
+        encoding=encoding,
+        use_local=args["--use-local"],
+        pypi_server=pypi_server,
+        proxy=proxy,
+        timeout=pypi_timeout,
+        total_timeout=pypi_total_timeout,
+        pypi_cache=pypi_cache,
+        include_transitive=include_transitive,
+        transitive_depth=transitive_depth,
+    ) as resolver:
+        imports = resolver.resolve(candidates)
 
     # sort imports based on lowercase name of package, similar to `pip freeze`.
     imports = sorted(imports, key=lambda x: x["name"].lower())
@@ -1905,15 +4455,18 @@ def init(args):
     else:
         symbol = "=="
 
-    if args["--print"]:
-        output_requirements(imports, symbol)
-        logging.info("Successfully output requirements")
-    else:
-        generate_requirements_file(path, imports, symbol)
-        logging.info("Successfully saved requirements file in " + path)
+    with _profile.stage("output"):
+        if args["--print"]:
+            output_requirements(imports, symbol)
+            logging.info("Successfully output requirements")
+        else:
+            generate_requirements_file(path, imports, symbol)
+            logging.info("Successfully saved requirements file in " + path)
 
 
 def main():  # pragma: no cover
+    from docopt import docopt
+
     args = docopt(__doc__, version=__version__)
     log_level = logging.DEBUG if args["--debug"] else logging.INFO
     logging.basicConfig(level=log_level, format="%(levelname)s: %(message)s")
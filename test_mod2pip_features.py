@@ -6,7 +6,7 @@ Tests --lib flag, --generate-env flag, and enhanced detection.
 Requirements:
     pip install -e .
     or
-    pip install docopt yarg requests
+    pip install docopt requests
 """
 
 import os
@@ -27,11 +27,6 @@ def check_dependencies():
     except ImportError:
         missing.append('docopt')
     
-    try:
-        import yarg  # noqa: F401
-    except ImportError:
-        missing.append('yarg')
-    
     try:
         import requests  # noqa: F401
     except ImportError:
@@ -48,7 +43,7 @@ def check_dependencies():
         print("\n  Method 1 (recommended):")
         print("    pip install -e .")
         print("\n  Method 2:")
-        print("    pip install docopt yarg requests")
+        print("    pip install docopt requests")
         print("\n  Method 3:")
         print("    pip install -r requirements-dev.txt")
         print("\n" + "=" * 70 + "\n")
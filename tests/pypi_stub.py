@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the PyPI JSON API.
+
+Serves ``/pypi/<name>/json`` from fixtures, or synthesizes a response for
+any name, with configurable latency, error rate and 404 rate. It records
+the requests, connections and bytes it served, so tests and benchmarks
+can check how mod2pip talks to the index without a network.
+
+Usage from Python::
+
+    with StubPyPIServer(latency=0.05) as server:
+        mod2pip.get_imports_info(["requests"], pypi_server=server.url)
+
+Usage from a shell, for ``mod2pip --pypi-server http://127.0.0.1:8080/pypi/``:
+    python tests/pypi_stub.py [--port N] [--latency S] [--error-rate F]
+                                   [--not-found-rate F] [--fixtures DIR]
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+
+
+class StubPyPIServer(object):
+    """PyPI JSON API served from a background thread.
+
+    Names found in ``fixtures`` get that JSON document, every other name
+    resolves to version 1.0 of its title-cased name. Names in ``missing``
+    and a ``not_found_rate`` fraction of the others return a 404; which
+    names are missing does not change between requests. An
+    ``error_rate`` fraction of the requests fail with a 503.
+
+    Every response is delayed by ``latency`` seconds, or by ``slow[name]``
+    for the names in ``slow``. Responses carry an ETag and conditional
+    requests get a 304.
+
+    Args:
+        latency (float): Seconds every response is delayed.
+        slow (dict): Names mapped to their own delay.
+        missing (Iterable[str]): Names that do not exist.
+        not_found_rate (float): Fraction of the other names that do not exist.
+        error_rate (float): Fraction of requests answered with a 503.
+        fixtures (dict|str): Names mapped to JSON documents, or a directory
+            of ``<name>.json`` files.
+        description_size (int): Bytes of long description in synthesized
+            responses, real ones embed the whole README.
+        port (int): Port to listen on, a free one by default.
+        seed (int): Seed of the error generator.
+
+    Attributes:
+        url (str): The ``--pypi-server`` URL of the server.
+        statuses (List[int]): Status code of every response.
+        connections (int): Connections accepted.
+        bytes_sent (int): Bytes written, headers included.
+    """
+
+    def __init__(self, latency=0.0, slow=None, missing=(), not_found_rate=0.0,
+                 error_rate=0.0, fixtures=None, description_size=0, port=0, seed=0):
+        self.latency = latency
+        self.slow = slow or {}
+        self.missing = set(missing)
+        self.not_found_rate = not_found_rate
+        self.error_rate = error_rate
+        self.fixtures = fixtures or {}
+        self.description_size = description_size
+        self.statuses = []
+        self.connections = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{0}/pypi/".format(self.server.server_port)
+
+    @property
+    def requests(self):
+        """Number of requests served."""
+        return len(self.statuses)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Forget the requests, connections and bytes served so far."""
+        with self._lock:
+            self.statuses = []
+            self.connections = 0
+            self.bytes_sent = 0
+
+    def document(self, name):
+        """Return the JSON document of ``name``, or ``None`` for a 404."""
+        if name in self.missing:
+            return None
+        if isinstance(self.fixtures, dict):
+            if name in self.fixtures:
+                return self.fixtures[name]
+        else:
+            try:
+                with open(os.path.join(self.fixtures, name + ".json")) as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                pass
+        # Stable across requests and runs, unlike hash()
+        if zlib.crc32(name.encode()) % 10000 < self.not_found_rate * 10000:
+            return None
+        return {
+            "info": {
+                "name": name.title(),
+                "version": "1.0",
+                "package_url": "https://pypi.org/project/" + name,
+                "requires_dist": None,
+                "description": "x" * self.description_size,
+            },
+        }
+
+    def _record(self, status=None, sent=0, connection=False):
+        with self._lock:
+            if status is not None:
+                self.statuses.append(status)
+            self.bytes_sent += sent
+            self.connections += connection
+
+    def _fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _make_handler(self):
+        stub = self
+
+        class CountingWriter(object):
+            def __init__(self, wfile):
+                self.wfile = wfile
+
+            def write(self, data):
+                stub._record(sent=len(data))
+                return self.wfile.write(data)
+
+            def __getattr__(self, name):
+                return getattr(self.wfile, name)
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open like PyPI does, so pooling is visible
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                stub._record(connection=True)
+                self.wfile = CountingWriter(self.wfile)
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                name = parts[-2] if len(parts) >= 2 and parts[-1] == "json" else None
+                time.sleep(stub.slow.get(name, stub.latency))
+
+                if stub._fail():
+                    self._send(503)
+                    return
+                document = stub.document(name) if name else None
+                if document is None:
+                    self._send(404)
+                    return
+                body = json.dumps(document).encode()
+                etag = '"{0:08x}"'.format(zlib.crc32(body))
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, headers={"ETag": etag})
+                    return
+                self._send(200, body, {"Content-Type": "application/json", "ETag": etag})
+
+            def _send(self, status, body=b"", headers=None):
+                stub._record(status=status)
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                if status != 304:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8080,
+                        help="port to listen on (default: 8080)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds every response is delayed (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests failing with a 503 (default: 0)")
+    parser.add_argument("--not-found-rate", type=float, default=0.0,
+                        help="fraction of names that do not exist (default: 0)")
+    parser.add_argument("--fixtures", metavar="DIR",
+                        help="directory of <name>.json documents")
+    args = parser.parse_args()
+
+    server = StubPyPIServer(
+        latency=args.latency, error_rate=args.error_rate,
+        not_found_rate=args.not_found_rate, fixtures=args.fixtures, port=args.port)
+    print(f"serving on {server.url}, press Ctrl+C to stop")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+        print(f"{server.requests} requests, {server.connections} connections, "
+              f"{server.bytes_sent} bytes sent")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,16 +9,30 @@ Tests for `mod2pip` module.
 """
 
 from io import StringIO
+import json
 import logging
+import time
 from unittest.mock import patch, Mock
 import unittest
 import os
+import pstats
 import requests
+import shutil
+import sqlite3
+import subprocess
 import sys
+import tempfile
+import tracemalloc
 import warnings
 
 from mod2pip import mod2pip
 
+try:
+    from .pypi_stub import StubPyPIServer
+except ImportError:
+    # Imported as a top level module by "unittest discover -s tests"
+    from pypi_stub import StubPyPIServer
+
 
 class TestMod2pip(unittest.TestCase):
 
@@ -30,6 +44,12 @@ class TestMod2pip(unittest.TestCase):
         # Specific warning not covered by the above command:
         warnings.filterwarnings("ignore", category=DeprecationWarning, module="jupyter_client")
 
+        # Keep the scan and PyPI caches of the CLI runs out of the user's home
+        cls.cache_home = tempfile.mkdtemp()
+        cls.cache_home_patch = patch(
+            "mod2pip.mod2pip._user_cache_dir", return_value=cls.cache_home)
+        cls.cache_home_patch.start()
+
         cls.modules = [
             "flask",
             "requests",
@@ -93,6 +113,11 @@ class TestMod2pip(unittest.TestCase):
         cls.notebook_path_same_imports = os.path.join(
             os.path.dirname(__file__), "_data_notebook/test.ipynb")
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_home_patch.stop()
+        shutil.rmtree(cls.cache_home, ignore_errors=True)
+
     def test_get_all_imports(self):
         imports = mod2pip.get_all_imports(self.project)
         self.assertEqual(len(imports), 15)
@@ -105,6 +130,369 @@ class TestMod2pip(unittest.TestCase):
         self.assertFalse("django" in imports)
         self.assertFalse("models" in imports)
 
+    def test_get_all_imports_parallel(self):
+        """
+        Test that scanning with a process pool returns the same imports
+        as the serial scan
+        """
+        serial = mod2pip.get_all_imports(self.project)
+        parallel = mod2pip.get_all_imports(self.project, jobs=2, chunk_size=1)
+        self.assertEqual(serial, parallel)
+
+    def test_iter_imports(self):
+        """
+        Test that iter_imports yields the imports and errors of every file
+        and can be stopped early
+        """
+        with tempfile.TemporaryDirectory() as project:
+            files = {
+                "app.py": "import os\nfrom google.cloud import storage\n",
+                "legacy.py": "import docopt\nprint 'python 2'\n",
+                "broken.py": b"import flask\n\xff\n",
+            }
+            for name, contents in files.items():
+                with open(os.path.join(project, name), "wb") as f:
+                    f.write(contents if isinstance(contents, bytes) else contents.encode())
+
+            results = {
+                os.path.basename(file_name): (imports, errors)
+                for file_name, imports, errors in mod2pip.iter_imports(project)
+            }
+            self.assertEqual(
+                results["app.py"],
+                ({"os", "google.cloud", "google.cloud.storage"}, []))
+            self.assertEqual(results["legacy.py"][0], {"docopt"})
+            self.assertIsInstance(results["legacy.py"][1][0], SyntaxError)
+            self.assertEqual(results["broken.py"][0], set())
+            self.assertIsInstance(results["broken.py"][1][0], UnicodeDecodeError)
+
+            for name in ["other.py", "more.py"]:
+                with open(os.path.join(project, name), "w") as f:
+                    f.write("import requests\n")
+            imports = mod2pip.iter_imports(project, jobs=2, chunk_size=1)
+            next(imports)
+            imports.close()
+
+            os.remove(os.path.join(project, "broken.py"))
+            self.assertEqual(
+                mod2pip.get_all_imports(project, jobs=2, chunk_size=1),
+                ["docopt", "google", "requests"])
+
+    def test_get_all_imports_cache(self):
+        """
+        Test that unchanged files are served from the scan cache and that
+        modified files are scanned again
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            project = os.path.join(tmp, "project")
+            cache_dir = os.path.join(tmp, "cache")
+            os.mkdir(project)
+            source = os.path.join(project, "app.py")
+            with open(source, "w") as f:
+                f.write("import requests\n")
+
+            first = mod2pip.get_all_imports(project, cache_dir=cache_dir)
+            with patch("mod2pip.mod2pip._get_static_imports") as static_mock:
+                second = mod2pip.get_all_imports(project, cache_dir=cache_dir)
+                static_mock.assert_not_called()
+            self.assertEqual(first, ["requests"])
+            self.assertEqual(first, second)
+
+            with open(source, "w") as f:
+                f.write("import flask\n")
+            os.utime(source, ns=(0, 0))
+            self.assertEqual(
+                mod2pip.get_all_imports(project, cache_dir=cache_dir), ["flask"])
+
+    def test_scan_cache_locked(self):
+        """
+        Test that the scan cache hashes the bytes it scanned and that a
+        cache locked by another run does not stop the scan
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            project = os.path.join(tmp, "project")
+            cache_dir = os.path.join(tmp, "cache")
+            os.mkdir(project)
+            for i in range(3):
+                with open(os.path.join(project, f"app{i}.py"), "w") as f:
+                    f.write("import requests\n")
+
+            with patch("mod2pip.mod2pip._file_digest") as digest_mock:
+                self.assertEqual(
+                    mod2pip.get_all_imports(project, cache_dir=cache_dir), ["requests"])
+                digest_mock.assert_not_called()
+            # Touched files are served from the hash taken during the scan
+            for i in range(3):
+                os.utime(os.path.join(project, f"app{i}.py"), ns=(0, 0))
+            with patch("mod2pip.mod2pip._get_static_imports") as static_mock:
+                mod2pip.get_all_imports(project, cache_dir=cache_dir)
+                static_mock.assert_not_called()
+
+            with open(os.path.join(project, "app0.py"), "w") as f:
+                f.write("import flask\n")
+            other = sqlite3.connect(
+                os.path.join(cache_dir, mod2pip.ScanCache.filename), isolation_level=None)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                with patch.object(mod2pip.ScanCache, "timeout", 0.01), \
+                        patch.object(mod2pip.ScanCache, "batch_size", 1), \
+                        patch("mod2pip.mod2pip.logging.warning") as warning_mock:
+                    imports = mod2pip.get_all_imports(project, cache_dir=cache_dir)
+                self.assertEqual(imports, ["flask", "requests"])
+                self.assertEqual(warning_mock.call_count, 1)
+            finally:
+                other.close()
+
+    def test_ignore_files(self):
+        """
+        Test that both scanners leave out the same directories and the paths
+        matched by .gitignore and .mod2pipignore patterns
+        """
+        with tempfile.TemporaryDirectory() as project:
+            files = {
+                "app.py": "import requests\nos.getenv('APP_ENV')\n",
+                "node_modules/pkg/tool.py": "import leftpad\n",
+                "build/lib/app.py": "import built\nos.getenv('BUILD_ENV')\n",
+                "generated/models.py": "import generated_dep\n",
+                "vendor/lib.py": "import vendored\nos.getenv('VENDOR_ENV')\n",
+                "sub/skip.py": "import skipped\n",
+                "sub/keep.py": "import kept\nos.getenv('KEPT_ENV')\n",
+                ".gitignore": "# build output\ngenerated/\n[z-a]\n",
+                ".mod2pipignore": "/vendor/\n",
+                "sub/.gitignore": "*.py\n!keep.py\n",
+            }
+            for name, contents in files.items():
+                os.makedirs(os.path.dirname(os.path.join(project, name)), exist_ok=True)
+                with open(os.path.join(project, name), "w") as f:
+                    f.write(contents)
+
+            profile = mod2pip.Profile()
+            previous = mod2pip._set_profile(profile)
+            try:
+                imports = mod2pip.get_all_imports(project)
+            finally:
+                mod2pip._set_profile(previous)
+            self.assertEqual(imports, ["kept", "requests"])
+            self.assertEqual(profile.counters["ignored_dirs"], 4)
+            self.assertEqual(profile.counters["ignored_files"], 1)
+            self.assertEqual(mod2pip.get_all_imports(project, files=list(files)), imports)
+            self.assertEqual(
+                sorted(mod2pip.scan_for_env_variables(project)), ["APP_ENV", "KEPT_ENV"])
+
+            rules = mod2pip.IgnoreRules(rules=[
+                mod2pip._ignore_pattern_regex(pattern, "src") for pattern in
+                ["*.log", "!keep.log", "/top.py", "docs/", "**/gen/*.py", "data/**",
+                 "tmp[[:space:]]*.txt", "[!a-z].c"]
+            ])
+            for name, is_dir, ignored in [
+                ("src/a.log", False, True),
+                ("src/x/keep.log", False, False),
+                ("src/top.py", False, True),
+                ("src/x/top.py", False, False),
+                ("src/x/docs", True, True),
+                ("src/docs", False, False),
+                ("src/a/b/gen/g.py", False, True),
+                ("src/data", True, False),
+                ("src/data/d.py", False, True),
+                ("a.log", False, False),
+                ("src/tmp file.txt", False, True),
+                ("src/tmp:file.txt", False, False),
+                ("src/1.c", False, True),
+                ("src/b.c", False, False),
+            ]:
+                self.assertEqual(rules.ignored(name, is_dir), ignored, name)
+
+            # Patterns git can not parse are left out, as git does
+            self.assertIsNone(mod2pip._ignore_pattern_regex("[z-a]"))
+            self.assertIsNone(mod2pip._ignore_pattern_regex("[[:nope:]]"))
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "symbolic links are not supported")
+    def test_walk_links_once(self):
+        """
+        Test that the walk does not follow symbolic link loops and scans a
+        file reached through several links once
+        """
+        with tempfile.TemporaryDirectory() as project:
+            os.makedirs(os.path.join(project, "app"))
+            os.makedirs(os.path.join(project, "libs"))
+            with open(os.path.join(project, "app", "main.py"), "w") as f:
+                f.write("import requests\n")
+            with open(os.path.join(project, "libs", "util.py"), "w") as f:
+                f.write("import flask\n")
+            try:
+                os.symlink(os.path.join(project, "app"), os.path.join(project, "app_link"))
+                os.symlink(project, os.path.join(project, "libs", "loop"))
+                os.symlink(os.path.join(project, "app", "main.py"),
+                           os.path.join(project, "libs", "main_link.py"))
+            except OSError:
+                self.skipTest("symbolic links can not be created")
+            os.link(os.path.join(project, "libs", "util.py"),
+                    os.path.join(project, "libs", "util_copy.py"))
+
+            profile = mod2pip.Profile()
+            previous = mod2pip._set_profile(profile)
+            try:
+                with patch("mod2pip.mod2pip._scan_file", wraps=mod2pip._scan_file) as scan_mock:
+                    imports = mod2pip.get_all_imports(project)
+            finally:
+                mod2pip._set_profile(previous)
+            self.assertEqual(imports, ["flask", "requests"])
+            self.assertEqual(scan_mock.call_count, 2)
+            self.assertEqual(profile.counters["duplicate_dirs"], 2)
+            self.assertEqual(profile.counters["duplicate_files"], 2)
+
+    @unittest.skipUnless(shutil.which("git"), "git is not installed")
+    def test_get_all_imports_changed_since(self):
+        """
+        Test that scanning only the files changed since a git reference
+        returns the same imports as a full scan
+        """
+        with tempfile.TemporaryDirectory() as project:
+            cache_dir = os.path.join(project, ".mod2pip_cache")
+            git = ["git", "-C", project, "-c", "user.name=test", "-c", "user.email=test@test"]
+
+            def write(name, contents):
+                os.makedirs(os.path.dirname(os.path.join(project, name)), exist_ok=True)
+                with open(os.path.join(project, name), "w") as f:
+                    f.write(contents)
+
+            def scan(ref):
+                with patch("mod2pip.mod2pip._scan_file", wraps=mod2pip._scan_file) as scan_mock:
+                    imports = mod2pip.get_all_imports(
+                        project, cache_dir=cache_dir, changed_since=ref)
+                self.assertEqual(imports, mod2pip.get_all_imports(project))
+                scanned = {os.path.relpath(call.args[0], project)
+                           for call in scan_mock.call_args_list}
+                return imports, scanned
+
+            write("app.py", "import requests\nimport utils\n")
+            write("utils.py", "import flask\n")
+            write("pkg/models.py", "import sqlalchemy\n")
+            write("pkg/venv/site.py", "import ignored\n")
+            subprocess.run(git + ["init", "-q"], check=True)
+            subprocess.run(git + ["add", "-A"], check=True)
+            subprocess.run(git + ["commit", "-q", "-m", "first"], check=True)
+
+            # The first scan has no baseline and records one for HEAD
+            self.assertEqual(scan("HEAD")[0], ["flask", "requests", "sqlalchemy"])
+            self.assertEqual(scan("HEAD")[1], set())
+
+            # Changes are picked up without being committed
+            write("utils.py", "import django\n")
+            write("new.py", "import boto\n")
+            os.remove(os.path.join(project, "pkg", "models.py"))
+            self.assertEqual(scan("HEAD"), (["boto", "django", "requests"], {"new.py", "utils.py"}))
+
+            subprocess.run(git + ["add", "-A"], check=True)
+            subprocess.run(git + ["commit", "-q", "-m", "second"], check=True)
+            self.assertEqual(scan("HEAD~1")[0], ["boto", "django", "requests"])
+            self.assertEqual(scan("HEAD")[0], ["boto", "django", "requests"])
+
+            with self.assertRaises(ValueError):
+                mod2pip.get_all_imports(project, changed_since="no-such-ref")
+
+    def test_get_all_imports_files_from(self):
+        """
+        Test that scanning a list of files returns the same results as
+        walking the tree, local modules included
+        """
+        files = [
+            os.path.relpath(os.path.join(root, name), self.project)
+            for root, _, names in os.walk(self.project) for name in names
+        ]
+        with patch("os.walk") as walk_mock:
+            imports = mod2pip.get_all_imports(self.project, files=files + ["deleted.py"])
+            env_vars = mod2pip.scan_for_env_variables(self.project, files=files)
+            walk_mock.assert_not_called()
+        self.assertEqual(imports, mod2pip.get_all_imports(self.project))
+        self.assertEqual(env_vars, mod2pip.scan_for_env_variables(self.project))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            list_file = os.path.join(tmp, "files")
+            for separator in ["\n", "\0"]:
+                with open(list_file, "w") as f:
+                    f.write(separator.join(["app.py", "pkg/models.py", ""]))
+                self.assertEqual(mod2pip.read_file_list(list_file), ["app.py", "pkg/models.py"])
+            with patch("sys.stdin", StringIO("app.py\n\n")):
+                self.assertEqual(mod2pip.read_file_list("-"), ["app.py"])
+
+            with open(os.path.join(tmp, "settings.py"), "w") as f:
+                f.write("import os\nDEBUG = os.getenv('DEBUG')\n")
+            env_vars = mod2pip.scan_for_env_variables(tmp, files=[os.path.join(tmp, "settings.py")])
+            self.assertEqual(env_vars["DEBUG"]["locations"][0]["file"], "settings.py")
+
+    def test_scan_for_env_variables_cache(self):
+        """
+        Test that env var findings are the same with and without the cache
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = os.path.join(tmp, ".mod2pip_cache")
+            with open(os.path.join(tmp, "settings.py"), "w") as f:
+                f.write("import os\nDEBUG = os.getenv('DEBUG', 'False')\n")
+
+            uncached = mod2pip.scan_for_env_variables(tmp)
+            first = mod2pip.scan_for_env_variables(tmp, cache_dir=cache_dir)
+            with patch("mod2pip.mod2pip._scan_file_env_variables") as scan_mock:
+                second = mod2pip.scan_for_env_variables(tmp, cache_dir=cache_dir)
+                scan_mock.assert_not_called()
+            self.assertEqual(uncached, first)
+            self.assertEqual(uncached, second)
+            self.assertEqual(second["DEBUG"]["default"], "False")
+
+    def test_get_dynamic_imports(self):
+        """
+        Test that dynamic imports are found, including constant folded
+        module names and sources passed to exec()
+        """
+        contents = "\n".join([
+            "import importlib",
+            "name = 'requests'",
+            "__import__(name)",
+            "importlib.import_module('yaml' + '.loader')",
+            "importlib.import_module('.relative', 'pkg')",
+            "base = 'sci'",
+            "importlib.import_module(f'{base}py')",
+            "exec('import numpy as np')",
+            "options = {'key': 'flask'}",
+        ])
+        self.assertEqual(
+            mod2pip._get_dynamic_imports(contents),
+            {"requests", "yaml.loader", "scipy", "numpy"},
+        )
+        self.assertEqual(mod2pip._get_static_imports(contents), {"importlib"})
+
+    def test_lazy_imports(self):
+        """
+        Test that importing mod2pip does not import the dependencies that
+        only some code paths need
+        """
+        code = (
+            "import sys, mod2pip.mod2pip; "
+            "print(sorted(m for m in ('requests', 'docopt', 'nbconvert') if m in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_tables_loaded_once(self):
+        """
+        Test that the stdlib and mapping tables are read once and frozen
+        """
+        stdlib = mod2pip._get_stdlib_modules()
+        self.assertIsInstance(stdlib, frozenset)
+        self.assertIn("os", stdlib)
+        self.assertIn("tomllib", stdlib)
+        self.assertNotIn("", stdlib)
+        mapping = mod2pip._get_import_mapping()
+        with self.assertRaises(TypeError):
+            mapping["sklearn"] = "other"
+        with patch("mod2pip.mod2pip.open") as mock_open:
+            self.assertEqual(mod2pip.get_pkg_names(["sklearn"]), ["scikit_learn"])
+            self.assertIs(mod2pip._get_stdlib_modules(), stdlib)
+        mock_open.assert_not_called()
+
     def test_deduplicate_dependencies(self):
         imports = mod2pip.get_all_imports(self.project_with_duplicated_deps)
         pkgs = mod2pip.get_pkg_names(imports)
@@ -141,6 +529,157 @@ class TestMod2pip(unittest.TestCase):
                 "Import item appears to be missing " + item["name"],
             )
 
+    def test_get_imports_info_concurrent(self):
+        """
+        Test that PyPI lookups run concurrently, keep the order of the
+        imports and skip packages that do not exist
+        """
+        names = ["zeta", "alpha", "missing", "mid", "beta", "gamma"]
+        with StubPyPIServer(latency=0.3, missing=["missing"]) as server:
+            start = time.perf_counter()
+            with_info = mod2pip.get_imports_info(names, pypi_server=server.url)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(
+            with_info,
+            [{"name": name.title(), "version": "1.0"} for name in names if name != "missing"],
+        )
+        # Serial lookups would take at least 6 * 0.3 seconds.
+        self.assertLess(elapsed, 1.2)
+
+    def test_scanner_resolver(self):
+        """
+        Test that a Scanner and a Resolver can be shared by concurrent
+        scans and reuse their environment index and HTTP session
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        index = mod2pip.EnvironmentIndex([
+            {"name": "requests", "version": "2.0", "exports": ["requests"]},
+        ])
+        scanner = mod2pip.Scanner(cache=True)
+        with tempfile.TemporaryDirectory() as tmp, \
+                StubPyPIServer(missing=["missing"]) as server:
+            projects = []
+            for i in range(8):
+                project = os.path.join(tmp, f"project{i}")
+                os.mkdir(project)
+                with open(os.path.join(project, "app.py"), "w") as f:
+                    f.write(f"import requests\nimport flask\nimport package{i}\n")
+                projects.append(project)
+
+            with mod2pip.Resolver(pypi_server=server.url, index=index) as resolver:
+                def analyse(project):
+                    return resolver.resolve(scanner.get_all_imports(project, full_names=True))
+
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    results = list(executor.map(analyse, projects))
+                session = resolver._session
+                self.assertIs(resolver.session, session)
+            self.assertIsNone(resolver._session)
+            self.assertTrue(os.path.isdir(mod2pip._scan_cache_dir(projects[0])))
+            self.assertEqual(os.listdir(projects[0]), ["app.py"])
+
+        for i, packages in enumerate(results):
+            self.assertEqual(
+                [(package["name"], package["version"]) for package in packages],
+                [("requests", "2.0"), ("Flask", "1.0"), (f"Package{i}", "1.0")],
+            )
+
+    def test_get_imports_info_timeouts(self):
+        """
+        Test that slow PyPI lookups are abandoned after the total timeout
+        """
+        sessions = []
+
+        def new_session(pool_size):
+            session = requests.Session()
+            session.close = Mock(wraps=session.close)
+            sessions.append(session)
+            return session
+
+        with StubPyPIServer(latency=0.1, slow={"slow": 1}) as server:
+            with patch("mod2pip.mod2pip._new_session", side_effect=new_session):
+                with_info = mod2pip.get_imports_info(
+                    ["slow", "fast"], pypi_server=server.url, total_timeout=0.5)
+            # The abandoned lookup still uses the session
+            sessions[0].close.assert_not_called()
+            deadline = time.monotonic() + 5
+            while not sessions[0].close.called and time.monotonic() < deadline:
+                time.sleep(0.05)
+            sessions[0].close.assert_called_once_with()
+            with_info_per_request = mod2pip.get_imports_info(
+                ["slow", "fast"], pypi_server=server.url, timeout=0.5)
+        self.assertEqual(with_info, [{"name": "Fast", "version": "1.0"}])
+        self.assertEqual(with_info_per_request, [{"name": "Fast", "version": "1.0"}])
+
+    def test_pypi_cache(self):
+        """
+        Test that PyPI metadata, including unknown packages, is served from
+        the cache and revalidated with the ETag once expired
+        """
+        names = ["alpha", "missing"]
+        expected = [{"name": "Alpha", "version": "1.0"}]
+        with tempfile.TemporaryDirectory() as tmp, StubPyPIServer(missing=["missing"]) as server:
+            cache = mod2pip.PyPICache(tmp)
+            self.assertEqual(
+                mod2pip.get_imports_info(names, pypi_server=server.url, cache=cache), expected)
+            self.assertEqual(
+                mod2pip.get_imports_info(names, pypi_server=server.url, cache=cache), expected)
+            self.assertEqual(sorted(server.statuses), [200, 404])
+            cache.close()
+
+            cache = mod2pip.PyPICache(tmp, ttl=0, max_entries=1)
+            self.assertEqual(
+                mod2pip.get_imports_info(["alpha"], pypi_server=server.url, cache=cache),
+                expected)
+            self.assertEqual(sorted(server.statuses), [200, 304, 404])
+            cache.close()
+
+            cache = mod2pip.PyPICache(tmp)
+            self.assertIsNone(cache.get(server.url, "missing"))
+            self.assertEqual(cache.get(server.url, "alpha")["data"]["version"], "1.0")
+            cache.close()
+
+    def test_pypi_cache_shared(self):
+        """
+        Test that runs sharing the PyPI cache do not wait for each other
+        and that a locked cache does not stop the lookups
+        """
+        with tempfile.TemporaryDirectory() as tmp, \
+                StubPyPIServer() as server, \
+                patch.object(mod2pip.PyPICache, "timeout", 0.1):
+            first = mod2pip.PyPICache(tmp)
+            second = mod2pip.PyPICache(tmp)
+            self.assertEqual(
+                mod2pip.get_imports_info(["alpha"], pypi_server=server.url, cache=first),
+                [{"name": "Alpha", "version": "1.0"}])
+            self.assertEqual(first.get(server.url, "alpha")["data"]["name"], "Alpha")
+            self.assertEqual(
+                mod2pip.get_imports_info(["alpha", "beta"], pypi_server=server.url,
+                                         cache=second),
+                [{"name": "Alpha", "version": "1.0"}, {"name": "Beta", "version": "1.0"}])
+            self.assertEqual(len(server.statuses), 2)
+            first.close()
+            second.close()
+
+            cache = mod2pip.PyPICache(tmp)
+            other = sqlite3.connect(os.path.join(tmp, cache.filename), isolation_level=None)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                with patch("mod2pip.mod2pip.logging.warning") as warning_mock:
+                    self.assertEqual(
+                        mod2pip.get_imports_info(["gamma", "delta"], pypi_server=server.url,
+                                                 cache=cache, max_workers=1),
+                        [{"name": "Gamma", "version": "1.0"},
+                         {"name": "Delta", "version": "1.0"}])
+                    cache.close()
+                messages = [call.args[0] for call in warning_mock.call_args_list]
+                self.assertEqual(
+                    sum(message.startswith("PyPI cache") for message in messages), 1)
+            finally:
+                other.close()
+
     def test_get_pkg_names(self):
         pkgs = ["jury", "Japan", "camel", "Caroline"]
         actual_output = mod2pip.get_pkg_names(pkgs)
@@ -168,6 +707,202 @@ class TestMod2pip(unittest.TestCase):
                 self.assertTrue(expected_local in found_names,
                                 f"Expected local package {expected_local} not found")
 
+    def test_get_pip_packages(self):
+        """
+        Test that distributions are found from the top level of a site
+        directory, with exports read from top_level.txt or RECORD
+        """
+        with tempfile.TemporaryDirectory() as site:
+            dist_info = os.path.join(site, "attrs-23.1.0.dist-info")
+            os.makedirs(os.path.join(dist_info, "licenses"))
+            with open(os.path.join(dist_info, "RECORD"), "w") as f:
+                f.write("attr/__init__.py,sha256=x,10\n"
+                        "attrs/__init__.py,sha256=x,10\n"
+                        "attrs-23.1.0.dist-info/METADATA,,\n"
+                        "six.py,,\n")
+            egg_info = os.path.join(site, "flask.egg-info")
+            os.makedirs(egg_info)
+            with open(os.path.join(egg_info, "top_level.txt"), "w") as f:
+                f.write("flask\n")
+            with open(os.path.join(egg_info, "PKG-INFO"), "w") as f:
+                f.write("Name: flask\nVersion: 2.0.1\n\nVersion: 0\n")
+            # Nested metadata directories are not importable distributions
+            os.makedirs(os.path.join(site, "pkg", "vendored-1.0.dist-info"))
+
+            packages = mod2pip._get_pip_packages(paths=[site, site])
+
+        self.assertEqual(packages, [
+            {"name": "attrs", "version": "23.1.0", "exports": ["attr", "attrs", "six"],
+             "modules": ["attr", "attrs", "six"]},
+            {"name": "flask", "version": "2.0.1", "exports": ["flask"],
+             "modules": ["flask"]},
+        ])
+
+    def test_records(self):
+        """
+        Test that distribution and requirement records are slotted and
+        behave like the dicts they replace
+        """
+        package = mod2pip.Distribution("google_cloud_storage", "2.0", ["google"],
+                                       ["google.cloud.storage"])
+        self.assertFalse(hasattr(package, "__dict__"))
+        self.assertEqual(package.exports, ("google",))
+        self.assertEqual(package["exports"], ["google"])
+        self.assertEqual(dict(package), {
+            "name": "google_cloud_storage", "version": "2.0",
+            "exports": ["google"], "modules": ["google.cloud.storage"]})
+        self.assertIs(package.name, sys.intern("google_cloud_storage"))
+        with self.assertRaises(KeyError):
+            package["missing"]
+        with self.assertRaises(TypeError):
+            package["version"] = "3.0"
+
+        plain = mod2pip.Distribution("six", "1.16", ["six"])
+        self.assertIs(plain.modules, plain.exports)
+        self.assertEqual(mod2pip.Distribution.from_mapping(
+            {"name": "six", "version": "1.16", "exports": ["six"]}), plain)
+
+        requirement = mod2pip.Requirement("flask", "2.0")
+        self.assertEqual(requirement, {"name": "flask", "version": "2.0"})
+        self.assertEqual(requirement.get("version"), "2.0")
+        self.assertEqual("{name}=={version}".format(**requirement), "flask==2.0")
+        self.assertEqual(repr(requirement), "Requirement(name='flask', version='2.0')")
+
+    def test_namespace_package_names(self):
+        """
+        Test that dotted imports resolve to the distribution installing the
+        longest matching namespace package, from RECORD or the mapping file
+        """
+        with tempfile.TemporaryDirectory() as site:
+            for dist, package in [("google_cloud_storage-2.0", "cloud/storage"),
+                                  ("protobuf-4.0", "protobuf")]:
+                dist_info = os.path.join(site, dist + ".dist-info")
+                os.makedirs(dist_info)
+                os.makedirs(os.path.join(site, "google", package))
+                with open(os.path.join(dist_info, "top_level.txt"), "w") as f:
+                    f.write("google\n")
+                with open(os.path.join(dist_info, "RECORD"), "w") as f:
+                    f.write(f"google/{package}/__init__.py,,\n"
+                            f"google/{package}/sub/__init__.py,,\n"
+                            f"{dist}.dist-info/RECORD,,\n")
+            # The site directory is listed once for packages and metadata
+            with patch("mod2pip.mod2pip._iter_metadata_dirs",
+                       wraps=mod2pip._iter_metadata_dirs) as listing_mock:
+                index = mod2pip.EnvironmentIndex.from_environment(paths=[site])
+            listing_mock.assert_called_once()
+            self.assertEqual(index.metadata_dirs, mod2pip._get_metadata_dirs([site]))
+
+        with tempfile.TemporaryDirectory() as project:
+            with open(os.path.join(project, "app.py"), "w") as f:
+                f.write("from google.cloud import storage\nimport os.path\n")
+            self.assertEqual(mod2pip.get_all_imports(project, full_names=True),
+                             ["google.cloud", "google.cloud.storage"])
+            self.assertEqual(mod2pip.get_all_imports(project), ["google"])
+
+            # The "from" module is not resolved on its own to a shorter match
+            with open(os.path.join(project, "app.py"), "a") as f:
+                f.write("from azure.storage import blob\n")
+            imports = mod2pip.get_all_imports(project, full_names=True)
+            for packages in [mod2pip.get_pkg_names(imports),
+                             mod2pip.get_pkg_names(imports, index=index)]:
+                self.assertEqual(packages, ["azure_storage_blob", "google_cloud_storage"])
+
+        self.assertEqual(
+            index.modules.match("google.protobuf.message")[0], 2)
+        self.assertEqual(
+            mod2pip.get_pkg_names(
+                ["google.cloud.storage.blob", "google.protobuf"], index=index),
+            ["google_cloud_storage", "protobuf"])
+        # Without the environment the mapping file is used
+        self.assertEqual(
+            mod2pip.get_pkg_names(["sklearn.linear_model", "unknown.sub"]),
+            ["scikit_learn", "unknown"])
+
+    def test_read_metadata(self):
+        """
+        Test that only the header block of a METADATA file is parsed
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            metadata_path = os.path.join(tmp, "METADATA")
+            with open(metadata_path, "w") as f:
+                f.write("Metadata-Version: 2.1\n"
+                        "Name: demo\n"
+                        "Version: 1.2\n"
+                        "Summary: A summary\n"
+                        "  continued on the next line\n"
+                        "Requires-Dist: idna (>=2.5)\n"
+                        "Requires-Dist: pytest ;\n"
+                        "        extra == 'test'\n"
+                        "Provides-Extra: test\n"
+                        "\n"
+                        "Version: 0\n"
+                        "Requires-Dist: readme\n")
+
+            metadata = mod2pip._read_metadata(metadata_path)
+
+        self.assertEqual(metadata, mod2pip.Metadata(
+            "demo", "1.2", ["idna (>=2.5)", "pytest ; extra == 'test'"], ["test"]))
+        self.assertIsNone(mod2pip._read_metadata(metadata_path))
+
+    def test_get_import_local_index(self):
+        """
+        Test that imports are matched through the export and normalized
+        name index and that duplicates are removed
+        """
+        index = mod2pip.EnvironmentIndex([
+            {"name": "PyYAML", "version": "6.0", "exports": ["_yaml", "yaml"]},
+            {"name": "beautifulsoup4", "version": "4.12", "exports": ["bs4"]},
+            {"name": "typing_extensions", "version": "4.9", "exports": ["typing_extensions"]},
+        ])
+        result = mod2pip.get_import_local(
+            ["yaml", "pyyaml", "bs4", "typing-extensions", "missing"], index=index)
+        self.assertEqual(
+            [package["name"] for package in result],
+            ["PyYAML", "beautifulsoup4", "typing_extensions"],
+        )
+        self.assertIn("Typing.Extensions", index)
+        self.assertNotIn("missing", index)
+
+    def test_get_transitive_dependencies(self):
+        """
+        Test that transitive dependencies are read from the installed
+        metadata, breadth first, without following extras or using PyPI
+        """
+        requires = {
+            "a": ["B>=1.0", "e; extra == 'dev'"],
+            "b": ["c; python_version >= '3'"],
+            "c": ["d"],
+            "d": [],
+        }
+        with tempfile.TemporaryDirectory() as site:
+            for name, deps in requires.items():
+                dist_info = os.path.join(site, f"{name}-1.0.dist-info")
+                os.makedirs(dist_info)
+                with open(os.path.join(dist_info, "METADATA"), "w") as f:
+                    f.write(f"Name: {name}\nVersion: 1.0\n")
+                    f.write("".join(f"Requires-Dist: {dep}\n" for dep in deps))
+            egg_info = os.path.join(site, "f.egg-info")
+            os.makedirs(egg_info)
+            with open(os.path.join(egg_info, "PKG-INFO"), "w") as f:
+                f.write("Name: f\nVersion: 2.0\n")
+            with open(os.path.join(egg_info, "requires.txt"), "w") as f:
+                f.write("a\n\n[test]\ne\n")
+            index = mod2pip.EnvironmentIndex.from_environment(paths=[site])
+
+            with patch("mod2pip.mod2pip._fetch_pypi_metadata") as fetch:
+                two_levels = mod2pip.get_transitive_dependencies(
+                    [{"name": "a", "version": "1.0"}], index=index)
+                all_levels = mod2pip.get_transitive_dependencies(
+                    [{"name": "f", "version": "2.0"}], max_depth=5, index=index)
+                fetch.assert_not_called()
+
+        self.assertEqual(two_levels, [
+            {"name": "B", "version": "1.0"},
+            {"name": "c", "version": "1.0"},
+        ])
+        self.assertEqual(
+            [package["name"] for package in all_levels], ["a", "B", "c", "d"])
+
     def test_init(self):
         """
         Test that all modules we will test upon are in requirements file
@@ -230,6 +965,82 @@ class TestMod2pip(unittest.TestCase):
                                     package_name in ['beautifulsoup4', 'flask-seasurf'],
                                     f"Invalid package name: {package_name}")
 
+    def test_init_profile_report(self):
+        """
+        Test that --profile-report writes stage timings and counters
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            report_path = os.path.join(tmp, "profile.json")
+            with open(os.path.join(tmp, "app.py"), "w") as f:
+                f.write("import requests\n")
+            with open(os.path.join(tmp, "legacy.py"), "w") as f:
+                f.write("import docopt\nprint 'python 2'\n")
+            mod2pip.init(
+                {
+                    "<path>": tmp,
+                    "--savepath": os.path.join(tmp, "requirements.txt"),
+                    "--use-local": True,
+                    "--proxy": None,
+                    "--pypi-server": None,
+                    "--print": False,
+                    "--diff": None,
+                    "--clean": None,
+                    "--mode": None,
+                    "--no-cache": True,
+                    "--profile-report": report_path,
+                }
+            )
+            with open(report_path) as f:
+                report = json.load(f)
+
+        for stage in ["walk", "scan", "environment", "local", "output", "total"]:
+            self.assertIn(stage, report["stages"])
+        self.assertEqual(report["counters"]["files_scanned"], 2)
+        self.assertEqual(report["counters"]["bytes_read"], 47)
+        self.assertEqual(report["counters"]["regex_fallbacks"], 1)
+        self.assertFalse(mod2pip._profile.enabled)
+
+    def test_init_cprofile_trace_memory(self):
+        """
+        Test that --cprofile writes a pstats file per stage and that
+        --trace-memory records the memory of every stage
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            cprofile_dir = os.path.join(tmp, "cprofile")
+            report_path = os.path.join(tmp, "profile.json")
+            mod2pip.init(
+                {
+                    "<path>": self.project,
+                    "--savepath": os.path.join(tmp, "requirements.txt"),
+                    "--use-local": True,
+                    "--proxy": None,
+                    "--pypi-server": None,
+                    "--print": False,
+                    "--diff": None,
+                    "--clean": None,
+                    "--mode": None,
+                    "--no-cache": True,
+                    "--profile-report": report_path,
+                    "--cprofile": cprofile_dir,
+                    "--trace-memory": True,
+                }
+            )
+            with open(report_path) as f:
+                report = json.load(f)
+            stages = ["scan", "mapping", "environment", "local", "output"]
+            self.assertEqual(
+                sorted(os.listdir(cprofile_dir)), sorted(s + ".pstats" for s in stages))
+            stats = pstats.Stats(os.path.join(cprofile_dir, "scan.pstats"))
+            self.assertIn("_scan_file", {func[2] for func in stats.stats})
+            self.assertIn("_walk_source_files", {func[2] for func in stats.stats})
+
+        for stage in stages:
+            self.assertGreater(report["stages"][stage]["memory"]["peak"], 0)
+        # The walk is interleaved with the scan and timed without hooks
+        self.assertNotIn("memory", report["stages"]["walk"])
+        self.assertNotIn("memory", report["stages"]["total"])
+        self.assertFalse(tracemalloc.is_tracing())
+
     def test_init_savepath(self):
         """
         Test that we can save requirements.txt correctly
@@ -600,6 +1411,45 @@ class TestMod2pip(unittest.TestCase):
         notebook_imports = mod2pip.get_all_imports(self.notebook_path_same_imports)
         self.assertEqual(python_imports, notebook_imports)
 
+    def test_read_notebook(self):
+        """
+        Test that the built-in notebook reader finds the imports nbconvert finds
+        """
+        for name in ["test.ipynb", "magic_commands.ipynb", "markdown_test.ipynb"]:
+            file_name = os.path.join(self.project_with_notebooks, name)
+            self.assertEqual(
+                mod2pip._get_imports(mod2pip.read_notebook(file_name)),
+                mod2pip._get_imports(mod2pip.ipynb_2_py(file_name).decode()),
+            )
+
+        source = mod2pip._strip_ipython(
+            "%%time\nimport os\nfiles = !ls\nif files:\n    %matplotlib inline\n"
+            "    !pip install \\\n        requests\nos.path?\nimport sys"
+        )
+        self.assertEqual(
+            source,
+            "\nimport os\nfiles = None\nif files:\n    pass\n    pass\n\npass\nimport sys",
+        )
+        self.assertEqual(mod2pip._strip_ipython("%%bash\nimport os"), "")
+
+        # Lines continuing a statement are Python, not magics
+        source = ("value = (a\n    % b)\ndoc = '''\n!not a shell escape\n'''\n"
+                  "total = 1 + \\\n    2\n!ls\nimport numpy")
+        self.assertEqual(
+            mod2pip._strip_ipython(source), source.replace("\n!ls\n", "\npass\n"))
+
+        # nbformat 3 keeps the cells in worksheets
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = os.path.join(tmp, "old.ipynb")
+            with open(file_name, "w") as f:
+                json.dump({"nbformat": 3, "worksheets": [{"cells": [
+                    {"cell_type": "markdown", "source": ["import nothing"]},
+                    {"cell_type": "code", "input": ["!ls\n", "import requests"]},
+                ]}]}, f)
+            self.assertEqual(
+                mod2pip.get_all_imports(tmp, notebooks=True), ["requests"])
+            self.assertEqual(mod2pip.get_all_imports(tmp, notebooks=False), [])
+
     def test_file_ext_is_allowed(self):
         """
         Test the  function file_ext_is_allowed()